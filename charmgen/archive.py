@@ -0,0 +1,125 @@
+"""
+Reproducible charm archives.
+
+Entries are written in sorted order with fixed timestamps and modes
+taken from the files only, so the same charm always zips to the same
+bytes. Archives are named by the sha256 of those bytes and indexed by
+charm name in the archives dir of a build.
+"""
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import zipfile
+
+ARCHIVES = 'archives'
+INDEX = 'index.json'
+# the earliest date zip can represent
+FIXED_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def _info(name, mode):
+    info = zipfile.ZipInfo(name, FIXED_TIME)
+    info.create_system = 3
+    info.external_attr = (mode & 0xFFFF) << 16
+    return info
+
+
+def write_zip(charm_path, fp):
+    """Zip up charm_path into fp, following symlinks like make_archive."""
+    with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for dirpath, dirnames, filenames in os.walk(charm_path,
+                                                    followlinks=True):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, charm_path)
+            if rel != os.curdir:
+                archive.writestr(_info(rel + '/', stat.S_IFDIR | 0755), '')
+            for name in sorted(filenames):
+                if name.endswith('.pyc'):
+                    continue
+                fn = os.path.join(dirpath, name)
+                mode = 0755 if os.access(fn, os.X_OK) else 0644
+                info = _info(os.path.normpath(os.path.join(rel, name)),
+                             stat.S_IFREG | mode)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(fn, 'rb') as src:
+                    archive.writestr(info, src.read())
+
+
+def archive_digest(archive):
+    return os.path.splitext(os.path.basename(archive))[0]
+
+
+def make_archive(charm_path, archive_dir):
+    """Archive a charm as archive_dir/<sha256>.zip, returning its path."""
+    if not os.path.exists(archive_dir):
+        os.makedirs(archive_dir)
+    fd, tmp = tempfile.mkstemp(dir=archive_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write_zip(charm_path, fp)
+        digest = hashlib.sha256()
+        with open(tmp, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), ''):
+                digest.update(chunk)
+        archive = os.path.join(archive_dir, digest.hexdigest() + '.zip')
+        os.rename(tmp, archive)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    return archive
+
+
+def load_index(build_dir):
+    try:
+        with open(os.path.join(build_dir, ARCHIVES, INDEX)) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_index(build_dir, index):
+    fn = os.path.join(build_dir, ARCHIVES, INDEX)
+    with open(fn + '.tmp', 'w') as fp:
+        json.dump(index, fp, indent=2, sort_keys=True)
+    os.rename(fn + '.tmp', fn)
+
+
+def update_archives(build_dir, series, charm_names, changed=()):
+    """
+    Archive the charms in `changed` and those without an archive yet,
+    dropping archives no charm uses any more. Returns the index.
+    """
+    archive_dir = os.path.join(build_dir, ARCHIVES)
+    index = dict((k, v) for k, v in load_index(build_dir).items()
+                 if k in charm_names)
+    for name in charm_names:
+        archived = index.get(name)
+        if name in changed or not archived or not os.path.exists(
+                os.path.join(archive_dir, archived)):
+            index[name] = os.path.basename(make_archive(
+                os.path.join(build_dir, series, name), archive_dir))
+    if not os.path.exists(archive_dir):
+        os.makedirs(archive_dir)
+    save_index(build_dir, index)
+    used = set(index.values())
+    for name in os.listdir(archive_dir):
+        if name.endswith('.zip') and name not in used:
+            os.unlink(os.path.join(archive_dir, name))
+    return index
+
+
+def charm_archive(build_dir, series, charm_name):
+    """
+    The archive of a generated charm, made on the spot for build dirs
+    from before archives were generated.
+    """
+    index = load_index(build_dir)
+    name = index.get(charm_name)
+    archive_dir = os.path.join(build_dir, ARCHIVES)
+    if name and os.path.exists(os.path.join(archive_dir, name)):
+        return os.path.join(archive_dir, name)
+    return make_archive(os.path.join(build_dir, series, charm_name),
+                        archive_dir)
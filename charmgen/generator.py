@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import argparse
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
 import sys
 import shutil
@@ -9,6 +14,7 @@ import inspect
 
 import pkg_resources
 import yaml
+from concurrent.futures import ProcessPoolExecutor
 
 try:
     from cloudfoundry import contexts
@@ -16,6 +22,93 @@ except ImportError:
     sys.path.append('.')
     from cloudfoundry import contexts
 
+from charmgen import archive
+from charmgen import runtime
+from charmgen.store import ContentStore
+
+
+# trees every managed charm carries, relative to the charm
+SHARED_TREES = [
+    ('../cloudfoundry', 'hooks/cloudfoundry'),
+    ('../files', 'files'),
+    # charmhelpers goes into the hook_dir
+    ('../hooks/charmhelpers', 'hooks/charmhelpers'),
+]
+# what slim charms fetch instead, see charmgen.runtime
+RUNTIME_TREES = [
+    ('../cloudfoundry', 'cloudfoundry'),
+    ('../files', 'files'),
+    ('../hooks/charmhelpers', 'charmhelpers'),
+]
+# input hashes of the charms in a build dir, by charm name
+MANIFEST = 'manifest.json'
+
+
+def _describe(obj):
+    # json stand-ins for the classes, callables and context instances
+    # of service definitions, stable across runs unlike their reprs
+    if inspect.ismethod(obj):
+        return [_describe(obj.im_self or obj.im_class), obj.__name__]
+    if isinstance(obj, functools.partial):
+        return [_describe(obj.func), obj.args, obj.keywords]
+    if inspect.isclass(obj) or inspect.isroutine(obj):
+        return '%s.%s' % (obj.__module__, obj.__name__)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+    if hasattr(obj, '__dict__'):
+        return [_describe(type(obj)), obj.__dict__]
+    return repr(obj)
+
+
+def load_manifest(target_dir):
+    try:
+        with open(os.path.join(target_dir, MANIFEST)) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(target_dir, manifest):
+    fn = os.path.join(target_dir, MANIFEST)
+    with open(fn + '.tmp', 'w') as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True)
+    os.rename(fn + '.tmp', fn)
+
+
+def write_charm(target_dir, meta, hooks, entry, trees=(), store=None):
+    """
+    Write out a charm from its already built parts. Takes plain data
+    only, so it can run in a worker process.
+
+    `trees` are (dest, entries) pairs of ContentStore.add_tree entries,
+    linked in from `store`.
+    """
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    with open(os.path.join(target_dir, 'metadata.yaml'), 'w') as fp:
+        yaml.safe_dump(meta, fp, default_flow_style=False)
+
+    icon = pkg_resources.resource_filename(__name__, '../icon.svg')
+    if store:
+        store.place(store.add(icon), os.path.join(target_dir, 'icon.svg'))
+    else:
+        shutil.copyfile(icon, os.path.join(target_dir, 'icon.svg'))
+
+    hook_dir = os.path.join(target_dir, 'hooks')
+    if not os.path.exists(hook_dir):
+        os.makedirs(hook_dir)
+
+    with open(os.path.join(hook_dir, 'entry.py'), 'w') as target:
+        os.fchmod(target.fileno(), 0755)
+        target.write(entry)
+
+    for hook in hooks:
+        os.symlink('entry.py', os.path.join(hook_dir, hook))
+
+    for dest, entries in trees:
+        store.materialize(entries, os.path.join(target_dir, dest))
+    return target_dir
+
 
 class CharmGenerator(object):
     author = "CloudFoundry Charm Generator <cs:~cf-charmers/cloudfoundry>"
@@ -90,36 +183,44 @@ class CharmGenerator(object):
             results.append('{}-relation-broken'.format(rel))
         return results
 
-    def build_entry(self, service_key):
+    def build_entry(self, service_key, tarball=None):
         _, name, _ = self._parse_charm_ref(service_key)
+        if tarball:
+            return runtime.build_bootstrap(name, tarball)
         return "\n".join([
             '#!/usr/bin/env python2.7',
             'from cloudfoundry.jobs import job_manager',
             'job_manager("{}")'.format(name)
         ])
 
-    def generate_charm(self, service_key, target_dir):
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-        meta = self.build_metadata(service_key)
-        meta_target = open(os.path.join(target_dir, 'metadata.yaml'), 'w')
-        yaml.safe_dump(meta, meta_target, default_flow_style=False)
-        meta_target.close()
+    def build_charm(self, service_key, target_dir, trees=(), store=None,
+                    tarball=None):
+        # write_charm arguments, everything that needs the service
+        # registry is resolved here in the parent process
+        return (target_dir, self.build_metadata(service_key),
+                self.build_hooks(service_key),
+                self.build_entry(service_key, tarball), list(trees), store)
 
-        shutil.copyfile(pkg_resources.resource_filename(__name__, '../icon.svg'),
-                        os.path.join(target_dir, 'icon.svg'))
-
-        hook_dir = os.path.join(target_dir, 'hooks')
-        if not os.path.exists(hook_dir):
-            os.makedirs(hook_dir)
-        entry = os.path.join(target_dir, 'hooks', 'entry.py')
-
-        with open(entry, 'w') as target:
-            os.fchmod(target.fileno(), 0755)
-            target.write(self.build_entry(service_key))
-
-        for hook in self.build_hooks(service_key):
-            os.symlink('entry.py', os.path.join(hook_dir, hook))
+    def generate_charm(self, service_key, target_dir):
+        write_charm(*self.build_charm(service_key, target_dir))
+
+    def charm_hash(self, service_key, trees_hash='', tarball=None):
+        """
+        Hash of everything a managed charm is generated from: its
+        service definition, the release topology, the parts built from
+        those and the shared trees or runtime.
+        """
+        _, name, _ = self._parse_charm_ref(service_key)
+        inputs = {
+            'service': self.service_registry[name],
+            'topology': self.release['topology'],
+            'metadata': self.build_metadata(service_key),
+            'hooks': sorted(self.build_hooks(service_key)),
+            'entry': self.build_entry(service_key, tarball),
+            'trees': trees_hash,
+        }
+        return hashlib.sha256(json.dumps(
+            inputs, sort_keys=True, default=_describe)).hexdigest()
 
     def _build_charm_ref(self, charm_id):
         if charm_id.startswith('cs:'):
@@ -165,7 +266,7 @@ class CharmGenerator(object):
         return charms
 
     def _get_relations(self):
-        relations = self.release['topology'].get('relations', [])
+        relations = list(self.release['topology'].get('relations', []))
         services = {service_name: self.service_registry[charm_name]
                     for _, charm_name, service_name in self._get_managed_charms()}
         provided = {provider.name: service_name
@@ -224,7 +325,25 @@ class CharmGenerator(object):
             yaml.safe_dump(bundle, fp, default_flow_style=False)
             fp.flush()
 
-    def generate(self, target_dir):
+    def generate(self, target_dir, jobs=1, store=None, slim=False):
+        """
+        Generate the bundle and managed charms of the selected release
+        into `target_dir`, writing up to `jobs` charms at a time in
+        worker processes. The output doesn't depend on `jobs`.
+
+        Charms whose inputs hash as recorded in the manifest of a
+        previous run are left alone, the paths of the charms written
+        are returned. Each charm gets a reproducible zip archive, see
+        charmgen.archive.
+
+        The shared trees are linked from the content store at `store`,
+        `target_dir`/.store by default. Releases generated side by side
+        can share one.
+
+        With `slim`, charms get none of the shared trees but a bootstrap
+        fetching them as one runtime tarball, written to the runtime
+        dir of `target_dir` for the orchestrator to serve.
+        """
         # Ensure that both the target dir
         # and its 'trusty' subdir exists
         repo = os.path.join(target_dir, 'trusty')
@@ -232,22 +351,63 @@ class CharmGenerator(object):
             os.makedirs(repo)
         self.generate_deployment(target_dir)
 
+        store = ContentStore(store or os.path.join(target_dir, '.store'))
+        runtime_dir = os.path.join(target_dir, runtime.RUNTIME)
+        if slim:
+            tarball = runtime.make_runtime(
+                [(pkg_resources.resource_filename(__name__, source), dest)
+                 for source, dest in RUNTIME_TREES], runtime_dir)
+            trees = []
+        else:
+            shutil.rmtree(runtime_dir, ignore_errors=True)
+            tarball = None
+            trees = [(dest, store.add_tree(
+                pkg_resources.resource_filename(__name__, source)))
+                for source, dest in SHARED_TREES]
+        # objects are named by content, so are the trees by their entries
+        trees_hash = hashlib.sha256(json.dumps([
+            (dest, [entry[:2] + tuple(os.path.relpath(e, store.root)
+                                      for e in entry[2:])
+                    for entry in entries])
+            for dest, entries in trees])).hexdigest()
+        manifest = load_manifest(target_dir)
+        hashes = {}
+        charms = []
         for _, charm_name, _ in self._get_managed_charms():
             charm_path = os.path.join(repo, charm_name)
-            if not os.path.exists(charm_path):
-                os.makedirs(charm_path)
-
-            self.generate_charm(charm_name, charm_path)
-            shutil.copytree(pkg_resources.resource_filename(
-                __name__, '../cloudfoundry'),
-                os.path.join(charm_path, 'hooks', 'cloudfoundry'))
-            shutil.copytree(pkg_resources.resource_filename(
-                __name__, '../files'),
-                os.path.join(charm_path, 'files'))
-            # copy charmhelpers into the hook_dir
-            shutil.copytree(pkg_resources.resource_filename(
-                __name__, '../hooks/charmhelpers'),
-                os.path.join(charm_path, 'hooks', 'charmhelpers'))
+            hashes[charm_name] = self.charm_hash(charm_name, trees_hash,
+                                                 tarball)
+            if manifest.get(charm_name) == hashes[charm_name] and \
+                    os.path.isdir(charm_path):
+                continue
+            charms.append(self.build_charm(charm_name, charm_path, trees,
+                                           store, tarball))
+        for charm_name in set(manifest) - set(hashes):
+            shutil.rmtree(os.path.join(repo, charm_name), ignore_errors=True)
+
+        # a charm only enters the manifest once completely written
+        changed = [os.path.basename(charm[0]) for charm in charms]
+        current = dict((k, v) for k, v in manifest.items()
+                       if k in hashes and k not in changed)
+        save_manifest(target_dir, current)
+        for charm in charms:
+            charm_path = charm[0]
+            if os.path.exists(charm_path):
+                shutil.rmtree(charm_path)
+        if jobs <= 1 or len(charms) <= 1:
+            written = [write_charm(*charm) for charm in charms]
+        else:
+            with ProcessPoolExecutor(min(jobs, len(charms))) as pool:
+                futures = [pool.submit(write_charm, *charm)
+                           for charm in charms]
+                written = [f.result() for f in futures]
+        save_manifest(target_dir, hashes)
+        # objects the rewritten and removed charms no longer link to
+        store.gc()
+        archive.update_archives(target_dir, 'trusty', sorted(hashes), changed)
+        logging.info("Generated %d of %d charms: %s", len(changed),
+                     len(hashes), ', '.join(changed) or 'none changed')
+        return written
 
 
 def main(args=None):
@@ -257,6 +417,12 @@ def main(args=None):
     parser.add_argument('release', type=int)
     parser.add_argument('-d', '--directory', dest="directory")
     parser.add_argument('-f', '--force', action="store_true")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="charms to generate in parallel, "
+                        "0 for one per CPU")
+    parser.add_argument('--slim', action="store_true",
+                        help="fetch the shared runtime instead of "
+                        "embedding it in every charm")
     options = parser.parse_args(args)
 
     using_default_dir = False
@@ -275,7 +441,9 @@ def main(args=None):
 
     g = CharmGenerator(RELEASES, SERVICES)
     g.select_release(options.release)
-    g.generate(options.directory)
+    g.generate(options.directory,
+               options.jobs or multiprocessing.cpu_count(),
+               slim=options.slim)
 
 if __name__ == '__main__':
     main()
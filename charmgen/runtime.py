@@ -0,0 +1,184 @@
+"""
+Shared runtime of slim charms.
+
+Instead of carrying the cloudfoundry, charmhelpers and files trees,
+slim charms have a bootstrap entry that fetches them as one tarball
+from the orchestrator, which serves it next to the job artifacts
+(see hooks/common.publish_runtime). The tarball is reproducible and
+named by its sha256, which the bootstrap checks before unpacking it
+into a cache shared by the charms on a machine.
+"""
+import gzip
+import hashlib
+import os
+import tarfile
+import tempfile
+
+RUNTIME = 'runtime'
+# where units unpack runtimes, by sha256
+CACHE = '/var/lib/cloudfoundry/runtime'
+
+BOOTSTRAP = '''
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+
+def log(message):
+    subprocess.call(['juju-log', message])
+
+
+def artifacts_url():
+    for rid in subprocess.check_output(
+            ['relation-ids', 'orchestrator']).split():
+        for unit in subprocess.check_output(
+                ['relation-list', '-r', rid]).split():
+            url = subprocess.check_output(
+                ['relation-get', '-r', rid, 'artifacts_url', unit]).strip()
+            if url:
+                return url
+
+
+def fetch():
+    """The unpacked runtime, None until the orchestrator is related."""
+    target = os.path.join(CACHE, SHA256)
+    if os.path.isdir(target):
+        return target
+    url = artifacts_url()
+    if not url:
+        return None
+    if not os.path.isdir(CACHE):
+        os.makedirs(CACHE)
+    tmp = tempfile.mkdtemp(dir=CACHE)
+    try:
+        archive = os.path.join(tmp, TARBALL)
+        url = '/'.join([url.rstrip('/'), 'runtime', TARBALL])
+        log('Downloading runtime from {}'.format(url))
+        subprocess.check_call(['wget', '-t5', '-nv', url, '-O', archive])
+        digest = hashlib.sha256()
+        with open(archive, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), ''):
+                digest.update(chunk)
+        if digest.hexdigest() != SHA256:
+            raise IOError('Checksum mismatch for {}'.format(url))
+        with tarfile.open(archive) as tgz:
+            tgz.extractall(os.path.join(tmp, 'tree'))
+        try:
+            os.rename(os.path.join(tmp, 'tree'), target)
+        except OSError:
+            # another charm on this machine unpacked it first
+            if not os.path.isdir(target):
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return target
+
+
+def main():
+    hook = os.path.basename(sys.argv[0])
+    runtime = fetch()
+    if runtime is None:
+        log('Deferring {} until the orchestrator is related'.format(hook))
+        return
+    os.environ['CF_RUNTIME_DIR'] = runtime
+    sys.path.insert(0, runtime)
+    from cloudfoundry.jobs import job_manager, manage_install
+    marker = os.path.join(os.environ.get('CHARM_DIR', '.'), '.runtime')
+    if hook not in ('install', 'upgrade-charm') and \\
+            not os.path.exists(marker):
+        # install ran before there was a runtime
+        manage_install(NAME)
+    job_manager(NAME)
+    with open(marker, 'w') as fp:
+        fp.write(SHA256)
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+def _info(name, mode, size=0):
+    info = tarfile.TarInfo(name)
+    info.mode = mode
+    info.size = size
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+def write_tarball(trees, fp):
+    """
+    Tar and gzip the (source, dest) trees into fp, with sorted entries
+    and nothing taken from the files but their contents and mode.
+    """
+    # filename and mtime end up in the gzip header
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=fp, mtime=0)
+    try:
+        with tarfile.open(fileobj=gz, mode='w',
+                          format=tarfile.GNU_FORMAT) as tar:
+            for source, dest in trees:
+                for dirpath, dirnames, filenames in os.walk(
+                        source, followlinks=True):
+                    dirnames.sort()
+                    rel = os.path.normpath(os.path.join(
+                        dest, os.path.relpath(dirpath, source)))
+                    info = _info(rel, 0755)
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                    for name in sorted(filenames):
+                        if name.endswith('.pyc'):
+                            continue
+                        fn = os.path.join(dirpath, name)
+                        mode = 0755 if os.access(fn, os.X_OK) else 0644
+                        with open(fn, 'rb') as src:
+                            tar.addfile(_info(
+                                os.path.join(rel, name), mode,
+                                os.fstat(src.fileno()).st_size), src)
+    finally:
+        gz.close()
+
+
+def make_runtime(trees, runtime_dir):
+    """
+    Package the trees as runtime_dir/<sha256>.tgz, removing older
+    runtimes from there. Returns its path.
+    """
+    if not os.path.exists(runtime_dir):
+        os.makedirs(runtime_dir)
+    fd, tmp = tempfile.mkstemp(dir=runtime_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            write_tarball(trees, fp)
+        digest = hashlib.sha256()
+        with open(tmp, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 16), ''):
+                digest.update(chunk)
+        tarball = os.path.join(runtime_dir, digest.hexdigest() + '.tgz')
+        os.rename(tmp, tarball)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    for name in os.listdir(runtime_dir):
+        if name.endswith('.tgz') and name != os.path.basename(tarball):
+            os.unlink(os.path.join(runtime_dir, name))
+    return tarball
+
+
+def build_bootstrap(charm_name, tarball, cache=CACHE):
+    """The entry of a slim charm, running `charm_name` from `tarball`."""
+    name = os.path.basename(tarball)
+    return '\n'.join([
+        '#!/usr/bin/env python2.7',
+        '# generated by charmgen, see charmgen/runtime.py',
+        'NAME = {!r}'.format(charm_name),
+        'TARBALL = {!r}'.format(name),
+        'SHA256 = {!r}'.format(os.path.splitext(name)[0]),
+        'CACHE = {!r}'.format(cache),
+    ]) + BOOTSTRAP
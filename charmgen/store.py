@@ -0,0 +1,144 @@
+"""
+Content addressed file store shared by generated charms.
+
+Every managed charm carries the same cloudfoundry, charmhelpers and
+files trees. Their files are kept once in the store, named by the hash
+of their contents, and charms get hardlinks to them. Where hardlinks
+are not possible (another filesystem, link limits) files are reflinked
+and, failing that too, copied.
+
+Objects no charm links to are removed by gc, going by their link
+counts. Reflinks and copies don't show up in those, so once the store
+had to fall back to them it keeps every object.
+"""
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+
+# linux/fs.h, share the extents of a file on btrfs, xfs, ...
+FICLONE = 0x40049409
+# marks a store that placed files other than by hardlink
+UNLINKED = 'unlinked'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 16), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reflink(source, dest):
+    with open(source, 'rb') as src:
+        with open(dest, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copymode(source, dest)
+
+
+class ContentStore(object):
+    def __init__(self, root):
+        self.root = root
+
+    def object_path(self, digest, executable=False):
+        name = digest[2:] + ('.x' if executable else '')
+        return os.path.join(self.root, digest[:2], name)
+
+    def add(self, path):
+        """Store the file at path unless there already, returns its object."""
+        executable = bool(os.stat(path).st_mode & stat.S_IXUSR)
+        obj = self.object_path(file_hash(path), executable)
+        if not os.path.exists(obj):
+            directory = os.path.dirname(obj)
+            if not os.path.exists(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            # concurrent writers each rename a complete file into place
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            os.close(fd)
+            shutil.copyfile(path, tmp)
+            os.chmod(tmp, 0755 if executable else 0644)
+            os.rename(tmp, obj)
+        return obj
+
+    def add_tree(self, root):
+        """
+        Store the files under root, returning the sorted entries to
+        recreate it from, ('d', relpath) and ('f', relpath, object).
+        Like copytree, symlinks are followed. Compiled python files
+        are left out.
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, root)
+            if rel != os.curdir:
+                entries.append(('d', rel))
+            for name in sorted(filenames):
+                if name.endswith('.pyc'):
+                    continue
+                relpath = os.path.normpath(os.path.join(rel, name))
+                entries.append(
+                    ('f', relpath, self.add(os.path.join(dirpath, name))))
+        return entries
+
+    @property
+    def linked(self):
+        """Whether every file was placed by hardlink."""
+        return not os.path.exists(os.path.join(self.root, UNLINKED))
+
+    def place(self, obj, dest):
+        """Put object at dest, by hardlink, reflink or copy."""
+        try:
+            os.link(obj, dest)
+            return 'link'
+        except OSError:
+            pass
+        if self.linked:
+            open(os.path.join(self.root, UNLINKED), 'w').close()
+        try:
+            reflink(obj, dest)
+            return 'reflink'
+        except (IOError, OSError):
+            if os.path.exists(dest):
+                os.unlink(dest)
+        shutil.copy2(obj, dest)
+        return 'copy'
+
+    def materialize(self, entries, dest):
+        """Recreate a tree stored by add_tree at dest."""
+        if not os.path.exists(dest):
+            os.makedirs(dest)
+        for entry in entries:
+            path = os.path.join(dest, entry[1])
+            if entry[0] == 'd':
+                os.mkdir(path)
+            else:
+                self.place(entry[2], path)
+
+    def gc(self):
+        """Remove the objects no charm links to, returning how many."""
+        removed = 0
+        if not os.path.exists(self.root):
+            return removed
+        if not self.linked:
+            logging.debug("%s has reflinked or copied files, not "
+                          "collecting garbage", self.root)
+            return removed
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                continue
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.stat(path).st_nlink == 1:
+                    os.unlink(path)
+                    removed += 1
+        return removed
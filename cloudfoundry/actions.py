@@ -1,7 +1,15 @@
+import collections
 import datetime
 import logging
+import multiprocessing
 import os
-import shutil
+import random
+import socket
+import time
+
+import jujuclient
+import websocket
+from tornado import gen
 
 from cloudfoundry.config import (
     PENDING, COMPLETE, RUNNING, FAILED, STATES
@@ -10,75 +18,241 @@ from cloudfoundry.config import (
 from deployer.charm import Charm
 from deployer.service import Service
 from deployer.utils import get_qualified_charm_url
+from deployer.utils import parse_constraints
 
 
+from charmgen.archive import charm_archive
 from charmgen.generator import CharmGenerator
+from cloudfoundry import uploads
 from cloudfoundry.releases import RELEASES
 from cloudfoundry.services import SERVICES
 
 
+def timestamp(dt):
+    if dt is None:
+        return None
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+
+class TacticSummary(collections.namedtuple(
+        'TacticSummary', 'name state start_time end_time failure')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return dict(self._asdict(), state=STATES[self.state])
+
+
+# juju api errors worth another try, matched against the message
+TRANSIENT_ERRORS = (
+    'connection is shut down',
+    'try again',
+    'timeout',
+    'timed out',
+    'transaction aborted',
+    'state changing too quickly',
+)
+
+
+def transient_error(e):
+    if isinstance(e, (socket.error, gen.TimeoutError,
+                      jujuclient.TimeoutError, jujuclient.LoginRequired,
+                      websocket.WebSocketException)):
+        return True
+    if isinstance(e, jujuclient.EnvError):
+        message = (e.message or '').lower()
+        return any(m in message for m in TRANSIENT_ERRORS)
+    return False
+
+
+class RetryPolicy(object):
+    """
+    How often and how soon a failed tactic is run again. The n-th
+    retry waits backoff * factor ** (n - 1) seconds, capped at
+    max_backoff, give or take `jitter` of that.
+    """
+    def __init__(self, max_attempts=4, backoff=1, factor=2, max_backoff=60,
+                 jitter=0.25, retryable=transient_error):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retryable = retryable
+
+    def should_retry(self, tactic):
+        return tactic.state == FAILED and \
+            tactic.attempts < self.max_attempts and \
+            self.retryable(tactic.failure)
+
+    def delay(self, attempt):
+        delay = min(self.backoff * self.factor ** (attempt - 1),
+                    self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
 class Tactic(object):
-    def __init__(self,  **kwargs):
+    # a call that timed out may still have happened, so only tactics
+    # that are safe to repeat retry
+    retry = NO_RETRY
+    # only talks to the juju api, ignoring the results, so it can
+    # go through run_async
+    pipelined = False
+    # seconds, a guess until we have timed a few
+    expected_duration = 5
+    # the charm revision the controller gave an upload, for the
+    # tactics depending on it
+    charm_url = None
+
+    def __init__(self, depends=None, **kwargs):
         self.state = PENDING
+        self.attempts = 0
         self.failure = None
         self.start_time = None
         self.end_time = None
+        # tactics that must be COMPLETE before this one may run
+        self.depends = list(depends or [])
         self.kwargs = kwargs
 
     def __str__(self):
         return "%s [%s]: %s" % (self.name, STATES[self.state], self.kwargs)
 
-    def run(self, env):
+    def serialize(self, index):
+        # index maps the tactics of our strategy to their position
+        return {
+            'type': type(self).__name__,
+            'kwargs': self.kwargs,
+            'depends': [index[d] for d in self.depends],
+            'state': self.state,
+            'attempts': self.attempts,
+            'failure': self.failure and str(self.failure),
+            'charm_url': self.charm_url,
+        }
+
+    def summary(self):
+        return TacticSummary(self.name, self.state,
+                             timestamp(self.start_time),
+                             timestamp(self.end_time),
+                             self.failure and str(self.failure))
+
+    @property
+    def ready(self):
+        return self.state == PENDING and all(
+            d.state == COMPLETE for d in self.depends)
+
+    @property
+    def blocked(self):
+        # a failure anywhere upstream means we can never run
+        return any(d.state == FAILED or d.blocked for d in self.depends)
+
+    def _start(self):
         if self.state != PENDING:
             raise ValueError("strategy out of order")
         self.start_time = datetime.datetime.now()
         self.state = RUNNING
+        self.attempts += 1
+        self.failure = None
+        logging.debug("Running %s", self)
+
+    def _failed(self, e):
+        logging.debug("Tactic Failed", exc_info=True)
+        self.state = FAILED
+        self.failure = e
+
+    def run(self, env):
+        self._start()
         try:
-            logging.debug("Running %s", self)
             self._run(env, **self.kwargs)
             self.state = COMPLETE
         except Exception, e:
-            logging.debug("Tactic Failed", exc_info=True)
-            self.state = FAILED
-            self.failure = e
+            self._failed(e)
         finally:
             self.end_time = datetime.datetime.now()
 
+    @gen.coroutine
+    def run_async(self, env):
+        """
+        Run a pipelined tactic against an rpc.AsyncEnvironment. The
+        calls `_run` makes are recorded, then issued in order.
+        """
+        self._start()
+        try:
+            calls = CallRecorder()
+            self._run(calls, **self.kwargs)
+            for name, args, kwargs in calls:
+                yield getattr(env, name)(*args, **kwargs)
+            self.state = COMPLETE
+        except Exception, e:
+            self._failed(e)
+        finally:
+            self.end_time = datetime.datetime.now()
+
+
+class CallRecorder(list):
+    """
+    Environment stand-in recording method calls, for tactics that
+    don't look at what the calls return.
+    """
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.append((name, args, kwargs))
+        return call
+
 
 class GenerateTactic(Tactic):
     name = "Generate charms"
+    expected_duration = 60
+    retry = NO_RETRY
+    # names of the charms written, only those whose inputs changed
+    # since the last run; running services of those get upgraded
+    changed = None
 
     def _run(self, env,  **kwargs):
         version = kwargs.get('cf_release',  RELEASES[0]['releases'][1])
         build_dir = os.path.join(kwargs['repo'], str(version))
-        if os.path.exists(build_dir):
-            return
         generator = CharmGenerator(RELEASES, SERVICES)
         generator.select_release(version)
-        generator.generate(build_dir)
+        store = os.path.join(kwargs['repo'], '.store')
+        # 0 generates a charm per CPU at a time
+        jobs = kwargs.get('jobs', 1) or multiprocessing.cpu_count()
+        self.changed = [os.path.basename(c) for c in
+                        generator.generate(build_dir, jobs, store=store)]
 
 
 class UpdateCharmTactic(Tactic):
     name = "Update charm"
+    retry = RetryPolicy()
+    expected_duration = 10
 
     def _run(self, env, **kwargs):
-        charm_url = get_qualified_charm_url(kwargs['charm_url'])
+        charm_url = kwargs['charm_url']
         if charm_url.startswith('local:'):
-            series, charm_id = charm_url.split(':')[1].split('/')
-            charm_name = charm_id.rsplit('-', 1)[0]
-            charm_file = os.path.join('/tmp', charm_id)
+            # plans leave the revision to the controller
+            series, charm_name = charm_url.split(':')[1].split('/')
+            base, _, revision = charm_name.rpartition('-')
+            if revision.isdigit():
+                charm_name = base
             version = kwargs.get('cf_release',  RELEASES[0]['releases'][1])
-            charm_path = os.path.join(kwargs['repo'],
-                                      str(version), series, charm_name)
-            shutil.make_archive(charm_file, 'zip', charm_path)
-            archive = charm_file + '.zip'
-            size = os.path.getsize(archive)
-            with open(archive) as fp:
-                env.add_local_charm(fp, series, size)
+            archive = charm_archive(os.path.join(kwargs['repo'], str(version)),
+                                    series, charm_name)
+            # the revision juju assigned, for upgrades depending on us;
+            # unchanged charms the controller has aren't sent again
+            self.charm_url, _ = uploads.upload_archive(env, archive, series)
+        else:
+            # asking the store for its latest revision blocks, that is
+            # done here on the executor rather than by the pipelined
+            # deploys and upgrades depending on us
+            charm_url = get_qualified_charm_url(charm_url)
+            env.add_charm(charm_url)
+            self.charm_url = charm_url
 
 
 class DeployTactic(Tactic):
     name = "Deploy"
+    expected_duration = 120
+    pipelined = True
 
     def _run(self, env, **kwargs):
         s = kwargs['service']
@@ -87,10 +261,13 @@ class DeployTactic(Tactic):
         charm = Charm.from_service(s['service_name'],
                                    os.path.join(kwargs['repo'], str(version)),
                                    'trusty', s)
+        # the revision the UpdateCharmTactic we depend on uploaded or
+        # resolved in the store
+        charm_url = charm.charm_url
+        for dep in self.depends:
+            charm_url = dep.charm_url or charm_url
         env.deploy(svc.name,
-                   # XXX version hack, have to probe for actual version after
-                   # push
-                   charm.charm_url + "-0",
+                   charm_url,
                    config=svc.config,
                    constraints=svc.constraints,
                    num_units=svc.num_units)
@@ -98,8 +275,75 @@ class DeployTactic(Tactic):
             env.expose(svc.name)
 
 
+class UpgradeCharmTactic(Tactic):
+    name = "Upgrade charm"
+    retry = RetryPolicy()
+    expected_duration = 30
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        charm_url = kwargs['charm_url']
+        for dep in self.depends:
+            charm_url = dep.charm_url or charm_url
+        env.set_charm(kwargs['service_name'], charm_url,
+                      force=kwargs.get('force', False))
+
+
+class ConfigureTactic(Tactic):
+    name = "Configure"
+    retry = RetryPolicy()
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        if kwargs.get('config'):
+            env.set_config(kwargs['service_name'], kwargs['config'])
+        if kwargs.get('unset'):
+            env.unset_config(kwargs['service_name'], kwargs['unset'])
+
+
+class ConstrainTactic(Tactic):
+    name = "Set constraints"
+    retry = RetryPolicy()
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        env.set_constraints(kwargs['service_name'],
+                            parse_constraints(kwargs['constraints']))
+
+
+class ExposeTactic(Tactic):
+    name = "Expose"
+    retry = RetryPolicy()
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        if kwargs.get('exposed', True):
+            env.expose(kwargs['service_name'])
+        else:
+            env.unexpose(kwargs['service_name'])
+
+
+class AddUnitsTactic(Tactic):
+    name = "Add units"
+    expected_duration = 120
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        env.add_units(kwargs['service_name'], kwargs['num_units'])
+
+
+class RemoveUnitsTactic(Tactic):
+    name = "Remove units"
+    pipelined = True
+
+    def _run(self, env, **kwargs):
+        env.remove_units(kwargs['unit_names'])
+
+
 class RemoveServiceTactic(Tactic):
     name = "Remove Service"
+    expected_duration = 30
+    pipelined = True
 
     def _run(self, env, **kwargs):
         env.destroy_service(kwargs['service_name'])
@@ -107,13 +351,35 @@ class RemoveServiceTactic(Tactic):
 
 class AddRelationTactic(Tactic):
     name = "Add Relation"
+    pipelined = True
 
     def _run(self, env, **kwargs):
         env.add_relation(kwargs['endpoint_a'], kwargs['endpoint_b'])
 
 
 class RemoveRelationTactic(Tactic):
-    name = "Add Relation"
+    name = "Remove Relation"
+    pipelined = True
 
     def _run(self, env, **kwargs):
         env.remove_relation(kwargs['endpoint_a'], kwargs['endpoint_b'])
+
+
+def load_tactics(data):
+    """
+    Rebuild a list of tactics from their serialized form.
+    """
+    tactics = []
+    for d in data:
+        cls = globals()[d['type']]
+        if not (isinstance(cls, type) and issubclass(cls, Tactic)):
+            raise ValueError("Unknown tactic %s" % d['type'])
+        tactic = cls(**d['kwargs'])
+        tactic.state = d['state']
+        tactic.failure = d.get('failure')
+        tactic.attempts = d.get('attempts', 0)
+        tactic.charm_url = d.get('charm_url')
+        tactics.append(tactic)
+    for tactic, d in zip(tactics, data):
+        tactic.depends = [tactics[i] for i in d['depends']]
+    return tactics
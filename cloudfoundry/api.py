@@ -1,11 +1,14 @@
-import os
-import shutil
 from charmhelpers.core import hookenv
 
 from deployer.env.gui import GUIEnvironment
 from deployer.utils import get_qualified_charm_url
 from deployer.utils import parse_constraints
 from deployer.deployment import Deployment
+from jujuclient import Environment as EnvironmentClient
+
+from charmgen.archive import charm_archive
+from cloudfoundry import connection
+from cloudfoundry import uploads
 
 
 class JujuLoggingDeployment(Deployment):
@@ -20,7 +23,28 @@ class JujuLoggingDeployment(Deployment):
 class APIEnvironment(GUIEnvironment):
     """
     Environment subclass that uses the APi but supports local charms.
+
+    Connections come from a pool shared by every APIEnvironment of the
+    same endpoint in this process, close() hands them back.
     """
+    @property
+    def pool(self):
+        def connect():
+            client = EnvironmentClient(self.api_endpoint)
+            client.login(self._get_token())
+            return client
+        return connection.get_pool(self.api_endpoint, connect)
+
+    def connect(self):
+        if self.client is None:
+            self.client = self.pool.acquire()
+
+    def close(self):
+        if self.client is not None:
+            self.pool.release(
+                self.client, broken=not self.client.conn.connected)
+            self.client = None
+
     def deploy(self, name, charm_url, repo=None, config=None, constraints=None,
                num_units=1, force_machine=None):
         charm_url = get_qualified_charm_url(charm_url)
@@ -28,13 +52,9 @@ class APIEnvironment(GUIEnvironment):
         if charm_url.startswith('local:'):
             series, charm_id = charm_url.split(':')[1].split('/')
             charm_name = charm_id.rsplit('-', 1)[0]
-            charm_file = os.path.join('/tmp', charm_id)
-            charm_path = os.path.join(repo, series, charm_name)
-            shutil.make_archive(charm_file, 'zip', charm_path)
-            archive = charm_file + '.zip'
-            size = os.path.getsize(archive)
-            with open(archive) as fp:
-                self.client.add_local_charm(fp, series, size)
+            archive = charm_archive(repo, series, charm_name)
+            uploaded, _ = uploads.upload_archive(self.client, archive, series)
+            charm_url = uploaded or charm_url
         else:
             self.client.add_charm(charm_url)
         self.client.deploy(
@@ -4,10 +4,12 @@ PENDING = 0
 RUNNING = 1
 COMPLETE = 2
 FAILED = -1
+CANCELLED = -2
 
 STATES = {
     PENDING: "PENDING",
     RUNNING: "RUNNING",
     COMPLETE: "COMPLETE",
-    FAILED: "FAILED"
+    FAILED: "FAILED",
+    CANCELLED: "CANCELLED",
 }
@@ -0,0 +1,169 @@
+"""
+Pooled, self healing connections to the Juju API.
+
+jujuclient connections are neither thread safe nor able to notice that
+the websocket went away, and the API server drops the connection after
+any error. The pool hands each thread a connection of its own, checks
+idle ones before reuse and replaces the ones that broke, so callers
+never see a stale connection twice.
+
+Used by the reconciler and, through api.APIEnvironment, by the hooks.
+"""
+import contextlib
+import logging
+import socket
+import threading
+import time
+
+import jujuclient
+import websocket
+
+
+CONNECTION_ERRORS = (socket.error, websocket.WebSocketException,
+                     jujuclient.LoginRequired)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def connection_lost(e, client):
+    if isinstance(e, CONNECTION_ERRORS):
+        return True
+    conn = getattr(client, 'conn', None)
+    return conn is not None and not getattr(conn, 'connected', True)
+
+
+class ConnectionPool(object):
+    """
+    Up to `size` connections made by `factory()`, which has to return
+    a connected and logged in client.
+
+    `timeout` bounds each request on the websocket, a connection idle
+    for `check_interval` seconds is pinged before it is handed out and
+    `acquire` gives up with PoolTimeout after `wait` seconds.
+    """
+    def __init__(self, factory, size=1, timeout=60, check_interval=30,
+                 wait=None):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.wait = wait
+        self.connects = 0
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        client = self.factory()
+        self.connects += 1
+        conn = getattr(client, 'conn', None)
+        if self.timeout and hasattr(conn, 'settimeout'):
+            conn.settimeout(self.timeout)
+        return client
+
+    def _close(self, client):
+        try:
+            client.close()
+        except Exception:
+            logging.debug("Error closing connection", exc_info=True)
+
+    def healthy(self, client, idle_since):
+        conn = getattr(client, 'conn', None)
+        if conn is not None and not getattr(conn, 'connected', True):
+            return False
+        if time.time() - idle_since < self.check_interval:
+            return True
+        try:
+            client.info()
+            return True
+        except Exception:
+            logging.info("Dropping dead connection", exc_info=True)
+            return False
+
+    def acquire(self):
+        deadline = None if self.wait is None else time.time() + self.wait
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        raise PoolTimeout(
+                            "No connection within %ss" % self.wait)
+                self._cond.wait(timeout)
+            if self._idle:
+                client, idle_since = self._idle.pop()
+            else:
+                client = None
+                self._open += 1
+        if client is not None:
+            if self.healthy(client, idle_since):
+                return client
+            self._close(client)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, client, broken=False):
+        if broken:
+            self._close(client)
+        with self._cond:
+            if broken:
+                self._open -= 1
+            else:
+                self._idle.append((client, time.time()))
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def connection(self):
+        client = self.acquire()
+        try:
+            yield client
+        except Exception, e:
+            self.release(client, broken=connection_lost(e, client))
+            raise
+        self.release(client)
+
+    def call(self, name, *args, **kwargs):
+        with self.connection() as client:
+            return getattr(client, name)(*args, **kwargs)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for client, _ in idle:
+            self._close(client)
+
+
+class PooledEnvironment(object):
+    """
+    Stand-in for a jujuclient Environment running each call on a
+    pooled connection.
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return self.pool.call(name, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory, **kwargs):
+    """The process wide pool for `key`, made on first use."""
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(factory, **kwargs)
+        return _pools[key]
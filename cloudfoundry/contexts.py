@@ -400,7 +400,10 @@ class OrchestratorRelation(RelationContext):
                 return domain
             env = APIEnvironment(creds['api_address'], creds['api_password'])
             env.connect()
-            status = env.status()
+            try:
+                status = env.status()
+            finally:
+                env.close()
             if 'haproxy' in status['services']:
                 units = status['services']['haproxy']['units']
                 unit0 = sorted(units.items(), key=lambda a: a[0])[0][1]
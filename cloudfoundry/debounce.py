@@ -0,0 +1,74 @@
+import tornado.ioloop
+from tornado.concurrent import is_future
+
+
+class Debouncer(object):
+    """
+    Coalesce bursts of `trigger()` calls into a single `callback()`.
+
+    The callback runs once no trigger arrived for `quiet` seconds, but
+    never later than `max_latency` seconds after the first trigger of
+    the burst, so a steady stream of triggers can't starve it. A callback
+    that fails, or returns a Future that does, is logged and run again
+    `retry` seconds later. Use from the IOLoop thread only.
+    """
+    def __init__(self, callback, quiet=0.5, max_latency=5, retry=5,
+                 io_loop=None):
+        self.callback = callback
+        self.quiet = quiet
+        self.max_latency = max_latency
+        self.retry = retry
+        self.io_loop = io_loop
+        self.triggers = 0
+        self.fired = 0
+        self._first = None
+        self._timeout = None
+
+    @property
+    def pending(self):
+        return self._timeout is not None
+
+    def trigger(self):
+        io_loop = self.io_loop or tornado.ioloop.IOLoop.current()
+        now = io_loop.time()
+        self.triggers += 1
+        if self._first is None:
+            self._first = now
+        deadline = min(now + self.quiet, self._first + self.max_latency)
+        if self._timeout is not None:
+            io_loop.remove_timeout(self._timeout)
+        self._timeout = io_loop.add_timeout(deadline, self._fire)
+
+    def cancel(self):
+        if self._timeout is not None:
+            io_loop = self.io_loop or tornado.ioloop.IOLoop.current()
+            io_loop.remove_timeout(self._timeout)
+        self._timeout = None
+        self._first = None
+
+    def _fire(self):
+        self._timeout = None
+        self._first = None
+        self.fired += 1
+        try:
+            result = self.callback()
+        except Exception:
+            self._failed()
+            raise
+        if is_future(result):
+            io_loop = self.io_loop or tornado.ioloop.IOLoop.current()
+            io_loop.add_future(result, self._done)
+
+    def _done(self, future):
+        if future.exception() is not None:
+            self._failed()
+        # raising here gets it logged by the IOLoop
+        future.result()
+
+    def _failed(self):
+        # a trigger that came in meanwhile already asked for a pass
+        if self._timeout is None:
+            io_loop = self.io_loop or tornado.ioloop.IOLoop.current()
+            self._first = io_loop.time()
+            self._timeout = io_loop.add_timeout(self._first + self.retry,
+                                                self._fire)
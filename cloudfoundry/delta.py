@@ -0,0 +1,269 @@
+"""
+Three-way delta between the previously applied expected state, the new
+expected state and the juju status.
+
+Expected states use the bundle format (`services`, `relations`) while
+reality is a status.Snapshot parsed from the juju-core status output.
+Status does not report service config or constraints, for those the
+change is taken from the previous expected state alone.
+"""
+import logging
+import os
+
+from cloudfoundry import actions
+from cloudfoundry import status
+from cloudfoundry import uploads
+from cloudfoundry import utils
+from cloudfoundry.config import COMPLETE
+
+
+def charm_base(url):
+    """Strip the revision from a charm url."""
+    if url and '-' in url:
+        base, rev = url.rsplit('-', 1)
+        if rev.isdigit():
+            return base
+    return url
+
+
+def charm_url(service):
+    branch = service.get('branch')
+    if branch and branch.startswith('local:'):
+        return branch
+    return service.get('charm')
+
+
+def charm_services(expected, charm_names):
+    """Names of the services deployed from the named local charms."""
+    result = set()
+    for name, service in (expected or {}).get('services', {}).items():
+        url = charm_url(service) or ''
+        if url.startswith('local:') and url.rsplit('/', 1)[1] in charm_names:
+            result.add(name)
+    return result
+
+
+def regenerated(url, real_url, repo, env_key):
+    """
+    Whether the local charm at `url` was regenerated since it was
+    uploaded as the `real_url` a service runs.
+    """
+    if not env_key or not url.startswith('local:'):
+        return False
+    series, charm_name = url.split(':', 1)[1].split('/')
+    build_dir = os.path.join(repo, str(actions.RELEASES[0]['releases'][1]))
+    return uploads.needs_upload(build_dir, charm_name, real_url, env_key)
+
+
+def endpoint_services(rel):
+    return set(ep.split(':', 1)[0] for ep in rel)
+
+
+def tactic_services(tactic):
+    """Names of the services a tactic acts on."""
+    kwargs = tactic.kwargs
+    if 'service_name' in kwargs:
+        return set([kwargs['service_name']])
+    if 'service' in kwargs:
+        return set([kwargs['service']['service_name']])
+    if 'endpoint_a' in kwargs:
+        return endpoint_services((kwargs['endpoint_a'], kwargs['endpoint_b']))
+    return set()
+
+
+def applied_state(previous, expected, tactics):
+    """
+    Fold what an unfinished strategy managed to do into `previous`.
+
+    Services whose tactics all completed take their definition from
+    the `expected` state the strategy was planned for. Returns the new
+    previous state and the names of the services left incomplete.
+    """
+    previous = previous or {}
+    incomplete = set()
+    for tactic in tactics:
+        if tactic.state != COMPLETE:
+            incomplete |= tactic_services(tactic)
+    services = dict(previous.get('services', {}))
+    for name in set(services) | set(expected.get('services', {})):
+        if name in incomplete:
+            continue
+        if name in expected.get('services', {}):
+            services[name] = expected['services'][name]
+        else:
+            del services[name]
+    # relations are only removed when previously asked for, keep
+    # asking for all of them and let reality decide
+    relations = list(previous.get('relations', []))
+    relations.extend(rel for rel in expected.get('relations', [])
+                     if rel not in relations)
+    result = dict(previous, services=services, relations=relations)
+    return result, incomplete
+
+
+def changed_services(old, new):
+    """
+    Names of the services whose definition or relations differ
+    between two expected states.
+    """
+    old = old or {}
+    new = new or {}
+    old_services = old.get('services', {})
+    new_services = new.get('services', {})
+    changed = set(name for name in set(old_services) | set(new_services)
+                  if old_services.get(name) != new_services.get(name))
+    rels = (utils.flatten_relations(old.get('relations', [])) ^
+            utils.flatten_relations(new.get('relations', [])))
+    for rel in rels:
+        changed |= endpoint_services(rel)
+    return changed
+
+
+def build_services(previous, expected, real, repo, scope=None, jobs=1,
+                   env_key=None):
+    # scope limits planning to the named services, None plans them all,
+    # jobs is how many charms are generated in parallel; given the
+    # environment key, services running a local charm whose archive
+    # was regenerated since its upload are upgraded
+    result = []
+    if not expected:
+        return result
+
+    current = expected['services']
+    prev = (previous or {}).get('services', {})
+    reality = status.snapshot(real).services
+    adds = set(current) - set(reality)
+    # only remove what we previously asked for
+    deletes = (set(prev) - set(current)) & set(reality)
+    names = set(current)
+    if scope is not None:
+        names &= scope
+        deletes &= scope
+        if not names and not deletes:
+            return result
+
+    # XXX detect when we really want to do this,
+    # ie, hash has changed or something
+    generate = actions.GenerateTactic(repo=repo, jobs=jobs)
+    result.append(generate)
+    for service_name in sorted(names):
+        if service_name in adds:
+            result.extend(deploy_service(
+                service_name, current[service_name], generate, repo))
+        else:
+            result.extend(update_service(
+                service_name, current[service_name],
+                prev.get(service_name, {}), reality[service_name],
+                generate, repo, env_key))
+
+    for service_name in sorted(deletes):
+        result.append(actions.RemoveServiceTactic(service_name=service_name))
+
+    logging.debug("Build New %s", result)
+    return result
+
+
+def upload_charm(url, generate, repo):
+    # local charms are uploaded, store charms get their revision resolved
+    if url.startswith('local:') or url.startswith('cs:'):
+        return actions.UpdateCharmTactic(
+            depends=[generate], charm_url=url, repo=repo)
+    return None
+
+
+def deploy_service(service_name, service, generate, repo):
+    result = []
+    service = service.copy()
+    service['service_name'] = service_name
+    charm = upload_charm(charm_url(service) or '', generate, repo)
+    if charm:
+        result.append(charm)
+    result.append(actions.DeployTactic(
+        depends=[charm or generate], service=service, repo=repo))
+    return result
+
+
+def update_service(service_name, service, prev, real, generate, repo,
+                   env_key=None):
+    result = []
+    depends = []
+
+    url = charm_url(service)
+    real_url = real.charm
+    if url and (url not in (real_url, charm_base(real_url)) or
+                regenerated(url, real_url, repo, env_key)):
+        charm = upload_charm(url, generate, repo)
+        if charm:
+            result.append(charm)
+        upgrade = actions.UpgradeCharmTactic(
+            depends=[charm or generate],
+            service_name=service_name, charm_url=url)
+        result.append(upgrade)
+        # new config keys or hooks may come with the new charm
+        depends = [upgrade]
+
+    options = service.get('options') or {}
+    prev_options = prev.get('options') or {}
+    config = dict((k, v) for k, v in options.items()
+                  if k not in prev_options or prev_options[k] != v)
+    unset = sorted(set(prev_options) - set(options))
+    if config or unset:
+        result.append(actions.ConfigureTactic(
+            depends=depends, service_name=service_name,
+            config=config, unset=unset))
+
+    constraints = service.get('constraints')
+    if constraints and constraints != prev.get('constraints'):
+        result.append(actions.ConstrainTactic(
+            service_name=service_name, constraints=constraints))
+
+    num_units = int(service.get('num_units', 1))
+    units = [unit.name for unit in real.alive_units()]
+    if num_units > len(units):
+        result.append(actions.AddUnitsTactic(
+            depends=depends, service_name=service_name,
+            num_units=num_units - len(units)))
+    elif num_units < len(units):
+        result.append(actions.RemoveUnitsTactic(
+            unit_names=units[num_units:]))
+
+    exposed = bool(service.get('expose'))
+    if exposed != real.exposed:
+        result.append(actions.ExposeTactic(
+            service_name=service_name, exposed=exposed))
+    return result
+
+
+def build_relations(previous, expected, index, deploys=None, scope=None):
+    # deploys maps service names to the DeployTactic creating them
+    # in this strategy, relations to those have to wait for them
+    result = []
+    if not expected:
+        return result
+
+    crels = utils.flatten_relations(expected.get('relations', []))
+    if scope is not None:
+        crels = set(rel for rel in crels if endpoint_services(rel) & scope)
+    adds, extra = index.diff(crels)
+    deploys = deploys or {}
+    for rel in sorted(adds):
+        depends = [deploys[n] for n in endpoint_services(rel) if n in deploys]
+        result.append(actions.AddRelationTactic(
+            depends=depends,
+            endpoint_a=rel[0], endpoint_b=rel[1]))
+
+    if not previous:
+        return result
+    # like services, only remove the relations we previously asked for,
+    # those of removed services go away with the service
+    removed = set(previous.get('services', {})) - set(expected['services'])
+    prels = utils.flatten_relations(previous.get('relations', []))
+    if scope is not None:
+        prels = set(rel for rel in prels if endpoint_services(rel) & scope)
+    dropped = set(index.resolve(*rel) for rel in prels - crels)
+    for rel in sorted(dropped & extra):
+        if endpoint_services(rel) & removed:
+            continue
+        result.append(actions.RemoveRelationTactic(
+            endpoint_a=rel[0], endpoint_b=rel[1]))
+    return result
@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+
+from cloudfoundry import delta
+
+
+class Durations(object):
+    """
+    Moving averages of how long tactics took, per tactic type and
+    service, persisted as JSON so estimates survive restarts. Recording
+    only updates memory, `save()` writes what changed since.
+
+    Tactics never seen before are estimated from the average of their
+    type, then from the `expected_duration` of their class.
+    """
+    def __init__(self, path=None, alpha=0.3):
+        self.path = path
+        self.alpha = alpha
+        self.averages = {}
+        self.dirty = False
+        if path and os.path.exists(path):
+            try:
+                with open(path) as fp:
+                    self.averages = json.load(fp)
+            except ValueError:
+                logging.warning("Ignoring corrupt durations in %s", path)
+
+    def key(self, tactic):
+        services = ','.join(sorted(delta.tactic_services(tactic)))
+        return '%s:%s' % (type(tactic).__name__, services)
+
+    def _update(self, key, seconds):
+        if key in self.averages:
+            self.averages[key] += self.alpha * (seconds - self.averages[key])
+        else:
+            self.averages[key] = seconds
+
+    def record(self, tactic, seconds):
+        self._update(self.key(tactic), seconds)
+        self._update(type(tactic).__name__, seconds)
+        self.dirty = True
+
+    def estimate(self, tactic):
+        for key in (self.key(tactic), type(tactic).__name__):
+            if key in self.averages:
+                return self.averages[key]
+        return tactic.expected_duration
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(self.averages, fp, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
+        self.dirty = False
@@ -0,0 +1,60 @@
+import collections
+import time
+
+from tornado.concurrent import Future
+
+
+class EventBus(object):
+    """
+    Sequenced, bounded log of reconciler events.
+
+    Every event gets an increasing `seq` so clients can resume with
+    `since(seq)` after a reconnect, as long as they are not further
+    behind than the backlog. Publish and subscribe from the IOLoop
+    thread only.
+    """
+    def __init__(self, maxlen=1000):
+        self.seq = 0
+        self.events = collections.deque(maxlen=maxlen)
+        self.listeners = set()
+
+    def publish(self, kind, **data):
+        self.seq += 1
+        event = dict(data, seq=self.seq, time=time.time(), type=kind)
+        self.events.append(event)
+        for listener in list(self.listeners):
+            listener(event)
+        return event
+
+    def since(self, seq):
+        if seq >= self.seq:
+            return []
+        return [e for e in self.events if e['seq'] > seq]
+
+    def subscribe(self, listener):
+        self.listeners.add(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.discard(listener)
+
+    def wait(self, seq):
+        """
+        Future resolving to the events after `seq`, immediately if
+        there are some already.
+        """
+        future = Future()
+        events = self.since(seq)
+        if events:
+            future.set_result(events)
+            return future
+
+        def listener(event):
+            self.unsubscribe(listener)
+            if not future.done():
+                future.set_result(self.since(seq))
+        self.subscribe(listener)
+        future.add_done_callback(lambda f: self.unsubscribe(listener))
+        return future
+
+
+bus = EventBus()
@@ -0,0 +1,71 @@
+import json
+import logging
+import os
+import threading
+
+
+class Journal(object):
+    """
+    Append-only journal of JSON records, one per line.
+
+    Records are only ever appended; `compact` atomically replaces the
+    whole file with a smaller set of records (usually a single snapshot)
+    that replays to the same state.
+    """
+    def __init__(self, path, compact_every=500):
+        self.path = path
+        self.compact_every = compact_every
+        self.appended = 0
+        self._lock = threading.Lock()
+        self._fp = None
+
+    def _open(self):
+        if self._fp is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._fp = open(self.path, 'a')
+        return self._fp
+
+    def append(self, record):
+        with self._lock:
+            fp = self._open()
+            fp.write(json.dumps(record) + '\n')
+            fp.flush()
+            self.appended += 1
+
+    @property
+    def needs_compaction(self):
+        return self.appended >= self.compact_every
+
+    def replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a write torn by a crash can only be the last one
+                    logging.warning("Ignoring corrupt journal record in %s",
+                                    self.path)
+
+    def compact(self, records):
+        with self._lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as fp:
+                for record in records:
+                    fp.write(json.dumps(record) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+            os.rename(tmp, self.path)
+            self.appended = 0
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
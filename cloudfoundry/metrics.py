@@ -0,0 +1,149 @@
+"""
+Minimal metrics for the reconciler, rendered in the Prometheus text
+exposition format so any scraper can read /api/v1/metrics.
+"""
+import bisect
+import threading
+
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(labels, extra=None):
+    items = sorted(labels.items()) + list(extra or [])
+    if not items:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in items)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        with self._lock:
+            for key in sorted(self._values):
+                lines.extend(self._render(dict(key), self._values[key]))
+        return lines
+
+    def _render(self, labels, value):
+        return ['%s%s %s' % (self.name, format_labels(labels),
+                             format_value(value))]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A gauge either set explicitly or computed by `func` at render time.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help, func=None):
+        super(Gauge, self).__init__(name, help)
+        self.func = func
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        if self.func is not None:
+            return self.func()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        if self.func is not None:
+            self.set(self.func())
+        return super(Gauge, self).render()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        counts, _ = self._values.get(self._key(labels), ([], 0.0))
+        return sum(counts)
+
+    def _render(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                self.name,
+                format_labels(labels, [('le', format_value(bound))]),
+                cumulative))
+        lines.append('%s_sum%s %s' % (self.name, format_labels(labels),
+                                      format_value(total)))
+        lines.append('%s_count%s %d' % (self.name, format_labels(labels),
+                                        cumulative))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help, func=None):
+        return self.register(Gauge(name, help, func))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -1,54 +1,393 @@
+import collections
+import copy
+import datetime
+import heapq
 import logging
 import threading
 import os
+import time
 
 import tornado.ioloop
 from tornado import gen
+from concurrent.futures import ThreadPoolExecutor
 
 from cloudfoundry import actions
-from config import (PENDING, COMPLETE, FAILED, RUNNING)
+from cloudfoundry import connection
+from cloudfoundry import delta
+from cloudfoundry import events
+from cloudfoundry import metrics
+from cloudfoundry import ratelimit
+from cloudfoundry import rpc
+from cloudfoundry import status
+from cloudfoundry import uploads
+from cloudfoundry.durations import Durations
+from cloudfoundry.journal import Journal
+from config import (PENDING, COMPLETE, FAILED, RUNNING, CANCELLED, STATES)
 from cloudfoundry import utils
 
 from jujuclient import Environment
 
+STATUS_FETCH = metrics.registry.histogram(
+    'reconciler_status_fetch_seconds',
+    'Latency of juju status calls.')
+TACTIC_DURATION = metrics.registry.histogram(
+    'reconciler_tactic_duration_seconds',
+    'Run time of finished tactics by tactic type.')
+TACTIC_FAILURES = metrics.registry.counter(
+    'reconciler_tactic_failures_total',
+    'Failed tactics by tactic type.')
+TACTIC_RETRIES = metrics.registry.counter(
+    'reconciler_tactic_retries_total',
+    'Failed tactics scheduled to run again by tactic type.')
+
 
 class StateDatabase(object):
     def __init__(self, config):
         self.config = config
         self._env = None
+        self.pool = None
         # expected is the state we are
         # transitioning to
         self.expected = {}
         # previous is the last (optional)
-        # expected state
+        # expected state, it becomes the
+        # expected state a strategy planned
+        # for once that strategy completes
         self.previous = {}
-        self.strategy = Strategy(self.env)
-        self.history = []
+        # services changed since the last plan, None when all of
+        # them need planning (full pushes, drift, restarts)
+        self.dirty = None
+        # bumped whenever something needs planning, planned is
+        # the revision the last strategy was built from
+        self.revision = 0
+        self.planned = 0
+        self.width = config.get('reconciler.width', 1)
+        # tactics and status calls block on the juju api, they run
+        # here so the IOLoop stays free to serve the REST API
+        self.executor = ThreadPoolExecutor(
+            config.get('reconciler.workers', self.width))
+        # observed tactic run times, to start long chains first
+        self.durations = Durations(config.get('server.durations'))
+        # paces the calls to the controller per operation type
+        self.limiter = None
+        if config.get('juju.rate_limits'):
+            self.limiter = ratelimit.RateLimiter(config['juju.rate_limits'])
+        # pipelined api client, lets tactics that only make api calls
+        # and status fetches share one connection on the IOLoop
+        self.async_env = None
+        if config.get('juju.pipeline'):
+            self.async_env = rpc.AsyncEnvironment.from_environment(
+                config['juju.environment'],
+                user=config['credentials.user'],
+                password=config['credentials.password'],
+                timeout=config.get('juju.timeout', 60))
+            if self.limiter:
+                self.async_env = ratelimit.AsyncLimitedEnvironment(
+                    self.async_env, self.limiter)
+        self.strategies = 0
+        self.strategy = self._new_strategy()
+        # summaries of retired strategies, newest last
+        self.history = collections.deque(
+            maxlen=config.get('reconciler.history', 100))
         self.exec_lock = threading.Lock()
+        # cached env.status() snapshot, refetched after status_ttl
+        # seconds or when invalidated; generation counts the fetches
+        self.status_ttl = config.get('reconciler.status_ttl', 10)
+        # of the environment in the upload ledger, fetched along with
+        # the first status
+        self.env_key = None
+        self.generation = 0
+        self._real = None
+        self._real_time = None
+        # expected state pushes and tactic state changes are
+        # journaled so a restart resumes where we left off
+        self.journal = None
+        if config.get('server.journal'):
+            self.journal = Journal(
+                config['server.journal'],
+                config.get('server.journal_compact', 500))
+            self.restore()
+
+    def _new_strategy(self):
+        self.strategies += 1
+        strategy = Strategy(self.env, self.width, self.executor)
+        strategy.id = self.strategies
+        return self._adopt(strategy)
+
+    def _adopt(self, strategy):
+        strategy.estimate = self.durations.estimate
+        strategy.async_env = self.async_env
+        return strategy
+
+    def push(self, expected):
+        self.expected = expected
+        self.touch()
+        self._journal({'op': 'expected', 'expected': expected})
+
+    def patch(self, ops):
+        """
+        Apply a JSON Patch to the expected state, raising
+        utils.PatchError if it does not apply.
+        """
+        self._update(utils.json_patch(self.expected, ops))
+        self._journal({'op': 'patch', 'patch': ops})
+
+    def put_service(self, name, service):
+        self._update(self._with_service(name, service))
+        self._journal({'op': 'service', 'name': name, 'service': service})
+
+    def delete_service(self, name):
+        """
+        Drop a service and its relations from the expected state,
+        raising KeyError if it is not there.
+        """
+        self._update(self._with_service(name, None))
+        self._journal({'op': 'service', 'name': name, 'service': None})
+
+    def _with_service(self, name, service):
+        # copy of expected with the service replaced, or removed
+        # along with its relations when service is None
+        expected = copy.deepcopy(self.expected)
+        services = expected.setdefault('services', {})
+        if service is not None:
+            services[name] = service
+            return expected
+        del services[name]
+        if 'relations' in expected:
+            expected['relations'] = utils.remove_service_relations(
+                expected['relations'], name)
+        return expected
+
+    def _update(self, expected):
+        self.touch(delta.changed_services(self.expected, expected))
+        self.expected = expected
+
+    @property
+    def outdated(self):
+        """True when expected changed since the last plan."""
+        return self.revision != self.planned
+
+    def touch(self, services=None):
+        """Mark services, or all of them, for the next plan."""
+        self.revision += 1
+        if services is None:
+            self.dirty = None
+        elif self.dirty is not None:
+            self.dirty |= set(services)
 
     def reset(self):
-        self.expected = {}
+        self.push({})
         self._reset_strategy()
 
     def _reset_strategy(self):
+        if self.strategy.state == COMPLETE and \
+                self.strategy.expected is not None:
+            self.previous = self.strategy.expected
+        elif self.strategy.state == CANCELLED:
+            # keep what was done, plan the rest again
+            self.previous, incomplete = delta.applied_state(
+                self.previous, self.strategy.expected, self.strategy)
+            if self.dirty is not None:
+                self.dirty |= incomplete
+        elif self.strategy:
+            # what failed is not in previous, look at everything
+            # again on the next plan
+            self.dirty = None
         if self.strategy:
-            self.history.append(self.strategy)
-        self.strategy = Strategy(self.env)
+            # rewriting the estimates after every tactic is too slow
+            # for large strategies
+            self.durations.save()
+            self.history.append(self.strategy.summary())
+            events.bus.publish('retired', strategy=self.strategy.id,
+                               state=STATES[self.strategy.state])
+        self.strategy = self._new_strategy()
+        self._journal({'op': 'retire', 'previous': self.previous})
 
     @property
-    def env(self):
-        if self._env:
-            return self._env
+    def stale(self):
+        """True when the strategy was planned for an older expected."""
+        return self.strategy.expected is not None and \
+            self.strategy.expected != self.expected
+
+    def preempt(self):
+        """
+        Cancel the pending tactics of a stale strategy, it retires
+        once the tactics in flight are done.
+        """
+        cancelled = self.strategy.cancel()
+        if cancelled:
+            logging.info("Preempting strategy %s, cancelled %d tactics",
+                         self.strategy.id, len(cancelled))
+            self._journal({'op': 'cancel', 'strategy': self.strategy.id})
+            events.bus.publish('preempted', strategy=self.strategy.id,
+                               cancelled=len(cancelled))
+        return cancelled
+
+    def _journal(self, record):
+        if self.journal is None:
+            return
+        self.journal.append(record)
+        if self.journal.needs_compaction:
+            self.journal.compact([self.snapshot()])
+
+    def snapshot(self):
+        return {
+            'op': 'snapshot',
+            'expected': self.expected,
+            'previous': self.previous,
+            'strategy': self.strategy.serialize() if self.strategy else None,
+        }
+
+    def restore(self):
+        strategy = None
+        for record in self.journal.replay():
+            op = record['op']
+            if op in ('expected', 'snapshot'):
+                self.expected = record['expected']
+            elif op == 'patch':
+                self.expected = utils.json_patch(self.expected,
+                                                 record['patch'])
+            elif op == 'service':
+                self.expected = self._with_service(record['name'],
+                                                   record['service'])
+            if op in ('retire', 'snapshot'):
+                self.previous = record['previous']
+                strategy = None
+            if op == 'snapshot' and record['strategy']:
+                strategy = record['strategy']
+            elif op == 'strategy':
+                strategy = record['strategy']
+            elif op == 'tactic' and strategy and \
+                    strategy['id'] == record['strategy']:
+                tactic = strategy['tactics'][record['index']]
+                tactic['state'] = record['state']
+                tactic['failure'] = record['failure']
+                tactic['charm_url'] = record.get('charm_url')
+            elif op == 'cancel' and strategy and \
+                    strategy['id'] == record['strategy']:
+                for tactic in strategy['tactics']:
+                    if tactic['state'] == PENDING:
+                        tactic['state'] = CANCELLED
+        if strategy:
+            self.strategy = self._adopt(Strategy.load(
+                strategy, self.env, self.width, self.executor))
+            self.strategies = self.strategy.id
+            # we can't know how far these got, run them again
+            for tactic in self.strategy:
+                if tactic.state == RUNNING:
+                    tactic.state = PENDING
+            self.strategy.reschedule()
+            logging.info("Resuming %s", self.strategy)
+        self.journal.compact([self.snapshot()])
+
+    def connect(self):
+        """A new connection, outside the pool and rate limits."""
         c = self.config
-        self._env = self.get_env(
+        return self.get_env(
             c['juju.environment'],
             user=c['credentials.user'],
             password=c['credentials.password'])
+
+    @property
+    def env(self):
+        if self._env:
+            return self._env
+        c = self.config
+        # a connection per worker so tactics don't queue on each other
+        self.pool = connection.ConnectionPool(
+            self.connect, size=c.get('reconciler.workers', self.width),
+            timeout=c.get('juju.timeout', 60))
+        self._env = connection.PooledEnvironment(self.pool)
+        if self.limiter:
+            # queue before taking a connection, not while holding one
+            self._env = ratelimit.LimitedEnvironment(self._env, self.limiter)
         return self._env
 
+    @property
+    def real_is_stale(self):
+        return self._real is None or self.status_ttl is not None and \
+            time.time() - self._real_time >= self.status_ttl
+
     @property
     def real(self):
-        return self.env.status()
+        if self.real_is_stale:
+            start = time.time()
+            self._set_real(self.env.status(), start)
+        return self._real
+
+    def _set_real(self, real, start):
+        # only the parsed snapshot is kept, not the raw status
+        self._real = status.Snapshot.parse(real)
+        self._real_time = time.time()
+        STATUS_FETCH.observe(self._real_time - start)
+        self.generation += 1
+
+    def fetch_real(self):
+        if self.async_env is not None and self.real_is_stale:
+            return self._fetch_real_async()
+        # resolve the snapshot on the executor, status() can take seconds
+        return self.executor.submit(self._fetch_real)
+
+    def _fetch_real(self):
+        if self.env_key is None:
+            self.env_key = uploads.environment_key(self.env)
+        return self.real
+
+    @gen.coroutine
+    def _fetch_real_async(self):
+        if self.env_key is None:
+            info = yield self.async_env.info()
+            self.env_key = uploads.info_key(info)
+        start = time.time()
+        real = yield self.async_env.status()
+        self._set_real(real, start)
+        raise gen.Return(self._real)
+
+    def invalidate(self):
+        self._real = None
+
+    def relation_index(self, real=None):
+        # built once per snapshot
+        if real is None:
+            real = self.real
+        return status.snapshot(real).relation_index
+
+    def diverges(self, deltas):
+        """
+        Decide from a batch of AllWatcher deltas whether reality may have
+        moved away from the expected state, without fetching status.
+        """
+        if not self.expected:
+            return False
+        expected = self.expected.get('services', {})
+        removed = set(self.previous.get('services', {})) - set(expected)
+        for entity, change, data in deltas:
+            if entity == 'service':
+                name = data.get('Name')
+                if name in removed:
+                    return True
+                if name not in expected:
+                    continue
+                if change == 'remove':
+                    return True
+                if bool(data.get('Exposed')) != bool(
+                        expected[name].get('expose')):
+                    return True
+                url = delta.charm_url(expected[name])
+                real_url = data.get('CharmURL')
+                if url and real_url and \
+                        url not in (real_url, delta.charm_base(real_url)):
+                    return True
+            elif entity == 'unit':
+                if change == 'remove' and data.get('Service') in expected:
+                    return True
+            elif entity == 'relation':
+                if change != 'remove':
+                    continue
+                names = [ep['ServiceName'] for ep in data.get('Endpoints', [])]
+                if names and all(n in expected for n in names):
+                    return True
+        return False
 
     def build_strategy(self, reality=None):
         if reality is None:
@@ -56,95 +395,98 @@ class StateDatabase(object):
         if reality is None:
             return []
 
+        self.strategy.expected = copy.deepcopy(self.expected)
+        scope = self.dirty
+        self.dirty = set()
+        self.planned = self.revision
         # Service Deltas
-        self.strategy.extend(self.build_services())
-        self.strategy.extend(self.build_relations())
-
-    def build_services(self):
-        # This should do a 3-way merge from the previous expected state
-        # to current with a delta for reality
-        current = self.expected
-        result = []
-        if not current:
-            return result
-
-        real = self.real
-        prev = self.previous
-        # XXX This is a very shallow diff in the sense that it only does
-        # service name merges and not charm revision
-        # XXX This deals with bundle format and the juju-core status output
-        # formats, so the key names are a little different
-        adds = set(current['services'].keys()) - set(real['Services'].keys())
-        deletes = set()
-        if prev:
-            deletes = set(prev['services'].keys()) - set(
-                current['services'].keys()) & set(
-                real['Services'].keys())
-
-        # XXX detect when we really want to do this,
-        # ie, hash has changed or something
-        result.append(actions.GenerateTactic(
-            repo=self.config['server.repository']))
-        for service_name in adds:
-            service = current['services'][service_name].copy()
-            service['service_name'] = service_name
-            branch = service.get('branch')
-            if branch and branch.startswith('local:'):
-                result.append(actions.UpdateCharmTactic(
-                    charm_url=branch,
-                    repo=self.config['server.repository']))
-            result.append(actions.DeployTactic(service=service,
-                                               repo=self.config['server.repository']))
-
-        for service_name in deletes:
-            result.push(actions.RemoveServiceTactic(service_name))
-
-        logging.debug("Build New %s", result)
-        return result
-
-    def build_relations(self):
-        current = self.expected
-        result = []
-        if not current:
-            return result
-
-        real = self.real
-        # prev = self.previous
-
-        crels = utils.flatten_relations(current['relations'])
-        for rel in crels:
-            if not utils.rel_exists(real, rel[0], rel[1]):
-                result.append(actions.AddRelationTactic(
-                    endpoint_a=rel[0], endpoint_b=rel[1]))
+        services = self.build_services(reality, scope)
+        deploys = dict((t.kwargs['service']['service_name'], t)
+                       for t in services
+                       if isinstance(t, actions.DeployTactic))
+        self.strategy.extend(services)
+        self.strategy.extend(self.build_relations(reality, deploys, scope))
+        if self.strategy:
+            self._journal({'op': 'strategy',
+                           'strategy': self.strategy.serialize()})
+            events.bus.publish('strategy', strategy=self.strategy.id,
+                               tactics=[str(t) for t in self.strategy])
 
-        # XXX skip deletes for now
+    def build_services(self, real=None, scope=None):
+        if real is None:
+            real = self.real
+        return delta.build_services(
+            self.previous, self.expected, real,
+            self.config['server.repository'], scope,
+            self.config.get('reconciler.generate_jobs', 1), self.env_key)
 
-        return result
+    def build_relations(self, real=None, deploys=None, scope=None):
+        if real is None:
+            real = self.real
+        return delta.build_relations(self.previous, self.expected,
+                                     self.relation_index(real), deploys,
+                                     scope)
 
     def execute_strategy(self):
         # each strategy is a list of tactics,
         # we track the state of each of those
-        # by mutating the tactic in the list
-        # execute strategy shouldn't blocka
-        # so if the lock is taken we continue
-        # without modifying the strategy
-        # and pick up in the next timeout cycle
-        if not self.strategy.runnable:
-            return
-
+        # by mutating the tactic in the list.
+        # Tactics run on the executor; as each one
+        # finishes we are called again to start
+        # whatever became ready or to retire the
+        # strategy once nothing is left in flight
         if not self.exec_lock.acquire(False):
             return
         try:
-            logging.debug("Exec Strat %s", self.strategy)
-            self.strategy()
-            if self.strategy.runnable:
-                tornado.ioloop.IOLoop.instance().add_callback(
-                    self.execute_strategy)
-            else:
+            strategy = self.strategy
+            if strategy.runnable:
+                logging.debug("Exec Strat %s", strategy)
+                io_loop = tornado.ioloop.IOLoop.instance()
+                for tactic in strategy.next_batch():
+                    self._publish_tactic(tactic, RUNNING)
+                    io_loop.add_future(strategy.run_tactic(tactic),
+                                       self._tactic_done)
+            elif strategy and not strategy.inflight and \
+                    not strategy.running:
                 self._reset_strategy()
         finally:
             self.exec_lock.release()
 
+    def _tactic_done(self, future):
+        tactic = future.result()
+        kind = type(tactic).__name__
+        if tactic.start_time and tactic.end_time:
+            seconds = (tactic.end_time - tactic.start_time).total_seconds()
+            TACTIC_DURATION.observe(seconds, tactic=kind)
+            if tactic.state == COMPLETE:
+                self.durations.record(tactic, seconds)
+        if tactic.state == FAILED:
+            TACTIC_FAILURES.inc(tactic=kind)
+        if isinstance(tactic, actions.GenerateTactic) and tactic.changed:
+            # the next plan upgrades the services running those
+            self.touch(delta.charm_services(self.expected, tactic.changed))
+        self._publish_tactic(tactic, tactic.state)
+        if tactic in self.strategy:
+            self._journal({'op': 'tactic',
+                           'strategy': self.strategy.id,
+                           'index': self.strategy.index(tactic),
+                           'state': tactic.state,
+                           'failure': tactic.failure and str(tactic.failure),
+                           'charm_url': tactic.charm_url})
+        # the tactic changed the environment
+        self.invalidate()
+        self.execute_strategy()
+
+    def _publish_tactic(self, tactic, state):
+        if tactic not in self.strategy:
+            return
+        events.bus.publish('tactic',
+                           strategy=self.strategy.id,
+                           index=self.strategy.index(tactic),
+                           tactic=str(tactic.name),
+                           state=STATES[state],
+                           failure=tactic.failure and str(tactic.failure))
+
     @classmethod
     def get_env(cls, name=None, user=None, password=None):
         # A hook env will have this set
@@ -159,38 +501,290 @@ class StateDatabase(object):
         return env
 
 
+class StrategySummary(collections.namedtuple(
+        'StrategySummary', 'id state start_time end_time tactics')):
+    """
+    What history keeps of a retired strategy, the tactics are
+    reduced to TacticSummary tuples.
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': STATES[self.state],
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'tactics': [t.to_dict() for t in self.tactics],
+        }
+
+
 class Strategy(list):
-    def __init__(self, env):
+    """
+    A DAG of tactics. Each call starts every tactic whose dependencies
+    are COMPLETE, up to `width` at a time; a FAILED tactic only blocks
+    the tactics that depend on it. Failures the tactic's RetryPolicy
+    considers transient are retried after a backoff first.
+
+    Given an executor the tactic bodies run there and each call returns
+    futures for the tactics it started, otherwise they run inline.
+    Given an async_env, pipelined tactics run on the IOLoop instead.
+    """
+    def __init__(self, env, width=1, executor=None):
+        self.id = None
         self.state = PENDING
         self.env = env
+        self.width = width
+        self.executor = executor
+        self.inflight = set()
+        # the expected state this strategy was planned for
+        self.expected = None
+        # estimate(tactic) -> seconds, enables critical path ordering
+        self.estimate = None
+        # an rpc.AsyncEnvironment for the pipelined tactics
+        self.async_env = None
+        self._paths = None
+        # see _schedule
+        self._index = {}
+        self._ready = None
 
-    def find_next_tactic(self):
-        if not self:
+    def _schedule(self):
+        """
+        Index the tactics and count the unfinished dependencies of
+        each, tactics that have none go on the ready heap. Finishing
+        tactics feed their dependents to it from then on, rather than
+        every tactic being looked at again. Rebuilt once tactics are
+        added or the estimate changes.
+        """
+        if self._ready is not None and len(self._index) == len(self) \
+                and self._ready_estimate is self.estimate:
+            return
+        self._index = dict((t, i) for i, t in enumerate(self))
+        self._dependents = self.dependents()
+        self._completed = set(t for t in self if t.state == COMPLETE)
+        self._waiting = {}
+        self._ready = []
+        self._ready_estimate = self.estimate
+        for tactic in self:
+            self._waiting[tactic] = len(
+                [d for d in tactic.depends if d.state != COMPLETE])
+            if not self._waiting[tactic]:
+                self._push(tactic)
+
+    def _push(self, tactic):
+        # longest chains first, plan order for ties
+        path = 0
+        if self.estimate is not None:
+            path = -self.critical_paths()[tactic]
+        heapq.heappush(self._ready, (path, self._index[tactic], tactic))
+
+    def _finished(self, tactic):
+        self._schedule()
+        if tactic.state != COMPLETE or tactic in self._completed or \
+                tactic not in self._index:
+            return
+        self._completed.add(tactic)
+        for dep in self._dependents[tactic]:
+            self._waiting[dep] -= 1
+            if not self._waiting[dep]:
+                self._push(dep)
+
+    def reschedule(self):
+        """Forget the ready tactics after changing states by hand."""
+        self._ready = None
+
+    def _runs(self, tactic):
+        return tactic.state == PENDING and tactic not in self.inflight
+
+    def find_ready_tactics(self):
+        self._schedule()
+        return [t for _, _, t in sorted(self._ready) if self._runs(t)]
+
+    def dependents(self):
+        result = dict((t, []) for t in self)
+        for tactic in self:
+            for dep in tactic.depends:
+                result.setdefault(dep, []).append(tactic)
+        return result
+
+    def critical_paths(self, estimate=None):
+        """
+        Map each tactic to the estimated run time of the longest chain
+        of tactics starting with it.
+        """
+        if estimate is None:
+            if self._paths is not None and len(self._paths) == len(self):
+                return self._paths
+            estimate = self.estimate
+        dependents = self.dependents()
+        paths = {}
+
+        def path(tactic):
+            if tactic not in paths:
+                paths[tactic] = estimate(tactic) + max(
+                    [path(d) for d in dependents[tactic]] or [0])
+            return paths[tactic]
+        # dependencies usually come first in a plan, walking it
+        # backwards keeps the recursion shallow
+        for tactic in reversed(self):
+            path(tactic)
+        if estimate is self.estimate:
+            self._paths = paths
+        return paths
+
+    def eta(self, now=None):
+        """
+        Estimated seconds until the tactics still to run are done, None
+        without estimates.
+        """
+        if self.estimate is None:
             return None
+        if now is None:
+            now = datetime.datetime.now()
+        remaining = dict((t, 0) for t in self)
         for tactic in self:
-            if tactic.state == FAILED:
-                return None
-            if tactic.state == PENDING:
-                return tactic
-        return None
+            if tactic.blocked or tactic.state not in (PENDING, RUNNING):
+                continue
+            seconds = self.estimate(tactic)
+            if tactic.state == RUNNING and tactic.start_time:
+                seconds -= (now - tactic.start_time).total_seconds()
+            remaining[tactic] = max(seconds, 0)
+        paths = self.critical_paths(lambda t: remaining[t])
+        longest = max(paths.values() or [0])
+        # more work than the width allows to run side by side
+        return max(longest, sum(remaining.values()) / float(self.width))
+
+    def find_next_tactic(self):
+        self._schedule()
+        # drop what was cancelled or started since it became ready
+        while self._ready and not self._runs(self._ready[0][2]):
+            heapq.heappop(self._ready)
+        return self._ready[0][2] if self._ready else None
+
+    @property
+    def running(self):
+        return [t for t in self
+                if t in self.inflight or t.state == RUNNING]
 
     @property
     def runnable(self):
-        return bool(self.find_next_tactic())
+        return self.find_next_tactic() is not None
+
+    @property
+    def pending(self):
+        return [t for t in self
+                if t.state == PENDING and t not in self.inflight]
+
+    def cancel(self):
+        # includes tactics waiting to be retried
+        cancelled = [t for t in self if t.state == PENDING]
+        for tactic in cancelled:
+            tactic.state = CANCELLED
+        self.update_state()
+        return cancelled
+
+    def next_batch(self):
+        # the caller runs these, they leave the ready heap
+        batch = []
+        slots = self.width - len(self.inflight)
+        while len(batch) < slots and self.find_next_tactic():
+            batch.append(heapq.heappop(self._ready)[2])
+        return batch
 
-    @gen.coroutine
     def __call__(self, env=None):
+        futures = [self.run_tactic(t, env) for t in self.next_batch()]
+        self.update_state()
+        return futures
+
+    @gen.coroutine
+    def run_tactic(self, tactic, env=None):
         if env is None:
             env = self.env
+        self.state = RUNNING
+        self.inflight.add(tactic)
+        try:
+            while True:
+                if self.async_env is not None and tactic.pipelined:
+                    yield tactic.run_async(self.async_env)
+                elif self.executor is None:
+                    tactic.run(env)
+                else:
+                    yield self.executor.submit(tactic.run, env)
+                if not tactic.retry.should_retry(tactic):
+                    break
+                yield self._backoff(tactic)
+                if tactic.state != PENDING:
+                    break
+        finally:
+            self.inflight.discard(tactic)
+            self._finished(tactic)
+            self.update_state()
+        raise gen.Return(tactic)
 
-        current = self.find_next_tactic()
-        if not current:
-            self.state = COMPLETE
+    def _backoff(self, tactic):
+        # the tactic stays in flight while it waits, so nothing else
+        # picks it up, but it does not hold a thread
+        delay = tactic.retry.delay(tactic.attempts)
+        logging.warning("%s failed on attempt %d, retrying in %.1fs: %s",
+                        tactic.name, tactic.attempts, delay, tactic.failure)
+        kind = type(tactic).__name__
+        TACTIC_RETRIES.inc(tactic=kind)
+        if tactic in self:
+            events.bus.publish('retry', strategy=self.id,
+                               index=self.index(tactic),
+                               tactic=str(tactic.name),
+                               attempt=tactic.attempts, delay=delay,
+                               failure=str(tactic.failure))
+        tactic.state = PENDING
+        io_loop = tornado.ioloop.IOLoop.current()
+        return gen.Task(io_loop.add_timeout, io_loop.time() + delay)
+
+    def update_state(self):
+        if self.inflight or self.runnable or self.running:
+            return
+        if any(t.state == FAILED for t in self):
+            self.state = FAILED
+        elif any(t.state == CANCELLED for t in self):
+            self.state = CANCELLED
         else:
-            self.state = RUNNING
-            current.run(env)
-            if current.state != COMPLETE:
-                self.state = FAILED
+            self.state = COMPLETE
+
+    def index(self, tactic):
+        self._schedule()
+        try:
+            return self._index[tactic]
+        except KeyError:
+            raise ValueError('%s is not in the strategy' % tactic)
+
+    def __contains__(self, tactic):
+        self._schedule()
+        return tactic in self._index
+
+    def serialize(self):
+        index = dict((t, i) for i, t in enumerate(self))
+        return {
+            'id': self.id,
+            'expected': self.expected,
+            'tactics': [t.serialize(index) for t in self],
+        }
+
+    def summary(self):
+        tactics = tuple(t.summary() for t in self)
+        starts = [t.start_time for t in tactics if t.start_time]
+        ends = [t.end_time for t in tactics if t.end_time]
+        return StrategySummary(self.id, self.state,
+                               min(starts) if starts else None,
+                               max(ends) if ends else None,
+                               tactics)
+
+    @classmethod
+    def load(cls, data, env, width=1, executor=None):
+        strategy = cls(env, width, executor)
+        strategy.id = data['id']
+        strategy.expected = data['expected']
+        strategy.extend(actions.load_tactics(data['tactics']))
+        strategy.update_state()
+        return strategy
 
     def __str__(self):
         return "Strategy %s" % [str(t) for t in self]
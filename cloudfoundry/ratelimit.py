@@ -0,0 +1,159 @@
+"""
+Admission control for calls to the Juju controller.
+
+Each API operation draws from a token bucket of its own, configured as
+`{"deploy": 2, "add_relation": [5, 10], "default": 20}`: a rate in
+calls per second, optionally with a burst size. Operations without an
+entry get their own bucket at the `default` rate, or are left unlimited
+when there is none.
+
+A call finding its bucket empty reserves the next token and waits for
+it rather than failing, so callers are served in arrival order and a
+large strategy drains at the configured pace.
+"""
+import threading
+import time
+
+from tornado import gen
+import tornado.ioloop
+
+from cloudfoundry import metrics
+
+
+CALLS = metrics.registry.counter(
+    'reconciler_ratelimit_calls_total',
+    'Juju API calls admitted by operation.')
+DELAYED = metrics.registry.counter(
+    'reconciler_ratelimit_delayed_total',
+    'Juju API calls that had to wait for a token by operation.')
+WAIT = metrics.registry.histogram(
+    'reconciler_ratelimit_wait_seconds',
+    'Time Juju API calls spent queued by operation.')
+QUEUED = metrics.registry.gauge(
+    'reconciler_ratelimit_queued',
+    'Juju API calls currently waiting for a token by operation.')
+
+# never limited, they don't reach the controller
+EXEMPT = ('close', 'connect')
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None, clock=time.time):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returning the seconds to wait before it may be
+        used. Tokens go negative while the bucket is empty, which
+        queues later callers behind the earlier ones.
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class RateLimiter(object):
+    def __init__(self, limits=None, clock=time.time, sleep=time.sleep):
+        limits = dict(limits or {})
+        self.default = limits.pop('default', None)
+        self.limits = limits
+        self.clock = clock
+        self.sleep = sleep
+        self.buckets = {}
+        self.queued = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, op):
+        with self._lock:
+            if op not in self.buckets:
+                limit = self.limits.get(op, self.default)
+                if isinstance(limit, (list, tuple)):
+                    rate, burst = limit
+                else:
+                    rate, burst = limit, None
+                self.buckets[op] = None
+                if rate:
+                    self.buckets[op] = TokenBucket(rate, burst, self.clock)
+            return self.buckets[op]
+
+    def reserve(self, op):
+        CALLS.inc(operation=op)
+        bucket = self._bucket(op)
+        delay = bucket.reserve() if bucket else 0
+        WAIT.observe(delay, operation=op)
+        if delay:
+            DELAYED.inc(operation=op)
+        return delay
+
+    def _queue(self, op, n):
+        with self._lock:
+            self.queued[op] = self.queued.get(op, 0) + n
+            QUEUED.set(self.queued[op], operation=op)
+
+    def wait(self, op):
+        """Block until a call to `op` may be made."""
+        delay = self.reserve(op)
+        if delay:
+            self._queue(op, 1)
+            try:
+                self.sleep(delay)
+            finally:
+                self._queue(op, -1)
+
+    @gen.coroutine
+    def wait_async(self, op, io_loop=None):
+        """Resolve once a call to `op` may be made."""
+        delay = self.reserve(op)
+        if delay:
+            io_loop = io_loop or tornado.ioloop.IOLoop.current()
+            self._queue(op, 1)
+            try:
+                yield gen.Task(io_loop.add_timeout, io_loop.time() + delay)
+            finally:
+                self._queue(op, -1)
+
+
+class LimitedEnvironment(object):
+    """Environment stand-in waiting for a token before each call."""
+    def __init__(self, env, limiter):
+        self.env = env
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self.env, name)
+        if name in EXEMPT or name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self.limiter.wait(name)
+            return attr(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+
+class AsyncLimitedEnvironment(LimitedEnvironment):
+    """The same for rpc.AsyncEnvironment, queueing on the IOLoop."""
+    def __getattr__(self, name):
+        attr = getattr(self.env, name)
+        if name in EXEMPT or name.startswith('_') or not callable(attr):
+            return attr
+
+        @gen.coroutine
+        def call(*args, **kwargs):
+            yield self.limiter.wait_async(
+                name, getattr(self.env, 'io_loop', None))
+            result = yield attr(*args, **kwargs)
+            raise gen.Return(result)
+        call.__name__ = name
+        return call
@@ -20,18 +20,18 @@ To experiment with this::
     server to force a run and then status the system.
     Debug output should show whats happening and
 
+Besides pushes and SIGHUP, the server follows the Juju AllWatcher
+stream and schedules a reconcile whenever the deltas show reality
+moving away from the expected state.
 
 ISSUES:
     local charm version in charm url
         need to probe server still
     reconcile loop:
-        should only trigger builds after push/reality change
         execute should happen by queueing the callback
-        should listen directly on the websocket and schedule
-            rebuilds on change
     no support for unit state currently (auto-retry/replace, etc)
-    relation removal still needs work
 """
+import datetime
 import json
 import logging
 import os
@@ -44,31 +44,104 @@ import tornado.ioloop
 import tornado.options
 import tornado.process
 import tornado.web
+import tornado.websocket
 
+from tornado import gen
 from tornado.options import define, options
 from cloudfoundry import config
+from cloudfoundry import events
+from cloudfoundry.debounce import Debouncer
+from cloudfoundry import metrics
 from cloudfoundry import model
 from cloudfoundry import utils
+from cloudfoundry.watcher import EnvironmentWatcher
 
 env_name = None
 server = None
 db = None
-
-
+watcher = None
+planning = False
+
+RECONCILE_TRIGGERS = metrics.registry.counter(
+    'reconciler_triggers_total',
+    'Requests for a reconcile pass, before coalescing.')
+RECONCILE_PASSES = metrics.registry.counter(
+    'reconciler_passes_total',
+    'Reconcile passes that planned a new strategy.')
+RECONCILE_DURATION = metrics.registry.histogram(
+    'reconciler_pass_duration_seconds',
+    'Time to fetch reality and plan a strategy.')
+QUEUE_DEPTH = metrics.registry.gauge(
+    'reconciler_strategy_queue_depth',
+    'Tactics of the current strategy waiting to run.',
+    lambda: len(db.strategy.pending) if db else 0)
+RUNNING_TACTICS = metrics.registry.gauge(
+    'reconciler_strategy_running',
+    'Tactics of the current strategy in flight.',
+    lambda: len(db.strategy.running) if db else 0)
+
+
+@gen.coroutine
 def reconcile():
     # delta state real vs expected
     # build strategy
     # execute strategy inside lock
-    if not db.strategy:
-        reality = db.real
-        db.build_strategy(reality)
+    global planning
+    if db.strategy and db.stale and not planning:
+        # expected moved on, stop the old plan at the next tactic
+        # boundary and replan once nothing is in flight
+        db.preempt()
+        db.execute_strategy()
+    if not db.strategy and not planning:
+        planning = True
+        start = time.time()
+        try:
+            reality = yield db.fetch_real()
+            db.build_strategy(reality)
+        finally:
+            planning = False
+        RECONCILE_PASSES.inc()
+        RECONCILE_DURATION.observe(time.time() - start)
+        if db.outdated:
+            # expected changed while we were fetching status
+            schedule()
     if db.strategy:
         db.execute_strategy()
 
 
+# pushes, signals and watcher deltas all ask for a reconcile,
+# bursts of those are folded into a single planning pass
+debouncer = Debouncer(reconcile)
+
+
+def schedule():
+    RECONCILE_TRIGGERS.inc()
+    debouncer.trigger()
+
+
+def on_retired(event):
+    # the plan that just finished was older than expected
+    if event['type'] == 'retired' and db.outdated:
+        schedule()
+
+
+def on_deltas(deltas, initial=False):
+    db.invalidate()
+    if not initial:
+        events.bus.publish('deltas', deltas=deltas)
+    # the initial batch is a full dump of the environment rather
+    # than a change, so we always reconcile against it
+    if initial or db.diverges(deltas):
+        logging.debug("Reality diverged, scheduling reconcile")
+        db.touch()
+        schedule()
+
+
 def sig_reconcile(sig, frame):
     logging.info("Forcing reconcile loop")
-    tornado.ioloop.IOLoop.instance().add_callback(reconcile)
+    io_loop = tornado.ioloop.IOLoop.instance()
+    io_loop.add_callback(db.touch)
+    io_loop.add_callback(schedule)
 
 
 def sig_restart(sig, frame):
@@ -79,6 +152,15 @@ def sig_restart(sig, frame):
 def shutdown():
     logging.info('Stopping http server')
     server.stop()
+    debouncer.cancel()
+    if watcher:
+        watcher.stop()
+    db.executor.shutdown(wait=False)
+    if db.pool:
+        db.pool.close()
+    if db.async_env:
+        db.async_env.close()
+    db.durations.save()
 
     logging.info('Will shutdown in %s seconds ...',
                  config.MAX_WAIT_SECONDS_BEFORE_SHUTDOWN)
@@ -101,8 +183,42 @@ class StateHandler(tornado.web.RequestHandler):
         self.write(json.dumps(db.expected, indent=2))
 
     def post(self):
-        db.expected = json.loads(self.request.body)
-        tornado.ioloop.IOLoop.instance().add_callback(reconcile)
+        db.push(json.loads(self.request.body))
+        schedule()
+
+    def patch(self):
+        # RFC 6902, only the services it touches are planned again
+        try:
+            db.patch(json.loads(self.request.body))
+        except (ValueError, KeyError, TypeError), e:
+            raise tornado.web.HTTPError(400, str(e))
+        schedule()
+        self.write(json.dumps(db.expected, indent=2))
+
+
+class ServiceHandler(tornado.web.RequestHandler):
+    def get(self, name):
+        service = db.expected.get('services', {}).get(name)
+        if service is None:
+            raise tornado.web.HTTPError(404)
+        self.write(json.dumps(service, indent=2))
+
+    def put(self, name):
+        try:
+            service = json.loads(self.request.body)
+        except ValueError, e:
+            raise tornado.web.HTTPError(400, str(e))
+        if not isinstance(service, dict):
+            raise tornado.web.HTTPError(400, 'Service must be an object')
+        db.put_service(name, service)
+        schedule()
+
+    def delete(self, name):
+        try:
+            db.delete_service(name)
+        except KeyError:
+            raise tornado.web.HTTPError(404)
+        schedule()
 
 
 class StrategyHandler(tornado.web.RequestHandler):
@@ -111,6 +227,114 @@ class StrategyHandler(tornado.web.RequestHandler):
                               indent=2))
 
 
+class StrategyETAHandler(tornado.web.RequestHandler):
+    def get(self):
+        eta = db.strategy.eta()
+        self.write(json.dumps({
+            'id': db.strategy.id,
+            'state': config.STATES[db.strategy.state],
+            'eta': eta,
+            'eta_time': time.time() + eta if eta is not None else None,
+        }, indent=2))
+
+
+class HistoryHandler(tornado.web.RequestHandler):
+    def get(self):
+        try:
+            offset = int(self.get_argument('offset', 0))
+            limit = int(self.get_argument('limit', 20))
+        except ValueError, e:
+            raise tornado.web.HTTPError(400, str(e))
+        if offset < 0 or limit < 0:
+            raise tornado.web.HTTPError(
+                400, 'offset and limit must not be negative')
+        # newest first
+        history = list(reversed(db.history))
+        self.write(json.dumps({
+            'total': len(history),
+            'offset': offset,
+            'limit': limit,
+            'strategies': [s.to_dict()
+                           for s in history[offset:offset + limit]],
+        }, indent=2))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.registry.render())
+
+
+def since_argument(handler):
+    try:
+        since = int(handler.get_argument('since', 0))
+    except ValueError, e:
+        raise tornado.web.HTTPError(400, str(e))
+    if since < 0:
+        raise tornado.web.HTTPError(400, 'since must not be negative')
+    return since
+
+
+class EventsHandler(tornado.websocket.WebSocketHandler):
+    """
+    Push events to websocket clients as they happen, starting with
+    the backlog after ?since=<seq>.
+    """
+    def get(self, *args, **kwargs):
+        # before the handshake, which is too late for a 400
+        self.since = since_argument(self)
+        return super(EventsHandler, self).get(*args, **kwargs)
+    def check_origin(self, origin):
+        # pages from elsewhere must not read the event stream, unless
+        # their origin is in server.allowed_origins
+        if origin in self.settings.get('allowed_origins', ()):
+            return True
+        return super(EventsHandler, self).check_origin(origin)
+
+    def open(self):
+        for event in events.bus.since(self.since):
+            self.send(event)
+        events.bus.subscribe(self.send)
+
+    def send(self, event):
+        try:
+            self.write_message(json.dumps(event))
+        except tornado.websocket.WebSocketClosedError:
+            events.bus.unsubscribe(self.send)
+
+    def on_close(self):
+        events.bus.unsubscribe(self.send)
+
+
+class EventsPollHandler(tornado.web.RequestHandler):
+    """
+    Long-poll alternative to EventsHandler, answers with the events
+    after ?since=<seq> as soon as there are any, or an empty list after
+    ?timeout= seconds, at most MAX_TIMEOUT.
+    """
+    MAX_TIMEOUT = 3600
+
+    @gen.coroutine
+    def get(self):
+        since = since_argument(self)
+        try:
+            timeout = float(self.get_argument('timeout', 30))
+        except ValueError, e:
+            raise tornado.web.HTTPError(400, str(e))
+        # also false for nan
+        if not 0 <= timeout <= self.MAX_TIMEOUT:
+            raise tornado.web.HTTPError(
+                400, 'timeout must be between 0 and %d' % self.MAX_TIMEOUT)
+        future = events.bus.wait(since)
+        try:
+            result = yield gen.with_timeout(
+                datetime.timedelta(seconds=timeout), future)
+        except gen.TimeoutError:
+            future.set_result([])
+            result = []
+        self.write(json.dumps({'seq': events.bus.seq, 'events': result}))
+
+
 class ResetHandler(tornado.web.RequestHandler):
     def get(self):
         db.reset()
@@ -125,12 +349,34 @@ def main():
         'server.port': 8888,
         'credentials.user': 'user-admin',
         'server.repository': 'build',
-        'juju.environment': utils.current_env()
+        'server.allowed_origins': [],
+        'juju.environment': utils.current_env(),
+        'reconciler.status_ttl': 10,
+        'reconciler.width': 4,
+        'reconciler.workers': 4,
+        'reconciler.history': 100,
+        # charms generated in parallel, 0 for one per CPU
+        'reconciler.generate_jobs': 0,
+        'juju.timeout': 60,
+        'juju.pipeline': False,
+        # calls per second, or [rate, burst], by api operation
+        'juju.rate_limits': {'default': 20, 'deploy': 2,
+                             'add_local_charm': 1, 'add_relation': 5},
+        'reconciler.debounce': 0.5,
+        'reconciler.max_latency': 5,
+        # seconds before a failed pass is tried again
+        'reconciler.retry': 5,
     })
 
     application = tornado.web.Application([
         (r"/api/v1/", StateHandler),
+        (r"/api/v1/services/([^/]+)", ServiceHandler),
         (r"/api/v1/strategy", StrategyHandler),
+        (r"/api/v1/strategy/eta", StrategyETAHandler),
+        (r"/api/v1/history", HistoryHandler),
+        (r"/api/v1/metrics", MetricsHandler),
+        (r"/api/v1/events", EventsHandler),
+        (r"/api/v1/events/poll", EventsPollHandler),
         (r"/api/v1/reset", ResetHandler),
     ],
         autoreload=True,
@@ -140,11 +386,22 @@ def main():
 
     global server
     global db
+    global watcher
 
     if not os.path.exists(config['server.repository']):
         os.makedirs(config['server.repository'])
+    if not config.get('server.journal'):
+        config['server.journal'] = os.path.join(
+            config['server.repository'], 'journal')
+    if not config.get('server.durations'):
+        config['server.durations'] = os.path.join(
+            config['server.repository'], 'durations.json')
 
     db = model.StateDatabase(config)
+    debouncer.quiet = config['reconciler.debounce']
+    debouncer.max_latency = config['reconciler.max_latency']
+    debouncer.retry = config['reconciler.retry']
+    events.bus.subscribe(on_retired)
     server = tornado.httpserver.HTTPServer(application)
     server.listen(config['server.port'], config['server.address'])
 
@@ -157,7 +414,12 @@ def main():
     tornado.autoreload.watch(options.config)
     utils.record_pid()
     loop = tornado.ioloop.IOLoop.instance()
-    # tornado.ioloop.PeriodicCallback(reconcile, 500, io_loop=loop).start()
+    # the long-poll gets a connection of its own, it would otherwise
+    # hold a pool slot and take rate limit tokens from tactics
+    watcher = EnvironmentWatcher(db.connect, on_deltas, io_loop=loop)
+    watcher.start()
+    # pick up a strategy restored from the journal
+    loop.add_callback(reconcile)
     loop.start()
 
 
@@ -0,0 +1,220 @@
+"""
+Tornado native Juju API client.
+
+Requests are written to a single websocket as soon as they are made and
+matched to their responses by RequestId, so any number of calls can be
+outstanding at once instead of paying a round-trip each. Every method
+returns a Future and mirrors the jujuclient Environment method of the
+same name.
+
+The API server closes the connection when a request fails; the pending
+requests then fail with ConnectionClosed and the next call reconnects.
+"""
+import datetime
+import json
+import logging
+import os
+import socket
+
+import yaml
+from jujuclient import EnvError
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest
+from tornado.websocket import websocket_connect
+
+
+class ConnectionClosed(socket.error):
+    pass
+
+
+def environment_endpoint(env_name):
+    """API endpoint and credentials of a bootstrapped environment."""
+    api_addresses = os.environ.get('JUJU_API_ADDRESSES')
+    if api_addresses:
+        return 'wss://%s' % api_addresses.split()[0], None, None
+    jhome = os.path.expanduser(os.environ.get('JUJU_HOME', '~/.juju'))
+    jenv = os.path.join(jhome, 'environments', '%s.jenv' % env_name)
+    if not os.path.exists(jenv):
+        raise ValueError("Environment %s not bootstrapped" % env_name)
+    with open(jenv) as fh:
+        data = yaml.safe_load(fh)
+    return ('wss://%s' % data['state-servers'][0],
+            'user-%s' % data['user'], data['password'])
+
+
+class AsyncEnvironment(object):
+    def __init__(self, endpoint, user='user-admin', password=None,
+                 timeout=60, io_loop=None):
+        self.endpoint = endpoint
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.io_loop = io_loop
+        self.conn = None
+        self._connecting = None
+        self._request_id = 0
+        self._pending = {}
+
+    @classmethod
+    def from_environment(cls, env_name, user=None, password=None, **kwargs):
+        endpoint, env_user, env_password = environment_endpoint(env_name)
+        return cls(endpoint, user=env_user or user,
+                   password=env_password or password, **kwargs)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def connect(self):
+        # concurrent callers share the one connection attempt
+        if self._connecting is None:
+            self._connecting = self._connect()
+            self._connecting.add_done_callback(self._connected)
+        return self._connecting
+
+    def _connected(self, future):
+        self._connecting = None
+
+    @gen.coroutine
+    def _connect(self):
+        request = HTTPRequest(self.endpoint, validate_cert=False,
+                              headers={'Origin': self.endpoint},
+                              connect_timeout=self.timeout)
+        conn = yield websocket_connect(request, io_loop=self.io_loop)
+        self.conn = conn
+        self._read(conn)
+        try:
+            yield self._send({
+                'Type': 'Admin', 'Request': 'Login',
+                'Params': {'AuthTag': self.user,
+                           'Password': self.password}})
+        except Exception:
+            self.close()
+            raise
+
+    @gen.coroutine
+    def _read(self, conn):
+        while True:
+            message = yield conn.read_message()
+            if message is None:
+                break
+            try:
+                result = json.loads(message)
+                future = self._pending.pop(result['RequestId'])
+            except (ValueError, KeyError):
+                logging.warning("Unexpected API message: %s", message)
+                continue
+            if 'Error' in result:
+                future.set_exception(EnvError(result))
+            else:
+                future.set_result(result.get('Response'))
+        if self.conn is conn:
+            self.conn = None
+        self._fail_pending(ConnectionClosed("API connection closed"))
+
+    def _fail_pending(self, error):
+        pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def close(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            conn.close()
+        self._fail_pending(ConnectionClosed("API connection closed"))
+
+    @gen.coroutine
+    def _send(self, op):
+        self._request_id += 1
+        request_id = self._request_id
+        op = dict(op, RequestId=request_id)
+        op.setdefault('Params', {})
+        future = Future()
+        self._pending[request_id] = future
+        self.conn.write_message(json.dumps(op))
+        try:
+            result = yield gen.with_timeout(
+                datetime.timedelta(seconds=self.timeout), future,
+                io_loop=self.io_loop)
+        except gen.TimeoutError:
+            self._pending.pop(request_id, None)
+            raise
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def rpc(self, op):
+        # conn is set before the Login reply, calls made in between
+        # still have to wait for it
+        if self.conn is None or self._connecting is not None:
+            yield self.connect()
+        result = yield self._send(op)
+        raise gen.Return(result)
+
+    def _client(self, request, **params):
+        return self.rpc({'Type': 'Client', 'Request': request,
+                         'Params': params})
+
+    def info(self):
+        return self._client('EnvironmentInfo')
+
+    def status(self):
+        return self._client('FullStatus')
+
+    def deploy(self, service_name, charm_url, num_units=1, config=None,
+               constraints=None, machine_spec=None):
+        return self._client(
+            'ServiceDeploy', ServiceName=service_name, CharmURL=charm_url,
+            NumUnits=num_units,
+            Config=dict((k, str(v)) for k, v in (config or {}).items()),
+            Constraints=prepare_constraints(constraints or {}),
+            ToMachineSpec=machine_spec)
+
+    def set_charm(self, service_name, charm_url, force=False):
+        return self._client('ServiceSetCharm', ServiceName=service_name,
+                            CharmUrl=charm_url, Force=force)
+
+    def set_config(self, service_name, config):
+        return self._client(
+            'ServiceSet', ServiceName=service_name,
+            Options=dict((k, str(v)) for k, v in config.items()))
+
+    def unset_config(self, service_name, config_keys):
+        return self._client('ServiceUnset', ServiceName=service_name,
+                            Options=config_keys)
+
+    def set_constraints(self, service_name, constraints):
+        return self._client('SetServiceConstraints',
+                            ServiceName=service_name,
+                            Constraints=prepare_constraints(constraints))
+
+    def expose(self, service_name):
+        return self._client('ServiceExpose', ServiceName=service_name)
+
+    def unexpose(self, service_name):
+        return self._client('ServiceUnexpose', ServiceName=service_name)
+
+    def add_units(self, service_name, num_units=1):
+        return self._client('AddServiceUnits', ServiceName=service_name,
+                            NumUnits=num_units)
+
+    def remove_units(self, unit_names):
+        return self._client('DestroyServiceUnits', UnitNames=unit_names)
+
+    def destroy_service(self, service_name):
+        return self._client('ServiceDestroy', ServiceName=service_name)
+
+    def add_relation(self, endpoint_a, endpoint_b):
+        return self._client('AddRelation', Endpoints=[endpoint_a, endpoint_b])
+
+    def remove_relation(self, endpoint_a, endpoint_b):
+        return self._client('DestroyRelation',
+                            Endpoints=[endpoint_a, endpoint_b])
+
+
+def prepare_constraints(constraints):
+    constraints = dict(constraints)
+    for k in ['cpu-cores', 'cpu-power', 'mem']:
+        if constraints.get(k):
+            constraints[k] = int(constraints[k])
+    return constraints
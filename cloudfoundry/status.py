@@ -0,0 +1,190 @@
+"""
+Compact view of a juju status snapshot.
+
+env.status() returns nested dicts carrying every field the API knows
+about, planning only needs a few of them. A Snapshot parses the status
+once into slotted Service, Unit and Relation records with interned
+names, and indexes the lookups the planner makes, so large environments
+neither keep the raw status around nor walk it per query.
+"""
+
+
+def _intern(name):
+    # juju names are ascii, anything else is kept as given
+    try:
+        return intern(str(name))
+    except (UnicodeEncodeError, TypeError):
+        return name
+
+
+def endpoint(service, relation):
+    return _intern('%s:%s' % (service, relation))
+
+
+class Unit(object):
+    __slots__ = ('name', 'service', 'number', 'machine', 'life',
+                 'agent_state', 'public_address')
+
+    def __init__(self, name, machine=None, life='', agent_state=None,
+                 public_address=None):
+        self.name = _intern(name)
+        service, number = name.rsplit('/', 1)
+        self.service = _intern(service)
+        self.number = int(number)
+        self.machine = machine
+        self.life = life
+        self.agent_state = agent_state
+        self.public_address = public_address
+
+    @classmethod
+    def parse(cls, name, data):
+        return cls(name, data.get('Machine'), data.get('Life') or '',
+                   data.get('AgentState'), data.get('PublicAddress'))
+
+    @property
+    def alive(self):
+        return self.life not in ('dying', 'dead')
+
+    def __repr__(self):
+        return '<Unit %s>' % self.name
+
+
+class Relation(object):
+    """
+    One side of a relation as status reports it, `remotes` are the
+    services at the other end.
+    """
+    __slots__ = ('service', 'name', 'remotes')
+
+    def __init__(self, service, name, remotes):
+        self.service = _intern(service)
+        self.name = _intern(name)
+        self.remotes = tuple(_intern(r) for r in remotes)
+
+    @property
+    def endpoint(self):
+        return endpoint(self.service, self.name)
+
+    def __repr__(self):
+        return '<Relation %s %s>' % (self.endpoint, ','.join(self.remotes))
+
+
+class Service(object):
+    __slots__ = ('name', 'charm', 'exposed', 'life', 'units', 'relations')
+
+    def __init__(self, name, charm=None, exposed=False, life='', units=(),
+                 relations=()):
+        self.name = _intern(name)
+        self.charm = charm
+        self.exposed = exposed
+        self.life = life
+        self.units = tuple(sorted(units, key=lambda u: u.number))
+        self.relations = tuple(relations)
+
+    @classmethod
+    def parse(cls, name, data):
+        units = [Unit.parse(n, u) for n, u in
+                 (data.get('Units') or {}).items()]
+        relations = [Relation(name, r, remotes) for r, remotes in
+                     sorted((data.get('Relations') or {}).items())]
+        return cls(name, data.get('Charm'), bool(data.get('Exposed')),
+                   data.get('Life') or '', units, relations)
+
+    def alive_units(self):
+        return [u for u in self.units if u.alive]
+
+    def __repr__(self):
+        return '<Service %s>' % self.name
+
+
+class Snapshot(object):
+    """Services and units of a status by name."""
+    __slots__ = ('services', 'units', '_relation_index')
+
+    def __init__(self, services=()):
+        self.services = dict((s.name, s) for s in services)
+        self.units = dict((u.name, u) for s in services for u in s.units)
+        self._relation_index = None
+
+    @classmethod
+    def parse(cls, real):
+        return cls([Service.parse(name, data) for name, data in
+                    ((real or {}).get('Services') or {}).items()])
+
+    @property
+    def relation_index(self):
+        if self._relation_index is None:
+            self._relation_index = RelationIndex(self)
+        return self._relation_index
+
+
+def snapshot(real):
+    """Parse a raw status, snapshots are passed through."""
+    if isinstance(real, Snapshot):
+        return real
+    return Snapshot.parse(real)
+
+
+class RelationIndex(object):
+    """
+    Normalized view of the relations in a status snapshot.
+
+    Relations are kept as sorted ('service:relation', 'service:relation')
+    pairs, so expected relations can be matched with set operations
+    instead of walking the status for each of them.
+    """
+    def __init__(self, reality):
+        self.reality = reality
+        halves = {}
+        for service in snapshot(reality).services.values():
+            for relation in service.relations:
+                for remote in relation.remotes:
+                    halves.setdefault((service.name, remote), set()).add(
+                        relation.name)
+        self.pairs = set()
+        # service level pairs to the full pairs between them,
+        # used to resolve endpoints given without a relation name
+        self.services = {}
+        for (service, remote), relations in halves.items():
+            for relation in relations:
+                for remote_relation in halves.get((remote, service), ()):
+                    pair = tuple(sorted((endpoint(service, relation),
+                                         endpoint(remote, remote_relation))))
+                    self.pairs.add(pair)
+                    self.services.setdefault(
+                        tuple(sorted((service, remote))), set()).add(pair)
+
+    def resolve(self, end_a, end_b):
+        """
+        Return the normalized pair in reality matching the expected
+        endpoints or None when the relation does not exist.
+        """
+        pair = tuple(sorted((end_a, end_b)))
+        if pair in self.pairs:
+            return pair
+        if ':' in end_a and ':' in end_b:
+            return None
+        names = tuple(sorted((end_a.split(':', 1)[0], end_b.split(':', 1)[0])))
+        for candidate in sorted(self.services.get(names, ())):
+            if all(':' not in e or e in candidate for e in pair):
+                return candidate
+        return None
+
+    def __contains__(self, pair):
+        return self.resolve(*pair) is not None
+
+    def diff(self, expected):
+        """
+        Compare flattened expected relations against reality, returning
+        the (adds, removes) sets. Adds are expected pairs as given,
+        removes are normalized pairs present only in reality.
+        """
+        adds = set()
+        found = set()
+        for rel in expected:
+            match = self.resolve(*rel)
+            if match is None:
+                adds.add(rel)
+            else:
+                found.add(match)
+        return adds, self.pairs - found
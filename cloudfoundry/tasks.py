@@ -21,10 +21,15 @@ logger = logging.getLogger(__name__)
 TEMPLATES_BASE_DIR = path('/var/vcap/jobs')
 
 
+def runtime_dir():
+    # slim charms have their files where the bootstrap unpacked them
+    return os.environ.get('CF_RUNTIME_DIR') or hookenv.charm_dir()
+
+
 def install_base_dependencies():
     fetch.apt_install(packages=fetch.filter_installed_packages([
         'ruby', 'monit', 'runit', 'zip', 'unzip']))
-    gem_file = os.path.join(hookenv.charm_dir(),
+    gem_file = os.path.join(runtime_dir(),
                             'files/bosh-template-1.2611.0.pre.gem')
     host.adduser('vcap')
     enable_monit_http_interface()
@@ -0,0 +1,83 @@
+"""
+Local charm uploads, skipped when the controller already has them.
+
+Generated archives are named by their sha256 (see charmgen.archive).
+The charm url each one got is recorded per environment next to the
+archives, and an archive recorded for an environment whose controller
+still knows that charm url is not sent again.
+"""
+import json
+import logging
+import os
+import threading
+
+from jujuclient import EnvError
+
+from charmgen.archive import ARCHIVES, archive_digest, load_index
+
+LEDGER = 'uploads.json'
+_lock = threading.Lock()
+
+
+def _load(fn):
+    try:
+        with open(fn) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def environment_key(env):
+    return info_key(env.info())
+
+
+def info_key(info):
+    # of an EnvironmentInfo response
+    info = info or {}
+    return info.get('UUID') or info.get('Name') or 'default'
+
+
+def needs_upload(build_dir, charm_name, charm_url, key):
+    """
+    Whether the generated archive of a charm is not the one the ledger
+    recorded as `charm_url` in environment `key`, ie. the charm was
+    regenerated since. False for charms without an archive.
+    """
+    name = load_index(build_dir).get(charm_name)
+    if not name:
+        return False
+    with _lock:
+        ledger = _load(os.path.join(build_dir, ARCHIVES, LEDGER))
+    return ledger.get(key, {}).get(archive_digest(name)) != charm_url
+
+
+def upload_archive(env, archive, series):
+    """
+    Make the charm in `archive` available to the environment, returning
+    its charm url and whether it had to be uploaded.
+    """
+    digest = archive_digest(archive)
+    ledger_fn = os.path.join(os.path.dirname(archive), LEDGER)
+    key = environment_key(env)
+    with _lock:
+        charm_url = _load(ledger_fn).get(key, {}).get(digest)
+    if charm_url:
+        try:
+            env.get_charm(charm_url)
+            logging.debug("%s already uploaded as %s", digest, charm_url)
+            return charm_url, False
+        except EnvError:
+            # the controller lost it, a new environment with our name...
+            logging.info("Uploading %s again, %s is gone", digest, charm_url)
+    size = os.path.getsize(archive)
+    with open(archive, 'rb') as fp:
+        result = env.add_local_charm(fp, series, size)
+    charm_url = isinstance(result, dict) and result.get('CharmURL') or None
+    if charm_url:
+        with _lock:
+            ledger = _load(ledger_fn)
+            ledger.setdefault(key, {})[digest] = charm_url
+            with open(ledger_fn + '.tmp', 'w') as fp:
+                json.dump(ledger, fp, indent=2, sort_keys=True)
+            os.rename(ledger_fn + '.tmp', ledger_fn)
+    return charm_url, True
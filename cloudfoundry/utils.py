@@ -36,6 +36,24 @@ def flatten_relations(rels):
     return set(result)
 
 
+def remove_service_relations(rels, service_name):
+    """Drop the endpoints of a service from bundle style relations."""
+    def other(ep):
+        return ep.split(':', 1)[0] != service_name
+    result = []
+    for a, b in rels:
+        if not other(a):
+            continue
+        if isinstance(b, list):
+            b = [ep for ep in b if other(ep)]
+            if not b:
+                continue
+        elif not other(b):
+            continue
+        result.append([a, b])
+    return result
+
+
 def flatten_reality(real):
     result = set()
     for s, d in real['Services'].items():
@@ -117,10 +135,112 @@ class NestedDict(dict):
 
         return dict.__getitem__(o, key)
 
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
     def update(self, other):
         deepmerge(self, other)
 
 
+class PatchError(ValueError):
+    pass
+
+
+def json_pointer(pointer):
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise PatchError('Invalid pointer: %s' % pointer)
+    return [p.replace('~1', '/').replace('~0', '~')
+            for p in pointer[1:].split('/')]
+
+
+def _resolve(doc, parts):
+    for part in parts:
+        if isinstance(doc, list):
+            try:
+                doc = doc[int(part)]
+            except (ValueError, IndexError):
+                raise PatchError('Invalid index: %s' % part)
+        elif isinstance(doc, dict) and part in doc:
+            doc = doc[part]
+        else:
+            raise PatchError('Missing key: %s' % part)
+    return doc
+
+
+def _add(doc, parts, value):
+    parent = _resolve(doc, parts[:-1])
+    key = parts[-1]
+    if isinstance(parent, list):
+        if key == '-':
+            parent.append(value)
+        else:
+            try:
+                index = int(key)
+            except ValueError:
+                raise PatchError('Invalid index: %s' % key)
+            if not 0 <= index <= len(parent):
+                raise PatchError('Invalid index: %s' % key)
+            parent.insert(index, value)
+    elif isinstance(parent, dict):
+        parent[key] = value
+    else:
+        raise PatchError('Cannot add to %s' % '/'.join(parts))
+
+
+def _remove(doc, parts):
+    parent = _resolve(doc, parts[:-1])
+    value = _resolve(parent, parts[-1:])
+    if isinstance(parent, list):
+        del parent[int(parts[-1])]
+    else:
+        del parent[parts[-1]]
+    return value
+
+
+def json_patch(doc, ops):
+    """
+    Apply an RFC 6902 JSON Patch to a copy of `doc` and return it.
+
+    Raises PatchError if any operation fails, in which case `doc`
+    is left untouched.
+    """
+    doc = copy.deepcopy(doc)
+    for op in ops:
+        try:
+            kind = op['op']
+            parts = json_pointer(op['path'])
+        except KeyError, e:
+            raise PatchError('Missing %s in %s' % (e, op))
+        if not parts and kind != 'test':
+            # replacing the whole document is a POST
+            raise PatchError('Cannot %s the document root' % kind)
+        if kind == 'add':
+            _add(doc, parts, copy.deepcopy(op['value']))
+        elif kind == 'remove':
+            _remove(doc, parts)
+        elif kind == 'replace':
+            _remove(doc, parts)
+            _add(doc, parts, copy.deepcopy(op['value']))
+        elif kind in ('move', 'copy'):
+            source = json_pointer(op['from'])
+            if kind == 'move':
+                value = _remove(doc, source)
+            else:
+                value = copy.deepcopy(_resolve(doc, source))
+            _add(doc, parts, value)
+        elif kind == 'test':
+            if _resolve(doc, parts) != op['value']:
+                raise PatchError('Test failed: %s' % op['path'])
+        else:
+            raise PatchError('Unknown op: %s' % kind)
+    return doc
+
+
 def parse_config(conf_fn, defaults=None):
     with open(conf_fn, 'r') as fp:
         conf = NestedDict()
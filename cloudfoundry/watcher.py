@@ -0,0 +1,75 @@
+import logging
+import threading
+import time
+
+import tornado.ioloop
+
+
+class EnvironmentWatcher(threading.Thread):
+    """
+    Follow the Juju AllWatcher delta stream in a background thread and hand
+    each batch of deltas to `callback(deltas, initial)` on the IOLoop.
+    `initial` is True for the first batch of each (re)connected watch, which
+    carries the complete environment rather than a change.
+
+    The jujuclient watcher is blocking, so it gets a thread and a
+    connection of its own, made by `connect` for each watch, outside the
+    pool and rate limits tactics go through. The callback itself always
+    runs on the IOLoop thread and is free to touch the StateDatabase.
+    """
+    def __init__(self, connect, callback, io_loop=None, retry_interval=1,
+                 max_retry_interval=30):
+        super(EnvironmentWatcher, self).__init__(name='juju-watcher')
+        self.daemon = True
+        self.connect = connect
+        self.callback = callback
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.instance()
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.running = False
+        self._watch = None
+        self._env = None
+
+    def run(self):
+        self.running = True
+        interval = self.retry_interval
+        while self.running:
+            try:
+                self._env = self.connect()
+                self._watch = self._env.get_watch(connection=self._env)
+                interval = self.retry_interval
+                initial = True
+                for deltas in self._watch:
+                    if not self.running:
+                        break
+                    self.io_loop.add_callback(self.callback, deltas, initial)
+                    initial = False
+                self._close()
+            except Exception:
+                if not self.running:
+                    break
+                logging.warning("Watcher failed, restarting in %ss",
+                                interval, exc_info=True)
+                self._close()
+                time.sleep(interval)
+                interval = min(interval * 2, self.max_retry_interval)
+        self._close()
+
+    def _close(self):
+        watch, env = self._watch, self._env
+        self._watch = self._env = None
+        if watch is not None:
+            try:
+                watch.stop()
+            except Exception:
+                logging.debug("Error stopping watcher", exc_info=True)
+        if env is not None:
+            try:
+                env.close()
+            except Exception:
+                logging.debug("Error closing watcher connection",
+                              exc_info=True)
+
+    def stop(self):
+        self.running = False
+        self._close()
@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 
+import multiprocessing
 import os
 import yaml
-import shutil
 import subprocess
 
 from charmhelpers.core import hookenv
@@ -47,12 +47,37 @@ def generate(s):
     version = config.get('cf_version')
     if not version or version == 'latest':
         version = RELEASES[0]['releases'][1]
-    build_dir = os.path.join(hookenv.charm_dir(), 'build', str(version))
-    if os.path.exists(build_dir):
-        shutil.rmtree(build_dir)
+    build_root = os.path.join(hookenv.charm_dir(), 'build')
+    build_dir = os.path.join(build_root, str(version))
     generator = CharmGenerator(RELEASES, SERVICES)
     generator.select_release(version)
-    generator.generate(build_dir)
+    # only charms whose inputs changed since the last hook are rewritten,
+    # their shared files are linked from a store all releases use
+    changed = generator.generate(
+        build_dir, config.get('generate_jobs') or multiprocessing.cpu_count(),
+        store=os.path.join(build_root, '.store'),
+        slim=config.get('slim_charms', False))
+    hookenv.log('Generated charms: {}'.format(
+        ', '.join(os.path.basename(c) for c in changed) or 'none changed'))
+
+
+def publish_runtime(s):
+    # slim charms fetch their runtime from our nginx, by its content name
+    config = hookenv.config()
+    version = config.get('cf_version')
+    if not version or version == 'latest':
+        version = RELEASES[0]['releases'][1]
+    build_dir = path(hookenv.charm_dir()) / 'build' / str(version)
+    runtime_dir = build_dir / 'runtime'
+    if not runtime_dir.exists():
+        return
+    base_path = path('/var/www') / 'runtime'
+    base_path.makedirs_p(mode=0755)
+    for tarball in runtime_dir.files('*.tgz'):
+        target = base_path / tarball.basename()
+        if not target.exists():
+            tarball.copy(target + '.tmp')
+            (target + '.tmp').rename(target)
 
 
 def deploy(s):
@@ -165,6 +190,7 @@ def manage():
                 cache_unit_addresses,
                 precache_job_artifacts,
                 generate,
+                publish_runtime,
                 deploy,
             ],
             'start': [],
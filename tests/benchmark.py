@@ -0,0 +1,141 @@
+"""
+Reconciler load benchmark against the in-process fake environment.
+
+Plans and runs a synthetic bundle of many services and relations through
+StateDatabase and Strategy, then replans the converged environment, and
+reports how long each phase took::
+
+    PYTHONPATH=.:charmgen python -m tests.benchmark --services 2000 \\
+        --relations 4000 --width 16 --latency 0.001
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import tornado.ioloop
+from tornado.concurrent import Future
+
+from cloudfoundry import events
+from cloudfoundry import model
+from cloudfoundry.releases import RELEASES
+from cloudfoundry.services import SERVICES
+from charmgen.generator import CharmGenerator
+from tests.fakejuju import FakeEnvironment
+
+
+def synthetic_bundle(services, relations, units=1, seed=None):
+    rand = random.Random(seed)
+    names = ['svc-%d' % i for i in range(services)]
+    bundle = {'services': {}, 'relations': []}
+    for name in names:
+        # pinned, so nothing asks the charm store for a revision
+        bundle['services'][name] = {'charm': 'cs:trusty/%s-1' % name,
+                                    'num_units': units}
+    pairs = set()
+    while len(pairs) < min(relations, services * (services - 1) / 2):
+        a, b = sorted(rand.sample(names, 2))
+        pairs.add((a, b))
+    for i, (a, b) in enumerate(sorted(pairs)):
+        bundle['relations'].append(['%s:rel-%d' % (a, i),
+                                    '%s:rel-%d' % (b, i)])
+    return bundle
+
+
+def wait_retired():
+    future = Future()
+
+    def listener(event):
+        if event['type'] == 'retired' and not future.done():
+            future.set_result(event)
+    events.bus.subscribe(listener)
+    future.add_done_callback(lambda f: events.bus.unsubscribe(listener))
+    return future
+
+
+def run(services=100, relations=200, units=1, width=4, latency=0,
+        failure_rate=0, seed=None, timeout=3600):
+    env = FakeEnvironment(latency=latency, failure_rate=failure_rate,
+                          seed=seed)
+
+    class Database(model.StateDatabase):
+        @classmethod
+        def get_env(cls, *args, **kwargs):
+            return env
+
+    repo = tempfile.mkdtemp()
+    # generated up front, GenerateTactic then finds nothing changed
+    version = RELEASES[0]['releases'][1]
+    generator = CharmGenerator(RELEASES, SERVICES)
+    generator.select_release(version)
+    generator.generate(os.path.join(repo, str(version)))
+    db = Database({
+        'juju.environment': 'fake',
+        'credentials.user': 'user-admin',
+        'credentials.password': 'fake',
+        'server.repository': repo,
+        'reconciler.width': width,
+        'reconciler.workers': width,
+        'reconciler.status_ttl': None,
+    })
+    results = collections.OrderedDict()
+    try:
+        db.push(synthetic_bundle(services, relations, units, seed))
+
+        start = time.time()
+        db.build_strategy(db.real)
+        results['plan_seconds'] = time.time() - start
+        results['tactics'] = len(db.strategy)
+
+        io_loop = tornado.ioloop.IOLoop.instance()
+        start = time.time()
+        retired = wait_retired()
+        io_loop.add_callback(db.execute_strategy)
+        io_loop.run_sync(lambda: retired, timeout=timeout)
+        results['run_seconds'] = time.time() - start
+        results['tactics_per_second'] = (
+            results['tactics'] / max(results['run_seconds'], 1e-9))
+        summary = db.history[-1]
+        results['state'] = model.STATES[summary.state]
+        results['failed'] = len([t for t in summary.tactics
+                                 if t.state == model.FAILED])
+        results['api_calls'] = dict(collections.Counter(env.calls))
+
+        # everything again against the converged environment
+        db.invalidate()
+        db.touch()
+        start = time.time()
+        db.build_strategy(db.real)
+        results['replan_seconds'] = time.time() - start
+        results['replan_tactics'] = len(db.strategy)
+    finally:
+        db.executor.shutdown(wait=False)
+        shutil.rmtree(repo)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--services', type=int, default=1000)
+    parser.add_argument('--relations', type=int, default=2000)
+    parser.add_argument('--units', type=int, default=1)
+    parser.add_argument('--width', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to every api call')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='chance of an api call failing transiently')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    print json.dumps(run(args.services, args.relations, args.units,
+                         args.width, args.latency, args.failure_rate,
+                         args.seed), indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+In-process stand-in for a jujuclient Environment.
+
+Keeps an environment in the juju status format, seeded from
+tests/status.json, and applies the calls the reconciler makes to it.
+Each call can be slowed down by `latency` seconds and made to fail with
+probability `failure_rate`, raising `failure()`; both can be set per
+call name with the `latencies` and `failure_rates` dicts.
+"""
+import copy
+import json
+import os
+import pkg_resources
+import random
+import threading
+import time
+import zipfile
+
+import yaml
+from jujuclient import EnvError
+
+
+def load_status():
+    return json.loads(pkg_resources.resource_string(__name__, 'status.json'))
+
+
+def transient_failure():
+    return EnvError({'Error': 'connection is shut down'})
+
+
+class FakeEnvironment(object):
+    def __init__(self, status=None, latency=0, failure_rate=0,
+                 failure=transient_failure, seed=None):
+        self.state = status if status is not None else load_status()
+        self.latency = latency
+        self.latencies = {}
+        self.failure_rate = failure_rate
+        self.failure_rates = {}
+        self.failure = failure
+        self.random = random.Random(seed)
+        self.calls = []
+        self.machines = 100
+        self.charm_revisions = {}
+        self.charms = set()
+        self._lock = threading.RLock()
+
+    def _call(self, name):
+        latency = self.latencies.get(name, self.latency)
+        if latency:
+            time.sleep(latency)
+        with self._lock:
+            self.calls.append(name)
+            rate = self.failure_rates.get(name, self.failure_rate)
+            if rate and self.random.random() < rate:
+                raise self.failure()
+
+    def _error(self, message):
+        return EnvError({'Error': message})
+
+    def _service(self, name):
+        try:
+            return self.state['Services'][name]
+        except KeyError:
+            raise self._error('service "%s" not found' % name)
+
+    def _new_unit(self, service_name):
+        service = self.state['Services'][service_name]
+        numbers = [int(u.rsplit('/', 1)[1]) for u in service['Units']]
+        self.machines += 1
+        name = '%s/%d' % (service_name, max(numbers or [-1]) + 1)
+        service['Units'][name] = {
+            'Machine': str(self.machines), 'Life': '', 'Err': None,
+            'AgentState': 'pending', 'Charm': '',
+            'PublicAddress': '10.0.%d.%d' % divmod(self.machines, 256)}
+
+    # api
+
+    def close(self):
+        pass
+
+    def info(self):
+        self._call('info')
+        return {'Name': self.state.get('EnvironmentName', 'fake')}
+
+    def status(self):
+        self._call('status')
+        with self._lock:
+            return copy.deepcopy(self.state)
+
+    def _charm_name(self, charm_file):
+        # juju reads it from the metadata in the archive
+        try:
+            with zipfile.ZipFile(charm_file) as archive:
+                return yaml.safe_load(archive.read('metadata.yaml'))['name']
+        except (zipfile.BadZipfile, KeyError):
+            name = os.path.basename(getattr(charm_file, 'name', 'charm'))
+            return os.path.splitext(name)[0].rsplit('-', 1)[0]
+
+    def add_charm(self, charm_url):
+        self._call('add_charm')
+        with self._lock:
+            self.charms.add(charm_url)
+
+    def add_local_charm(self, charm_file, series, size=None):
+        self._call('add_local_charm')
+        name = self._charm_name(charm_file)
+        with self._lock:
+            revision = self.charm_revisions.get(name, -1) + 1
+            self.charm_revisions[name] = revision
+            charm_url = 'local:%s/%s-%d' % (series, name, revision)
+            self.charms.add(charm_url)
+        return {'CharmURL': charm_url}
+
+    def get_charm(self, charm_url):
+        self._call('get_charm')
+        with self._lock:
+            if charm_url not in self.charms:
+                raise self._error('charm url "%s" not found' % charm_url)
+        return {'URL': charm_url}
+
+    def deploy(self, service_name, charm_url, num_units=1, config=None,
+               constraints=None, machine_spec=None):
+        self._call('deploy')
+        with self._lock:
+            if service_name in self.state['Services']:
+                raise self._error('service "%s" already exists'
+                                  % service_name)
+            self.state['Services'][service_name] = {
+                'Life': '', 'Err': None, 'Exposed': False,
+                'Charm': charm_url, 'Relations': {}, 'Units': {},
+                'SubordinateTo': [], 'CanUpgradeTo': '',
+                'Networks': {'Disabled': [], 'Enabled': []}}
+            for i in range(num_units):
+                self._new_unit(service_name)
+
+    def set_charm(self, service_name, charm_url, force=False):
+        self._call('set_charm')
+        with self._lock:
+            self._service(service_name)['Charm'] = charm_url
+
+    def set_config(self, service_name, config):
+        self._call('set_config')
+        self._service(service_name)
+
+    def unset_config(self, service_name, config_keys):
+        self._call('unset_config')
+        self._service(service_name)
+
+    def set_constraints(self, service_name, constraints):
+        self._call('set_constraints')
+        self._service(service_name)
+
+    def add_units(self, service_name, num_units=1):
+        self._call('add_units')
+        with self._lock:
+            self._service(service_name)
+            for i in range(num_units):
+                self._new_unit(service_name)
+
+    def remove_units(self, unit_names):
+        self._call('remove_units')
+        with self._lock:
+            for unit_name in unit_names:
+                service = self._service(unit_name.split('/')[0])
+                service['Units'].pop(unit_name, None)
+
+    def expose(self, service_name):
+        self._call('expose')
+        with self._lock:
+            self._service(service_name)['Exposed'] = True
+
+    def unexpose(self, service_name):
+        self._call('unexpose')
+        with self._lock:
+            self._service(service_name)['Exposed'] = False
+
+    def destroy_service(self, service_name):
+        self._call('destroy_service')
+        with self._lock:
+            self._service(service_name)
+            del self.state['Services'][service_name]
+            for service in self.state['Services'].values():
+                for relation, remotes in service['Relations'].items():
+                    if service_name in remotes:
+                        remotes.remove(service_name)
+                    if not remotes:
+                        del service['Relations'][relation]
+
+    def _endpoints(self, endpoint_a, endpoint_b):
+        # juju infers missing relation names, we use the other side's
+        a, _, rel_a = endpoint_a.partition(':')
+        b, _, rel_b = endpoint_b.partition(':')
+        rel_a = rel_a or rel_b or b
+        rel_b = rel_b or rel_a
+        self._service(a)
+        self._service(b)
+        return (a, rel_a), (b, rel_b)
+
+    def add_relation(self, endpoint_a, endpoint_b):
+        self._call('add_relation')
+        with self._lock:
+            (a, rel_a), (b, rel_b) = self._endpoints(endpoint_a, endpoint_b)
+            relations_a = self._service(a)['Relations'].setdefault(rel_a, [])
+            relations_b = self._service(b)['Relations'].setdefault(rel_b, [])
+            if b in relations_a:
+                raise self._error('relation already exists')
+            relations_a.append(b)
+            if a != b:
+                relations_b.append(a)
+
+    def remove_relation(self, endpoint_a, endpoint_b):
+        self._call('remove_relation')
+        with self._lock:
+            a, b = self._endpoints(endpoint_a, endpoint_b)
+            for (service, relation), (other, _) in ((a, b), (b, a)):
+                relations = self._service(service)['Relations']
+                if other in relations.get(relation, []):
+                    relations[relation].remove(other)
+                    if not relations[relation]:
+                        del relations[relation]
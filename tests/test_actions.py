@@ -0,0 +1,143 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import jujuclient
+import mock
+import tornado.ioloop
+
+from cloudfoundry import actions
+from cloudfoundry import model
+from tests.fakejuju import FakeEnvironment
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_transient_error(self):
+        self.assertTrue(actions.transient_error(socket.error()))
+        self.assertTrue(actions.transient_error(jujuclient.EnvError(
+            {'Error': 'connection is shut down'})))
+        self.assertFalse(actions.transient_error(jujuclient.EnvError(
+            {'Error': 'service "nats" not found'})))
+        self.assertFalse(actions.transient_error(ValueError()))
+
+    @mock.patch('random.uniform', lambda a, b: b)
+    def test_delay(self):
+        policy = actions.RetryPolicy(backoff=1, factor=2, max_backoff=5,
+                                     jitter=0.5)
+        self.assertEqual([policy.delay(n) for n in range(1, 5)],
+                         [1.5, 3.0, 6.0, 7.5])
+
+    def test_should_retry(self):
+        policy = actions.RetryPolicy(max_attempts=2)
+        tactic = actions.AddUnitsTactic(service_name='nats', num_units=1)
+        env = mock.Mock()
+        env.add_units.side_effect = socket.error()
+        tactic.run(env)
+        self.assertTrue(policy.should_retry(tactic))
+        tactic.state = actions.PENDING
+        tactic.run(env)
+        self.assertFalse(policy.should_retry(tactic))
+        self.assertFalse(actions.GenerateTactic.retry.should_retry(tactic))
+
+
+def lose_answers(env, name, times=None):
+    # the call goes through, but its answer never arrives
+    call = getattr(env, name)
+    lost = []
+
+    def timeout(*args, **kwargs):
+        result = call(*args, **kwargs)
+        if times is None or len(lost) < times:
+            lost.append(args)
+            raise socket.timeout('timed out')
+        return result
+    setattr(env, name, timeout)
+
+
+class TestRetryAfterPartialSuccess(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+
+    def run_tactic(self, tactic):
+        s = model.Strategy(self.env)
+        s.append(tactic)
+        # retry without waiting
+        with mock.patch('random.uniform', lambda a, b: 0):
+            tornado.ioloop.IOLoop().run_sync(lambda: s()[0])
+        return tactic
+
+    def test_deploy_not_repeated(self):
+        lose_answers(self.env, 'expose')
+        tactic = self.run_tactic(actions.DeployTactic(service={
+            'service_name': 'uaa', 'charm': 'cs:trusty/uaa-3',
+            'expose': True}, repo='build'))
+        self.assertEqual(tactic.state, actions.FAILED)
+        self.assertEqual(self.env.calls.count('deploy'), 1)
+        self.assertIn('uaa', self.env.status()['Services'])
+
+    def test_add_units_not_repeated(self):
+        units = len(self.env.status()['Services']['nats']['Units'])
+        lose_answers(self.env, 'add_units')
+        tactic = self.run_tactic(actions.AddUnitsTactic(
+            service_name='nats', num_units=2))
+        self.assertEqual(tactic.state, actions.FAILED)
+        self.assertEqual(
+            len(self.env.status()['Services']['nats']['Units']), units + 2)
+
+    def test_add_relation_not_repeated(self):
+        lose_answers(self.env, 'add_relation')
+        tactic = self.run_tactic(actions.AddRelationTactic(
+            endpoint_a='cc:db', endpoint_b='mysql'))
+        self.assertEqual(tactic.state, actions.FAILED)
+        self.assertEqual(self.env.calls.count('add_relation'), 1)
+
+    def test_remove_units_not_repeated(self):
+        unit = sorted(self.env.status()['Services']['nats']['Units'])[0]
+        lose_answers(self.env, 'remove_units')
+        tactic = self.run_tactic(actions.RemoveUnitsTactic(
+            unit_names=[unit]))
+        self.assertEqual(tactic.state, actions.FAILED)
+        self.assertEqual(self.env.calls.count('remove_units'), 1)
+
+    def test_expose_repeated(self):
+        lose_answers(self.env, 'expose', times=1)
+        tactic = self.run_tactic(actions.ExposeTactic(service_name='nats'))
+        self.assertEqual(tactic.state, actions.COMPLETE)
+        self.assertEqual(tactic.attempts, 2)
+        self.assertTrue(self.env.status()['Services']['nats']['Exposed'])
+
+
+class TestGenerateTactic(unittest.TestCase):
+    def test_regenerates_changed_charms(self):
+        repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, repo)
+        tactic = actions.GenerateTactic(repo=repo)
+        tactic.run(None)
+        self.assertEqual(tactic.state, actions.COMPLETE)
+        self.assertIn('nats-v1', tactic.changed)
+        version = str(actions.RELEASES[0]['releases'][1])
+        charms = os.path.join(repo, version, 'trusty')
+        stamp = os.path.join(charms, 'uaa-v1', 'stamp')
+        open(stamp, 'w').close()
+        shutil.rmtree(os.path.join(charms, 'nats-v1'))
+        # an existing build dir is no longer taken as up to date
+        tactic = actions.GenerateTactic(repo=repo)
+        tactic.run(None)
+        self.assertEqual(tactic.changed, ['nats-v1'])
+        self.assertTrue(os.path.isdir(os.path.join(charms, 'nats-v1')))
+        self.assertTrue(os.path.exists(stamp))
+
+    @mock.patch('multiprocessing.cpu_count', lambda: 8)
+    @mock.patch('charmgen.generator.CharmGenerator.generate')
+    def test_jobs(self, generate):
+        generate.return_value = []
+        actions.GenerateTactic(repo='build', jobs=3).run(None)
+        self.assertEqual(generate.call_args[0][1], 3)
+        actions.GenerateTactic(repo='build', jobs=0).run(None)
+        self.assertEqual(generate.call_args[0][1], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
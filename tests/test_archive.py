@@ -0,0 +1,209 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zipfile
+
+import mock
+
+from charmgen import archive
+from charmgen.generator import CharmGenerator
+from cloudfoundry import actions
+from cloudfoundry import delta
+from cloudfoundry import uploads
+from cloudfoundry.api import APIEnvironment
+from tests.fakejuju import FakeEnvironment
+from tests.release1 import RELEASES, SERVICES
+
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.build = os.path.join(self.tmpdir, 'build')
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        g.generate(self.build)
+        self.charm = os.path.join(self.build, 'trusty', 'router_v1')
+
+
+class TestArchive(ArchiveTest):
+    def test_reproducible(self):
+        archive_dir = os.path.join(self.tmpdir, 'archives')
+        first = archive.make_archive(self.charm, archive_dir)
+        later = time.time() + 3600
+        for name in ('metadata.yaml', 'hooks/entry.py'):
+            os.utime(os.path.join(self.charm, name), (later, later))
+        self.assertEqual(archive.make_archive(self.charm, archive_dir), first)
+        self.assertEqual(os.listdir(archive_dir), [os.path.basename(first)])
+
+        with zipfile.ZipFile(first) as zf:
+            infos = zf.infolist()
+        names = [i.filename for i in infos]
+        self.assertIn('metadata.yaml', names)
+        # hooks are symlinks to entry.py, archived with its contents
+        self.assertIn('hooks/start', names)
+        self.assertTrue(all(i.date_time == archive.FIXED_TIME
+                            for i in infos))
+        self.assertFalse([n for n in names if n.endswith('.pyc')])
+        entry, = [i for i in infos if i.filename == 'hooks/entry.py']
+        self.assertEqual(entry.external_attr >> 16 & 0777, 0755)
+
+    def test_content_change(self):
+        archive_dir = os.path.join(self.tmpdir, 'archives')
+        first = archive.make_archive(self.charm, archive_dir)
+        with open(os.path.join(self.charm, 'README'), 'w') as fp:
+            fp.write('new')
+        self.assertNotEqual(archive.make_archive(self.charm, archive_dir),
+                            first)
+
+    def test_generated_archives(self):
+        index = archive.load_index(self.build)
+        self.assertEqual(sorted(index), [
+            'cc_clock_v1', 'cloud_controller_v1', 'router_v1'])
+        path = archive.charm_archive(self.build, 'trusty', 'router_v1')
+        self.assertEqual(os.path.basename(path), index['router_v1'])
+        self.assertEqual(archive.archive_digest(path),
+                         index['router_v1'][:-4])
+
+    def test_update_archives(self):
+        index = archive.load_index(self.build)
+        old = index['router_v1']
+        with open(os.path.join(self.charm, 'README'), 'w') as fp:
+            fp.write('new')
+        updated = archive.update_archives(
+            self.build, 'trusty', ['cloud_controller_v1', 'router_v1'],
+            changed=['router_v1'])
+        self.assertNotEqual(updated['router_v1'], old)
+        self.assertEqual(updated['cloud_controller_v1'],
+                         index['cloud_controller_v1'])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.build, 'archives'))),
+            sorted(updated.values() + ['index.json']))
+
+
+class TestUploads(ArchiveTest):
+    def setUp(self):
+        super(TestUploads, self).setUp()
+        self.env = FakeEnvironment()
+        self.archive = archive.charm_archive(self.build, 'trusty',
+                                             'router_v1')
+
+    def test_skips_known_uploads(self):
+        self.assertEqual(uploads.upload_archive(self.env, self.archive,
+                                                'trusty'),
+                         ('local:trusty/router_v1-0', True))
+        self.assertEqual(uploads.upload_archive(self.env, self.archive,
+                                                'trusty'),
+                         ('local:trusty/router_v1-0', False))
+        self.assertEqual(self.env.calls.count('add_local_charm'), 1)
+
+    def test_uploads_what_the_controller_lost(self):
+        uploads.upload_archive(self.env, self.archive, 'trusty')
+        self.env.charms.clear()
+        self.assertEqual(uploads.upload_archive(self.env, self.archive,
+                                                'trusty'),
+                         ('local:trusty/router_v1-1', True))
+
+    def test_update_charm_tactic(self):
+        repo = os.path.join(self.tmpdir, 'repo')
+        version = str(actions.RELEASES[0]['releases'][1])
+        shutil.copytree(self.build, os.path.join(repo, version),
+                        symlinks=True)
+        tactics = [actions.UpdateCharmTactic(
+            charm_url='local:trusty/router_v1-0', repo=repo)
+            for i in range(2)]
+        for tactic in tactics:
+            tactic.run(self.env)
+            self.assertEqual(tactic.state, actions.COMPLETE)
+            self.assertEqual(tactic.charm_url, 'local:trusty/router_v1-0')
+        self.assertEqual(self.env.calls.count('add_local_charm'), 1)
+
+    def test_upgrades_regenerated_charm(self):
+        repo = os.path.join(self.tmpdir, 'repo')
+        build = os.path.join(repo, str(actions.RELEASES[0]['releases'][1]))
+        shutil.copytree(self.build, build, symlinks=True)
+        url, _ = uploads.upload_archive(
+            self.env, archive.charm_archive(build, 'trusty', 'router_v1'),
+            'trusty')
+        key = uploads.environment_key(self.env)
+        self.assertFalse(uploads.needs_upload(build, 'router_v1', url, key))
+        self.assertTrue(uploads.needs_upload(build, 'router_v1', url, 'x'))
+        self.assertFalse(uploads.needs_upload(build, 'nats_v1', url, key))
+
+        self.env.state['Services']['router']['Charm'] = url
+        expected = {'services': {'router': {
+            'charm': 'router_v1', 'branch': 'local:trusty/router_v1'}}}
+
+        def plan():
+            tactics = delta.build_services(expected, expected,
+                                           self.env.status(), repo,
+                                           env_key=key)
+            return [t for t in tactics if isinstance(
+                t, (actions.UpdateCharmTactic, actions.UpgradeCharmTactic))]
+        self.assertEqual(plan(), [])
+
+        with open(os.path.join(build, 'trusty', 'router_v1', 'README'),
+                  'w') as fp:
+            fp.write('new')
+        archive.update_archives(build, 'trusty',
+                                sorted(archive.load_index(build)),
+                                changed=['router_v1'])
+        update, upgrade = plan()
+        self.assertEqual(upgrade.depends, [update])
+        update.run(self.env)
+        upgrade.run(self.env)
+        self.assertEqual(self.env.state['Services']['router']['Charm'],
+                         'local:trusty/router_v1-1')
+        self.assertEqual(plan(), [])
+
+    @mock.patch('cloudfoundry.actions.get_qualified_charm_url',
+                lambda url: url + '-7')
+    def test_update_store_charm(self):
+        tactic = actions.UpdateCharmTactic(charm_url='cs:trusty/mysql')
+        tactic.run(self.env)
+        self.assertEqual(tactic.state, actions.COMPLETE)
+        self.assertEqual(tactic.charm_url, 'cs:trusty/mysql-7')
+        self.assertIn('cs:trusty/mysql-7', self.env.charms)
+
+    def test_update_unrevisioned_charm(self):
+        repo = os.path.join(self.tmpdir, 'repo')
+        version = str(actions.RELEASES[0]['releases'][1])
+        shutil.copytree(self.build, os.path.join(repo, version),
+                        symlinks=True)
+        # as planned, without asking the charm store
+        with mock.patch('cloudfoundry.actions.get_qualified_charm_url',
+                        side_effect=AssertionError):
+            tactic = actions.UpdateCharmTactic(
+                charm_url='local:trusty/router_v1', repo=repo)
+            tactic.run(self.env)
+        self.assertEqual(tactic.state, actions.COMPLETE)
+        self.assertEqual(tactic.charm_url, 'local:trusty/router_v1-0')
+
+    def test_deploy_uploaded_revision(self):
+        repo = os.path.join(self.tmpdir, 'repo')
+        version = str(actions.RELEASES[0]['releases'][1])
+        shutil.copytree(self.build, os.path.join(repo, version),
+                        symlinks=True)
+        self.env.charm_revisions['router_v1'] = 4
+        update = actions.UpdateCharmTactic(
+            charm_url='local:trusty/router_v1-0', repo=repo)
+        deploy = actions.DeployTactic(depends=[update], service={
+            'service_name': 'router-b', 'charm': 'router_v1',
+            'branch': 'local:trusty/router_v1'}, repo=repo)
+        update.run(self.env)
+        deploy.run(self.env)
+        self.assertEqual(deploy.state, actions.COMPLETE)
+        self.assertEqual(self.env.status()['Services']['router-b']['Charm'],
+                         'local:trusty/router_v1-5')
+
+    def test_api_deploy(self):
+        env = APIEnvironment('wss://localhost:17070', 'secret')
+        env.client = self.env
+        with mock.patch.object(self.env, 'deploy') as deploy:
+            env.deploy('router', 'local:trusty/router_v1-3', repo=self.build)
+            env.deploy('other', 'local:trusty/router_v1-3', repo=self.build)
+        self.assertEqual(self.env.calls.count('add_local_charm'), 1)
+        self.assertEqual(deploy.call_args[0],
+                         ('other', 'local:trusty/router_v1-0'))
@@ -0,0 +1,85 @@
+import socket
+import unittest
+
+import mock
+
+from cloudfoundry import connection
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.clients = []
+        self.pool = connection.ConnectionPool(self.connect, size=2,
+                                              timeout=5, wait=0.01)
+
+    def connect(self):
+        client = mock.Mock()
+        client.conn.connected = True
+        self.clients.append(client)
+        return client
+
+    def test_reuse(self):
+        with self.pool.connection() as client:
+            client.conn.settimeout.assert_called_once_with(5)
+        with self.pool.connection() as again:
+            self.assertIs(again, client)
+        self.assertEqual(self.pool.connects, 1)
+
+    def test_size(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        self.assertIsNot(a, b)
+        self.assertRaises(connection.PoolTimeout, self.pool.acquire)
+        self.pool.release(a)
+        self.assertIs(self.pool.acquire(), a)
+
+    def test_broken_connection_replaced(self):
+        def fail():
+            client.conn.connected = False
+            raise socket.error('reset')
+        with self.pool.connection() as client:
+            client.status.side_effect = fail
+        self.assertRaises(socket.error, self.pool.call, 'status')
+        client.close.assert_called_once_with()
+        self.assertIsNot(self.pool.acquire(), client)
+        self.assertIsNot(self.pool.acquire(), client)
+
+    def test_dropped_while_idle(self):
+        with self.pool.connection() as client:
+            pass
+        client.conn.connected = False
+        with self.pool.connection() as again:
+            self.assertIsNot(again, client)
+
+    def test_health_check(self):
+        self.pool.check_interval = 0
+        with self.pool.connection() as client:
+            pass
+        client.info.side_effect = socket.error('reset')
+        with self.pool.connection() as again:
+            self.assertIsNot(again, client)
+        with self.pool.connection() as pinged:
+            self.assertIs(pinged, again)
+        again.info.assert_called_once_with()
+
+    def test_connect_failure_frees_slot(self):
+        self.pool.factory = mock.Mock(side_effect=socket.error('refused'))
+        for i in range(3):
+            self.assertRaises(socket.error, self.pool.acquire)
+
+    def test_pooled_environment(self):
+        env = connection.PooledEnvironment(self.pool)
+        self.assertEqual(env.status(), self.clients[0].status.return_value)
+        env.add_units('nats', 2)
+        self.clients[0].add_units.assert_called_once_with('nats', 2)
+        self.assertEqual(len(self.clients), 1)
+
+    def test_get_pool(self):
+        pool = connection.get_pool('test-key', self.connect)
+        self.assertIs(connection.get_pool('test-key', None), pool)
+        self.assertIsNot(connection.get_pool('other-key', self.connect),
+                         pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
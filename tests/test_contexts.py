@@ -267,6 +267,7 @@ class TestOrchestratorRelation(unittest.TestCase):
         api_creds.assert_called_once_with()
         api_env.assert_called_with('addr', 'pw')
         api_env.return_value.connect.assert_called_once_with()
+        api_env.return_value.close.assert_called_once_with()
 
         api_env.return_value.status.return_value = {
             'services': {
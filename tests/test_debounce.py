@@ -0,0 +1,111 @@
+import unittest
+
+import tornado.ioloop
+import tornado.testing
+from tornado import gen
+from tornado.log import app_log
+from tornado.testing import ExpectLog
+
+from cloudfoundry.debounce import Debouncer
+
+
+class TestDebouncer(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(TestDebouncer, self).setUp()
+        self.calls = []
+        self.debouncer = Debouncer(lambda: self.calls.append(
+            self.io_loop.time()), quiet=0.05, max_latency=0.2,
+            io_loop=self.io_loop)
+
+    def wait_for(self, seconds):
+        timeout = self.io_loop.add_timeout(self.io_loop.time() + seconds,
+                                           self.stop)
+        try:
+            self.wait()
+        finally:
+            self.io_loop.remove_timeout(timeout)
+
+    def test_coalesce(self):
+        for i in range(5):
+            self.debouncer.trigger()
+        self.assertTrue(self.debouncer.pending)
+        self.wait_for(0.1)
+        self.assertEqual(len(self.calls), 1)
+        self.assertFalse(self.debouncer.pending)
+        self.assertEqual(self.debouncer.triggers, 5)
+
+    def test_max_latency(self):
+        start = self.io_loop.time()
+        pokes = []
+
+        def poke():
+            pokes.append(self.io_loop.time())
+            self.debouncer.trigger()
+            if self.io_loop.time() - start < 0.3:
+                self.io_loop.add_timeout(self.io_loop.time() + 0.02, poke)
+        poke()
+        self.wait_for(0.5)
+        # triggers kept coming faster than the quiet window, the first
+        # call still came max_latency after the first trigger
+        self.assertTrue(0.2 <= self.calls[0] - start < 0.3)
+        self.assertTrue(pokes[-1] > self.calls[0])
+
+    def test_cancel(self):
+        self.debouncer.trigger()
+        self.debouncer.cancel()
+        self.wait_for(0.1)
+        self.assertEqual(self.calls, [])
+
+    def test_failure_retried(self):
+        @gen.coroutine
+        def failing():
+            self.calls.append(self.io_loop.time())
+            if len(self.calls) == 1:
+                raise ValueError('status unavailable')
+        self.debouncer = Debouncer(failing, quiet=0.01, retry=0.05,
+                                   io_loop=self.io_loop)
+        self.debouncer.trigger()
+        # the error reaches the IOLoop, here the test's stack context
+        self.assertRaises(ValueError, self.wait_for, 0.03)
+        self.assertEqual(len(self.calls), 1)
+        self.assertTrue(self.debouncer.pending)
+        self.wait_for(0.1)
+        self.assertEqual(len(self.calls), 2)
+        self.assertFalse(self.debouncer.pending)
+
+    def test_failure_with_trigger_pending(self):
+        def failing():
+            self.calls.append(self.io_loop.time())
+            if len(self.calls) == 1:
+                # a trigger arrives while the failed pass runs
+                self.debouncer.trigger()
+                raise ValueError('status unavailable')
+        self.debouncer = Debouncer(failing, quiet=0.01, retry=10,
+                                   io_loop=self.io_loop)
+        self.debouncer.trigger()
+        self.assertRaises(ValueError, self.wait_for, 0.05)
+        self.wait_for(0.05)
+        # the pending trigger ran it, not the retry 10s later
+        self.assertEqual(len(self.calls), 2)
+
+
+class TestDebouncerErrors(unittest.TestCase):
+    def test_failure_logged(self):
+        # outside of AsyncTestCase nothing catches the error but the
+        # IOLoop, which logs it
+        io_loop = tornado.ioloop.IOLoop()
+        self.addCleanup(io_loop.close)
+
+        @gen.coroutine
+        def failing():
+            raise ValueError('status unavailable')
+        debouncer = Debouncer(failing, quiet=0.01, io_loop=io_loop)
+        io_loop.add_callback(debouncer.trigger)
+        io_loop.add_timeout(io_loop.time() + 0.05, io_loop.stop)
+        with ExpectLog(app_log, 'Exception in callback'):
+            io_loop.start()
+        self.assertTrue(debouncer.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import json
+import pkg_resources
+import unittest
+
+from cloudfoundry import actions
+from cloudfoundry import delta
+from cloudfoundry import status
+
+
+def load(name):
+    return json.loads(pkg_resources.resource_string(__name__, name))
+
+
+def by_type(tactics, cls):
+    return [t for t in tactics if type(t) is cls]
+
+
+class TestDelta(unittest.TestCase):
+    def setUp(self):
+        self.real = load('status.json')
+        self.expected = load('state.json')
+
+    def plan(self, previous, expected):
+        return delta.build_services(previous, expected, self.real, 'build')
+
+    def test_charm_base(self):
+        self.assertEqual(delta.charm_base('cs:trusty/mysql-4'),
+                         'cs:trusty/mysql')
+        self.assertEqual(delta.charm_base('local:trusty/haproxy-v1'),
+                         'local:trusty/haproxy-v1')
+        self.assertEqual(delta.charm_base(None), None)
+
+    def test_no_changes(self):
+        expected = self.expected
+        del expected['services']['uaa']
+        tactics = self.plan(expected, expected)
+        self.assertEqual([type(t) for t in tactics],
+                         [actions.GenerateTactic])
+
+    def test_config(self):
+        previous = {'services': {'nats': {'options': {'a': 1, 'b': 2}}}}
+        expected = {'services': {'nats': {'options': {'a': 1, 'b': 3,
+                                                      'c': 4}}}}
+        configure, = by_type(self.plan(previous, expected),
+                             actions.ConfigureTactic)
+        self.assertEqual(configure.kwargs, {'service_name': 'nats',
+                                            'config': {'b': 3, 'c': 4},
+                                            'unset': []})
+
+        expected = {'services': {'nats': {'options': {'b': 2}}}}
+        configure, = by_type(self.plan(previous, expected),
+                             actions.ConfigureTactic)
+        self.assertEqual(configure.kwargs['unset'], ['a'])
+
+    def test_constraints(self):
+        previous = {'services': {'nats': {'constraints': 'mem=1G'}}}
+        expected = {'services': {'nats': {'constraints': 'mem=2G'}}}
+        constrain, = by_type(self.plan(previous, expected),
+                             actions.ConstrainTactic)
+        self.assertEqual(constrain.kwargs['constraints'], 'mem=2G')
+        self.assertEqual(by_type(self.plan(expected, expected),
+                                 actions.ConstrainTactic), [])
+
+    def test_upgrade(self):
+        self.real['Services']['mysql']['Charm'] = 'cs:trusty/mysql-4'
+        expected = {'services': {'mysql': {'charm': 'cs:trusty/mysql-5'},
+                                 'nats': self.expected['services']['nats']}}
+        tactics = self.plan(expected, expected)
+        update, = by_type(tactics, actions.UpdateCharmTactic)
+        upgrade, = by_type(tactics, actions.UpgradeCharmTactic)
+        self.assertEqual(upgrade.kwargs, {'service_name': 'mysql',
+                                          'charm_url': 'cs:trusty/mysql-5'})
+        self.assertEqual(update.depends, [tactics[0]])
+        self.assertEqual(upgrade.depends, [update])
+
+    def test_upgrade_local(self):
+        expected = {'services': {'nats': {
+            'charm': 'nats-v2', 'branch': 'local:trusty/nats-v2',
+            'options': {'a': 1}}}}
+        tactics = self.plan({}, expected)
+        update, = by_type(tactics, actions.UpdateCharmTactic)
+        upgrade, = by_type(tactics, actions.UpgradeCharmTactic)
+        configure, = by_type(tactics, actions.ConfigureTactic)
+        self.assertEqual(upgrade.depends, [update])
+        self.assertEqual(configure.depends, [upgrade])
+
+    def test_units(self):
+        units = self.real['Services']['nats']['Units']
+        for i in (2, 10):
+            units['nats/%d' % i] = dict(units['nats/0'])
+        expected = {'services': {'nats': self.expected['services']['nats']}}
+        remove, = by_type(self.plan(expected, expected),
+                          actions.RemoveUnitsTactic)
+        self.assertEqual(remove.kwargs['unit_names'], ['nats/2', 'nats/10'])
+
+        expected['services']['nats']['num_units'] = 5
+        add, = by_type(self.plan(expected, expected), actions.AddUnitsTactic)
+        self.assertEqual(add.kwargs['num_units'], 2)
+
+    def test_expose(self):
+        expected = {'services': {'nats': {'expose': True}}}
+        expose, = by_type(self.plan(expected, expected),
+                          actions.ExposeTactic)
+        self.assertEqual(expose.kwargs, {'service_name': 'nats',
+                                         'exposed': True})
+
+    def test_remove_service(self):
+        previous = {'services': {'nats': {}, 'router': {}, 'gone': {}}}
+        expected = {'services': {'nats': {}}}
+        removes = by_type(self.plan(previous, expected),
+                          actions.RemoveServiceTactic)
+        # services never asked for are left alone
+        self.assertEqual([t.kwargs['service_name'] for t in removes],
+                         ['router'])
+
+    def test_remove_relation(self):
+        index = status.RelationIndex(self.real)
+        previous = {'services': {'nats': {}, 'router': {}, 'etcd': {}},
+                    'relations': [['nats', ['router:nats']]]}
+        expected = {'services': {'nats': {}, 'router': {}, 'etcd': {}},
+                    'relations': []}
+        remove, = delta.build_relations(previous, expected, index)
+        self.assertIsInstance(remove, actions.RemoveRelationTactic)
+        self.assertEqual(remove.kwargs, {'endpoint_a': 'nats:nats',
+                                         'endpoint_b': 'router:nats'})
+
+        # going away with the service
+        expected = {'services': {'nats': {}, 'etcd': {}}, 'relations': []}
+        self.assertEqual(delta.build_relations(previous, expected, index), [])
+
+    def test_applied_state(self):
+        from cloudfoundry.config import COMPLETE, CANCELLED
+        previous = {'services': {'nats': {}, 'router': {}, 'gone': {}},
+                    'relations': [['nats', 'router']]}
+        expected = {'services': {'nats': {'num_units': 2},
+                                 'router': {'num_units': 2},
+                                 'uaa': {}},
+                    'relations': [['uaa:db', 'mysql:db']]}
+        nats = actions.AddUnitsTactic(service_name='nats', num_units=1)
+        nats.state = COMPLETE
+        router = actions.AddUnitsTactic(service_name='router', num_units=1)
+        router.state = CANCELLED
+        deploy = actions.DeployTactic(service={'service_name': 'uaa'})
+        deploy.state = COMPLETE
+        remove = actions.RemoveServiceTactic(service_name='gone')
+        remove.state = CANCELLED
+        relate = actions.AddRelationTactic(endpoint_a='mysql:db',
+                                           endpoint_b='uaa:db')
+        relate.state = CANCELLED
+        applied, incomplete = delta.applied_state(
+            previous, expected, [nats, router, deploy, remove, relate])
+        self.assertEqual(incomplete, set(['router', 'gone', 'mysql', 'uaa']))
+        self.assertEqual(applied['services'], {'nats': {'num_units': 2},
+                                               'router': {}, 'gone': {}})
+        self.assertEqual(applied['relations'],
+                         [['nats', 'router'], ['uaa:db', 'mysql:db']])
+
+    def test_changed_services(self):
+        old = {'services': {'nats': {}, 'router': {}, 'uaa': {}},
+               'relations': [['nats', ['router']]]}
+        new = {'services': {'nats': {'num_units': 2}, 'router': {},
+                            'mysql': {}},
+               'relations': [['uaa:db', 'mysql:db'], ['nats', 'router']]}
+        self.assertEqual(delta.changed_services(old, new),
+                         set(['nats', 'uaa', 'mysql']))
+        self.assertEqual(delta.changed_services(new, new), set())
+
+    def test_scope(self):
+        previous = {'services': {'nats': {'options': {'a': 1}},
+                                 'router': {'options': {'a': 1}},
+                                 'gone': {}}}
+        expected = {'services': {'nats': {'options': {'a': 2}},
+                                 'router': {'options': {'a': 2}}}}
+        tactics = delta.build_services(previous, expected, self.real,
+                                       'build', scope=set(['nats']))
+        configure, = by_type(tactics, actions.ConfigureTactic)
+        self.assertEqual(configure.kwargs['service_name'], 'nats')
+        self.assertEqual(by_type(tactics, actions.RemoveServiceTactic), [])
+        self.assertEqual(delta.build_services(
+            previous, expected, self.real, 'build', scope=set()), [])
+
+        index = status.RelationIndex(self.real)
+        expected = self.expected
+        del expected['services']['uaa']
+        self.assertEqual(delta.build_relations(
+            {}, expected, index, scope=set(['nats', 'router'])), [])
+        add, = delta.build_relations({}, expected, index,
+                                     scope=set(['mysql']))
+        self.assertEqual(add.kwargs, {'endpoint_a': 'mysql:db',
+                                      'endpoint_b': 'uaa:db'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudfoundry import actions
+from cloudfoundry.durations import Durations
+
+
+class TestDurations(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'durations.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_estimate(self):
+        durations = Durations(self.path, alpha=0.5)
+        nats = actions.AddUnitsTactic(service_name='nats', num_units=1)
+        mysql = actions.AddUnitsTactic(service_name='mysql', num_units=1)
+        self.assertEqual(durations.estimate(nats), 120)
+        durations.record(nats, 10)
+        durations.record(nats, 20)
+        self.assertEqual(durations.estimate(nats), 15)
+        # falls back to the average of the type
+        self.assertEqual(durations.estimate(mysql), 15)
+        relation = actions.AddRelationTactic(endpoint_a='uaa:db',
+                                             endpoint_b='mysql:db')
+        durations.record(relation, 3)
+        self.assertFalse(os.path.exists(self.path))
+        durations.save()
+        self.assertFalse(durations.dirty)
+        self.assertEqual(Durations(self.path).averages, {
+            'AddUnitsTactic:nats': 15,
+            'AddUnitsTactic': 15,
+            'AddRelationTactic:mysql,uaa': 3,
+            'AddRelationTactic': 3,
+        })
+
+    def test_corrupt(self):
+        with open(self.path, 'w') as fp:
+            fp.write('{')
+        self.assertEqual(Durations(self.path).averages, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
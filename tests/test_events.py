@@ -0,0 +1,41 @@
+import unittest
+
+from cloudfoundry.events import EventBus
+
+
+class TestEventBus(unittest.TestCase):
+    def test_since(self):
+        bus = EventBus(maxlen=2)
+        self.assertEqual(bus.since(0), [])
+        for i in range(3):
+            bus.publish('tactic', index=i)
+        self.assertEqual([e['index'] for e in bus.since(0)], [1, 2])
+        self.assertEqual([e['seq'] for e in bus.since(2)], [3])
+        self.assertEqual(bus.since(3), [])
+
+    def test_subscribe(self):
+        bus = EventBus()
+        seen = []
+
+        def listener(event):
+            seen.append(event)
+        bus.subscribe(listener)
+        bus.publish('deltas', deltas=[])
+        bus.unsubscribe(listener)
+        bus.publish('deltas', deltas=[])
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0]['type'], 'deltas')
+
+    def test_wait(self):
+        bus = EventBus()
+        bus.publish('a')
+        self.assertEqual(len(bus.wait(0).result()), 1)
+        future = bus.wait(1)
+        self.assertFalse(future.done())
+        bus.publish('b')
+        self.assertEqual([e['type'] for e in future.result()], ['b'])
+        self.assertEqual(bus.listeners, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
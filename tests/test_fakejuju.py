@@ -0,0 +1,80 @@
+import StringIO
+import unittest
+
+from jujuclient import EnvError
+
+from cloudfoundry import actions
+from tests import benchmark
+from tests.fakejuju import FakeEnvironment
+
+
+class TestFakeEnvironment(unittest.TestCase):
+    def test_seeded_from_status(self):
+        env = FakeEnvironment()
+        self.assertIn('cc', env.status()['Services'])
+        self.assertEqual(env.calls, ['status'])
+
+    def test_deploy_and_destroy(self):
+        env = FakeEnvironment()
+        env.deploy('web', 'cs:trusty/web-3', num_units=2)
+        service = env.status()['Services']['web']
+        self.assertEqual(service['Charm'], 'cs:trusty/web-3')
+        self.assertEqual(sorted(service['Units']), ['web/0', 'web/1'])
+        self.assertRaises(EnvError, env.deploy, 'web', 'cs:trusty/web-3')
+        env.add_units('web', 1)
+        env.remove_units(['web/0'])
+        self.assertEqual(sorted(env.status()['Services']['web']['Units']),
+                         ['web/1', 'web/2'])
+        env.add_relation('web:db', 'mysql:db')
+        env.destroy_service('web')
+        status = env.status()['Services']
+        self.assertNotIn('web', status)
+        self.assertNotIn('db', status['mysql']['Relations'])
+        self.assertRaises(EnvError, env.expose, 'web')
+
+    def test_relations(self):
+        env = FakeEnvironment()
+        env.add_relation('cc:db', 'mysql')
+        status = env.status()['Services']
+        self.assertEqual(status['cc']['Relations']['db'], ['mysql'])
+        self.assertIn('cc', status['mysql']['Relations']['db'])
+        self.assertRaises(EnvError, env.add_relation, 'cc:db', 'mysql:db')
+        env.remove_relation('cc:db', 'mysql:db')
+        self.assertNotIn('db', env.status()['Services']['cc']['Relations'])
+
+    def test_add_local_charm(self):
+        env = FakeEnvironment()
+        fp = StringIO.StringIO()
+        fp.name = '/tmp/cloudfoundry-1.zip'
+        self.assertEqual(env.add_local_charm(fp, 'trusty'),
+                         {'CharmURL': 'local:trusty/cloudfoundry-0'})
+        self.assertEqual(env.add_local_charm(fp, 'trusty'),
+                         {'CharmURL': 'local:trusty/cloudfoundry-1'})
+
+    def test_failure_injection(self):
+        env = FakeEnvironment(seed=1)
+        env.failure_rates['expose'] = 1
+        with self.assertRaises(EnvError) as cm:
+            env.expose('cc')
+        self.assertTrue(actions.transient_error(cm.exception))
+        self.assertFalse(env.status()['Services']['cc']['Exposed'])
+        env.failure_rates['expose'] = 0
+        env.expose('cc')
+        self.assertTrue(env.status()['Services']['cc']['Exposed'])
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_synthetic_bundle(self):
+        bundle = benchmark.synthetic_bundle(10, 20, seed=0)
+        self.assertEqual(len(bundle['services']), 10)
+        self.assertEqual(len(bundle['relations']), 20)
+        # more relations than service pairs
+        self.assertEqual(len(benchmark.synthetic_bundle(3, 10)['relations']),
+                         3)
+
+    def test_run(self):
+        results = benchmark.run(services=20, relations=30, seed=0)
+        self.assertEqual(results['state'], 'COMPLETE')
+        self.assertEqual(results['api_calls']['deploy'], 20)
+        self.assertEqual(results['api_calls']['add_relation'], 30)
+        self.assertEqual(results['replan_tactics'], 1)
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import copy
+import json
 import os
 import shutil
 import tempfile
@@ -206,6 +208,76 @@ class TestGenerator(unittest.TestCase):
             self.assertTrue(os.path.isdir(os.path.join(
                 tmpdir, 'trusty', 'cloud_controller_v1', 'files')))
 
+    def test_generate_parallel(self):
+        def snapshot(root):
+            result = {}
+            for dirpath, dirnames, filenames in os.walk(root):
+                for name in filenames:
+                    fn = os.path.join(dirpath, name)
+                    key = os.path.relpath(fn, root)
+                    if os.path.islink(fn):
+                        result[key] = os.readlink(fn)
+                    else:
+                        with open(fn) as fp:
+                            result[key] = fp.read()
+            return result
+
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        with tempdir() as tmpdir:
+            serial = os.path.join(tmpdir, 'serial')
+            parallel = os.path.join(tmpdir, 'parallel')
+            written = g.generate(serial)
+            self.assertEqual(g.generate(parallel, jobs=4), [
+                os.path.join(parallel, os.path.relpath(p, serial))
+                for p in written])
+            self.assertEqual(snapshot(serial), snapshot(parallel))
+
+    def test_generate_incremental(self):
+        services = copy.deepcopy(SERVICES)
+        g = CharmGenerator(RELEASES, services)
+        g.select_release(173)
+        with tempdir() as tmpdir:
+            repo = os.path.join(tmpdir, 'trusty')
+            self.assertEqual(len(g.generate(tmpdir)), 3)
+            manifest = json.load(open(os.path.join(tmpdir, 'manifest.json')))
+            self.assertEqual(sorted(manifest), [
+                'cc_clock_v1', 'cloud_controller_v1', 'router_v1'])
+            stamp = os.path.join(repo, 'router_v1', 'stamp')
+            open(stamp, 'w').close()
+            # nothing changed
+            self.assertEqual(g.generate(tmpdir), [])
+            self.assertTrue(os.path.exists(stamp))
+
+            services['router_v1']['summary'] = 'changed'
+            shutil.rmtree(os.path.join(repo, 'cc_clock_v1'))
+            self.assertEqual(sorted(g.generate(tmpdir)), [
+                os.path.join(repo, 'cc_clock_v1'),
+                os.path.join(repo, 'router_v1')])
+            # rewritten from scratch
+            self.assertFalse(os.path.exists(stamp))
+            self.assertIn('changed', open(os.path.join(
+                repo, 'router_v1', 'metadata.yaml')).read())
+
+    def test_generate_removed_charm(self):
+        releases = copy.deepcopy(RELEASES)
+        g = CharmGenerator(releases, SERVICES)
+        g.select_release(173)
+        with tempdir() as tmpdir:
+            g.generate(tmpdir)
+            releases[0]['topology']['services'].remove('cc_clock_v1')
+            # the topology is an input of every charm
+            self.assertEqual(len(g.generate(tmpdir)), 2)
+            self.assertFalse(os.path.exists(
+                os.path.join(tmpdir, 'trusty', 'cc_clock_v1')))
+            self.assertNotIn('cc_clock_v1', json.load(
+                open(os.path.join(tmpdir, 'manifest.json'))))
+
+    def test_build_deployment_repeatable(self):
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        self.assertEqual(g.build_deployment(), g.build_deployment())
+
     def test_generate_missing_service(self):
         releases = [{'releases': (1, 1), 'topology': {
             'services': [('missing', '??')],
@@ -223,5 +295,10 @@ class TestGenerator(unittest.TestCase):
             self.assertTrue((path(tmpdir) / 'bundles.yaml').exists())
             self.assertTrue((path(tmpdir) / 'trusty/nats-v1').exists())
 
+    def test_main_jobs(self):
+        with tempdir() as tmpdir:
+            main(['-d', tmpdir, '-j', '2', '173'])
+            self.assertTrue((path(tmpdir) / 'trusty/nats-v1').exists())
+
 if __name__ == '__main__':
     unittest.main()
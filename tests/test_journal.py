@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cloudfoundry.journal import Journal
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'state', 'journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay_empty(self):
+        self.assertEqual(list(Journal(self.path).replay()), [])
+
+    def test_append_replay(self):
+        journal = Journal(self.path)
+        journal.append({'op': 'a'})
+        journal.append({'op': 'b'})
+        journal.close()
+        with open(self.path, 'a') as fp:
+            fp.write('{"op": "tor')
+        self.assertEqual(list(Journal(self.path).replay()),
+                         [{'op': 'a'}, {'op': 'b'}])
+
+    def test_compact(self):
+        journal = Journal(self.path, compact_every=2)
+        journal.append({'op': 'a'})
+        self.assertFalse(journal.needs_compaction)
+        journal.append({'op': 'b'})
+        self.assertTrue(journal.needs_compaction)
+        journal.compact([{'op': 'snapshot'}])
+        self.assertFalse(journal.needs_compaction)
+        journal.append({'op': 'c'})
+        self.assertEqual(list(journal.replay()),
+                         [{'op': 'snapshot'}, {'op': 'c'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
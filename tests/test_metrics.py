@@ -0,0 +1,50 @@
+import unittest
+
+from cloudfoundry import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        c = self.registry.counter('failures_total', 'Failures.')
+        c.inc(tactic='Deploy')
+        c.inc(2, tactic='Deploy')
+        c.inc(tactic='Add "x"')
+        self.assertEqual(c.value(tactic='Deploy'), 3)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP failures_total Failures.',
+            '# TYPE failures_total counter',
+            'failures_total{tactic="Add \\"x\\""} 1.0',
+            'failures_total{tactic="Deploy"} 3.0',
+        ]) + '\n')
+
+    def test_gauge(self):
+        depth = [4]
+        g = self.registry.gauge('depth', 'Depth.', lambda: depth[0])
+        self.assertIn('depth 4.0', self.registry.render())
+        depth[0] = 2
+        self.assertEqual(g.value(), 2)
+        self.assertIn('depth 2.0', self.registry.render())
+
+    def test_histogram(self):
+        h = self.registry.histogram('took_seconds', 'Took.', buckets=(1, 5))
+        h.observe(0.5)
+        h.observe(1)
+        h.observe(3)
+        h.observe(10)
+        self.assertEqual(h.count(), 4)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP took_seconds Took.',
+            '# TYPE took_seconds histogram',
+            'took_seconds_bucket{le="1.0"} 2',
+            'took_seconds_bucket{le="5.0"} 3',
+            'took_seconds_bucket{le="+Inf"} 4',
+            'took_seconds_sum 14.5',
+            'took_seconds_count 4',
+        ]) + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
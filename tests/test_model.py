@@ -0,0 +1,508 @@
+import collections
+import datetime
+import json
+import mock
+import os
+import pkg_resources
+import shutil
+import socket
+import tempfile
+import unittest
+
+import tornado.ioloop
+from tornado import gen
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudfoundry import actions
+from cloudfoundry import model
+from cloudfoundry.config import PENDING, RUNNING, COMPLETE, FAILED
+
+
+def load(name):
+    return json.loads(pkg_resources.resource_string(__name__, name))
+
+
+class TestStateDatabase(unittest.TestCase):
+    def setUp(self):
+        self.get_env_patch = mock.patch.object(model.StateDatabase, 'get_env')
+        self.get_env = self.get_env_patch.start()
+        self.env = self.get_env.return_value
+        self.env.status.return_value = load('status.json')
+        self.db = model.StateDatabase({
+            'juju.environment': 'local',
+            'credentials.user': 'user-admin',
+            'credentials.password': 'secret',
+            'server.repository': 'build',
+        })
+
+    def tearDown(self):
+        self.get_env_patch.stop()
+
+    def test_real_is_cached(self):
+        self.db.expected = load('state.json')
+        self.assertIs(self.db.real, self.db.real)
+        self.db.build_strategy()
+        self.assertEqual(self.env.status.call_count, 1)
+        self.assertEqual(self.db.generation, 1)
+
+    def test_real_invalidate(self):
+        self.db.real
+        self.db.invalidate()
+        self.db.real
+        self.assertEqual(self.env.status.call_count, 2)
+        self.assertEqual(self.db.generation, 2)
+
+    @mock.patch('time.time')
+    def test_real_ttl(self, now):
+        now.return_value = 100
+        self.db.status_ttl = 5
+        self.db.real
+        now.return_value = 104
+        self.db.real
+        self.assertEqual(self.env.status.call_count, 1)
+        now.return_value = 105
+        self.db.real
+        self.assertEqual(self.env.status.call_count, 2)
+
+    def test_generate_jobs(self):
+        self.db.config['reconciler.generate_jobs'] = 3
+        self.db.expected = load('state.json')
+        self.db.build_strategy()
+        self.assertEqual(self.db.strategy[0].kwargs['jobs'], 3)
+
+    def test_env_key_fetched_once(self):
+        self.env.info.return_value = {'UUID': 'abc'}
+        self.db._fetch_real()
+        self.db.invalidate()
+        self.db._fetch_real()
+        self.assertEqual(self.db.env_key, 'abc')
+        self.assertEqual(self.env.info.call_count, 1)
+        self.db.expected = load('state.json')
+        with mock.patch('cloudfoundry.delta.build_services') as build:
+            build.return_value = []
+            self.db.build_strategy()
+        self.assertEqual(build.call_args[0][-1], 'abc')
+
+    def test_regenerated_charms_replan(self):
+        self.db.push(load('state.json'))
+        self.db.build_strategy()
+        self.db.dirty = set()
+        generate = self.db.strategy[0]
+        generate.state = COMPLETE
+        generate.changed = ['nats-v1', 'uaa-v1', 'unused-v1']
+        with mock.patch.object(self.db, 'execute_strategy'):
+            self.db._tactic_done(gen.maybe_future(generate))
+        self.assertTrue(self.db.outdated)
+        self.assertFalse(self.db.stale)
+        self.assertEqual(self.db.dirty, set(['nats', 'uaa']))
+
+    def test_connect_outside_pool(self):
+        # for the watcher, which must not hold a pooled connection
+        self.db.env
+        calls = self.get_env.call_count
+        self.assertIs(self.db.connect(), self.env)
+        self.assertEqual(self.get_env.call_count, calls + 1)
+        self.get_env.assert_called_with('local', user='user-admin',
+                                        password='secret')
+
+    def test_diverges_without_expected(self):
+        self.assertFalse(self.db.diverges([
+            ['service', 'remove', {'Name': 'nats'}]]))
+
+    def test_diverges(self):
+        self.db.expected = load('state.json')
+        self.assertTrue(self.db.diverges([
+            ['service', 'remove', {'Name': 'nats'}]]))
+        self.assertTrue(self.db.diverges([
+            ['unit', 'remove', {'Name': 'nats/0', 'Service': 'nats'}]]))
+        self.assertTrue(self.db.diverges([
+            ['service', 'change', {'Name': 'nats', 'Exposed': True}]]))
+        self.assertTrue(self.db.diverges([
+            ['relation', 'remove', {'Key': 'nats:nats router:nats',
+                                    'Endpoints': [
+                                        {'ServiceName': 'nats'},
+                                        {'ServiceName': 'router'}]}]]))
+
+    def test_diverges_ignores_unrelated(self):
+        self.db.expected = load('state.json')
+        self.assertFalse(self.db.diverges([
+            ['service', 'change', {'Name': 'nats', 'Exposed': False}],
+            ['unit', 'change', {'Name': 'nats/1', 'Service': 'nats'}],
+            ['unit', 'remove', {'Name': 'other/0', 'Service': 'other'}],
+            ['machine', 'remove', {'Id': '3'}],
+            ['relation', 'change', {'Key': 'nats:nats router:nats',
+                                    'Endpoints': [
+                                        {'ServiceName': 'nats'},
+                                        {'ServiceName': 'router'}]}]]))
+
+    def test_diverges_on_stale_service(self):
+        self.db.previous = {'services': {'old': {}}}
+        self.db.expected = load('state.json')
+        self.assertTrue(self.db.diverges([
+            ['service', 'change', {'Name': 'old'}]]))
+
+    def test_build_strategy_dependencies(self):
+        del self.env.status.return_value['Services']['mysql']
+        self.db.expected = load('state.json')
+        self.db.build_strategy()
+        strategy = self.db.strategy
+        generate = strategy[0]
+        self.assertIsInstance(generate, actions.GenerateTactic)
+        self.assertEqual(generate.depends, [])
+        self.assertEqual(generate.kwargs['jobs'], 1)
+        deploys = dict((t.kwargs['service']['service_name'], t)
+                       for t in strategy
+                       if isinstance(t, actions.DeployTactic))
+        # nats is in status.json, uaa is not
+        self.assertNotIn('nats', deploys)
+        update = deploys['uaa'].depends[0]
+        self.assertIsInstance(update, actions.UpdateCharmTactic)
+        self.assertEqual(update.depends, [generate])
+        # store charms have their revision resolved off the IOLoop
+        resolve, = deploys['mysql'].depends
+        self.assertIsInstance(resolve, actions.UpdateCharmTactic)
+        self.assertEqual(resolve.kwargs['charm_url'], 'cs:trusty/mysql')
+        rels = [t for t in strategy
+                if isinstance(t, actions.AddRelationTactic)]
+        self.assertEqual(len(rels), 1)
+        self.assertEqual(rels[0].kwargs, {'endpoint_a': 'mysql:db',
+                                          'endpoint_b': 'uaa:db'})
+        self.assertEqual(set(rels[0].depends),
+                         set([deploys['mysql'], deploys['uaa']]))
+
+    def test_previous_follows_completed_strategy(self):
+        self.db.expected = load('state.json')
+        self.db.build_strategy()
+        self.assertEqual(self.db.previous, {})
+        for tactic in self.db.strategy:
+            tactic.state = COMPLETE
+        self.db.strategy.update_state()
+        self.db.execute_strategy()
+        self.assertEqual(self.db.previous, self.db.expected)
+        self.assertIsNot(self.db.previous, self.db.expected)
+
+    def test_durations_saved_on_retire(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'durations.json')
+        config = dict(self.db.config, **{'server.durations': path})
+        db = model.StateDatabase(config)
+        tactic = Recorder(key=1)
+        db.strategy.append(tactic)
+        tactic.run(mock.Mock(calls=[]))
+        with mock.patch.object(db, 'execute_strategy'):
+            db._tactic_done(gen.maybe_future(tactic))
+        self.assertTrue(db.durations.dirty)
+        self.assertFalse(os.path.exists(path))
+        db.execute_strategy()
+        self.assertEqual(len(db.history), 1)
+        with open(path) as fp:
+            self.assertIn('Recorder', json.load(fp))
+
+    def test_patch_scope(self):
+        self.db.push(load('state.json'))
+        self.assertIsNone(self.db.dirty)
+        self.db.build_strategy()
+        self.assertEqual(self.db.dirty, set())
+        self.db.strategy = self.db._new_strategy()
+
+        self.db.patch([{'op': 'add', 'path': '/services/nats/expose',
+                        'value': True}])
+        self.db.put_service('router', {'charm': 'router-v1',
+                                       'branch': 'local:trusty/router-v1',
+                                       'num_units': 2})
+        self.assertEqual(self.db.dirty, set(['nats', 'router']))
+        self.assertTrue(self.db.outdated)
+        self.db.build_strategy()
+        self.assertFalse(self.db.outdated)
+        self.assertEqual(
+            sorted((type(t).__name__, t.kwargs.get('service_name'))
+                   for t in self.db.strategy[1:]),
+            [('AddUnitsTactic', 'router'), ('ExposeTactic', 'nats')])
+
+    def test_delete_service(self):
+        self.db.push(load('state.json'))
+        self.db.dirty = set()
+        self.db.delete_service('uaa')
+        self.assertNotIn('uaa', self.db.expected['services'])
+        self.assertEqual(self.db.expected['relations'],
+                         [['nats:nats', ['router:nats']]])
+        self.assertEqual(self.db.dirty, set(['uaa', 'mysql']))
+        self.assertRaises(KeyError, self.db.delete_service, 'uaa')
+
+    def test_failed_strategy_plans_everything(self):
+        self.db.dirty = set()
+        self.db.strategy.append(Recorder(key=1, fail=True))
+        self.db.strategy[0].run(mock.Mock(calls=[]))
+        self.db.strategy.update_state()
+        self.db._reset_strategy()
+        self.assertIsNone(self.db.dirty)
+
+    def test_preempt(self):
+        self.db.push(load('state.json'))
+        self.db.build_strategy()
+        self.assertFalse(self.db.stale)
+        strategy = self.db.strategy
+        strategy[0].state = COMPLETE
+        strategy[1].state = RUNNING
+        self.db.patch([{'op': 'add', 'path': '/services/nats/expose',
+                        'value': True}])
+        self.assertTrue(self.db.stale)
+        cancelled = self.db.preempt()
+        self.assertEqual(cancelled, strategy[2:])
+        self.assertEqual(set(t.state for t in cancelled),
+                         set([model.CANCELLED]))
+        self.assertEqual(self.db.preempt(), [])
+
+        # retires once the running tactic is done
+        self.db.execute_strategy()
+        self.assertIs(self.db.strategy, strategy)
+        strategy[1].state = COMPLETE
+        strategy.update_state()
+        self.assertEqual(strategy.state, model.CANCELLED)
+        self.db.execute_strategy()
+        self.assertIsNot(self.db.strategy, strategy)
+        self.assertEqual(self.db.history[-1].state, model.CANCELLED)
+        # the cancelled deploys are planned again
+        self.assertIn('uaa', self.db.dirty)
+        self.assertIn('nats', self.db.dirty)
+        self.assertNotIn('uaa', self.db.previous['services'])
+
+    def test_history(self):
+        self.db.history = collections.deque(maxlen=2)
+        for i in range(3):
+            self.db.strategy.append(Recorder(key=i))
+            self.db.strategy[0].run(mock.Mock(calls=[]))
+            self.db.strategy.update_state()
+            self.db._reset_strategy()
+        self.assertEqual([s.id for s in self.db.history], [2, 3])
+        summary = self.db.history[-1]
+        self.assertIsInstance(summary, model.StrategySummary)
+        self.assertEqual(summary.state, COMPLETE)
+        tactic = summary.tactics[0]
+        self.assertEqual(tactic.name, 'Record')
+        self.assertTrue(summary.start_time <= tactic.end_time)
+        self.assertEqual(summary.to_dict()['tactics'][0]['state'],
+                         'COMPLETE')
+
+    def test_journal_restore(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = dict(self.db.config)
+        config['server.journal'] = os.path.join(tmpdir, 'journal')
+        db = model.StateDatabase(config)
+        db.push(load('state.json'))
+        db.build_strategy()
+        generate, update, deploy = db.strategy[:3]
+        generate.state = COMPLETE
+        db._tactic_done(gen.maybe_future(generate))
+        update.state = RUNNING
+
+        restored = model.StateDatabase(config)
+        self.assertEqual(restored.expected, load('state.json'))
+        self.assertEqual(restored.strategy.id, db.strategy.id)
+        self.assertEqual([type(t) for t in restored.strategy],
+                         [type(t) for t in db.strategy])
+        self.assertEqual([t.kwargs for t in restored.strategy],
+                         [t.kwargs for t in db.strategy])
+        # the running tactic is run again
+        self.assertEqual([t.state for t in restored.strategy],
+                         [COMPLETE] + [PENDING] * (len(db.strategy) - 1))
+        self.assertEqual(restored.strategy[2].depends,
+                         [restored.strategy[1]])
+        # resumes from the next pending tactic
+        self.assertEqual(restored.strategy.find_next_tactic(),
+                         restored.strategy[1])
+        # the journal was compacted into a single snapshot
+        with open(config['server.journal']) as fp:
+            self.assertEqual(len(fp.readlines()), 1)
+
+    def test_journal_keeps_charm_url(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = dict(self.db.config)
+        config['server.journal'] = os.path.join(tmpdir, 'journal')
+        db = model.StateDatabase(config)
+        db.push(load('state.json'))
+        db.build_strategy()
+        update = db.strategy[1]
+        update.state = COMPLETE
+        update.charm_url = 'local:trusty/uaa-v1-3'
+        with mock.patch.object(db, 'execute_strategy'):
+            db._tactic_done(gen.maybe_future(update))
+
+        restored = model.StateDatabase(config)
+        # what deploys and upgrades of the charm still need
+        self.assertEqual(restored.strategy[1].charm_url,
+                         'local:trusty/uaa-v1-3')
+
+    def test_journal_restore_patches(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        config = dict(self.db.config)
+        config['server.journal'] = os.path.join(tmpdir, 'journal')
+        db = model.StateDatabase(config)
+        db.push(load('state.json'))
+        db.patch([{'op': 'replace', 'path': '/services/nats/charm',
+                   'value': 'nats-v2'}])
+        db.put_service('extra', {'charm': 'cs:trusty/extra'})
+        db.delete_service('uaa')
+        restored = model.StateDatabase(config)
+        self.assertEqual(restored.expected, db.expected)
+        self.assertIsNone(restored.dirty)
+
+
+class Recorder(actions.Tactic):
+    name = "Record"
+
+    def _run(self, env, **kwargs):
+        env.calls.append(kwargs['key'])
+        if kwargs.get('fail'):
+            raise ValueError(kwargs['key'])
+
+
+class Flaky(Recorder):
+    retry = actions.RetryPolicy(max_attempts=3, backoff=0.01, jitter=0)
+
+    def _run(self, env, **kwargs):
+        env.calls.append(kwargs['key'])
+        if len(env.calls) <= kwargs['failures']:
+            raise socket.error('connection reset')
+
+
+class TestStrategy(unittest.TestCase):
+    def setUp(self):
+        self.env = mock.Mock(calls=[])
+
+    def test_width(self):
+        s = model.Strategy(self.env, width=2)
+        a = Recorder(key='a')
+        b = Recorder(key='b')
+        c = Recorder(key='c', depends=[a])
+        s.extend([a, b, c])
+        self.assertEqual(s.find_ready_tactics(), [a, b])
+        s()
+        self.assertEqual(self.env.calls, ['a', 'b'])
+        s()
+        self.assertEqual(self.env.calls, ['a', 'b', 'c'])
+        self.assertFalse(s.runnable)
+        s()
+        self.assertEqual(s.state, COMPLETE)
+
+    def test_ready_queue(self):
+        s = model.Strategy(self.env, width=1)
+        a = Recorder(key='a')
+        b = Recorder(key='b', depends=[a])
+        c = Recorder(key='c', depends=[a, b])
+        d = Recorder(key='d')
+        s.extend([a, b, c, d])
+        # finishing tactics feed their dependents, nothing rescans
+        # the whole strategy
+        with mock.patch.object(actions.Tactic, 'ready',
+                               new_callable=mock.PropertyMock) as ready:
+            while s.runnable:
+                s()
+        self.assertFalse(ready.called)
+        self.assertEqual(self.env.calls, ['a', 'b', 'c', 'd'])
+        self.assertEqual(s.state, COMPLETE)
+        self.assertEqual(s.index(c), 2)
+        self.assertIn(d, s)
+        self.assertNotIn(Recorder(key='e'), s)
+
+    def test_reschedule(self):
+        s = model.Strategy(self.env)
+        a = Recorder(key='a')
+        s.append(a)
+        a.state = RUNNING
+        self.assertFalse(s.runnable)
+        a.state = PENDING
+        s.reschedule()
+        self.assertIs(s.find_next_tactic(), a)
+
+    def test_failure_blocks_dependents_only(self):
+        s = model.Strategy(self.env, width=4)
+        a = Recorder(key='a', fail=True)
+        b = Recorder(key='b')
+        c = Recorder(key='c', depends=[a])
+        d = Recorder(key='d', depends=[c])
+        e = Recorder(key='e', depends=[b])
+        s.extend([a, b, c, d, e])
+        while s.runnable:
+            s()
+        self.assertEqual(self.env.calls, ['a', 'b', 'e'])
+        self.assertEqual(a.state, FAILED)
+        self.assertEqual(c.state, PENDING)
+        self.assertTrue(d.blocked)
+        self.assertFalse(e.blocked)
+        self.assertEqual(s.state, FAILED)
+
+    def test_executor(self):
+        executor = ThreadPoolExecutor(2)
+        s = model.Strategy(self.env, width=2, executor=executor)
+        a = Recorder(key='a')
+        b = Recorder(key='b', depends=[a])
+        s.extend([a, b])
+
+        @gen.coroutine
+        def drive():
+            while s.runnable:
+                yield s()
+
+        tornado.ioloop.IOLoop().run_sync(drive)
+        executor.shutdown()
+        self.assertEqual(self.env.calls, ['a', 'b'])
+        self.assertEqual(s.state, COMPLETE)
+
+    def test_critical_path(self):
+        s = model.Strategy(self.env, width=1)
+        a = Recorder(key='a')
+        b = Recorder(key='b')
+        c = Recorder(key='c', depends=[b])
+        d = Recorder(key='d', depends=[c])
+        s.extend([a, b, c, d])
+        s.estimate = lambda t: {'a': 5, 'b': 1, 'c': 2, 'd': 3}[
+            t.kwargs['key']]
+        self.assertEqual(s.critical_paths(), {a: 5, b: 6, c: 5, d: 3})
+        # the b, c, d chain is longer than a alone
+        self.assertEqual(s.find_ready_tactics(), [b, a])
+        self.assertEqual(s.eta(), 11)
+        s.width = 4
+        self.assertEqual(s.eta(), 6)
+
+        b.state = COMPLETE
+        b.end_time = b.start_time = datetime.datetime.now()
+        c.state = RUNNING
+        c.start_time = datetime.datetime.now() - datetime.timedelta(
+            seconds=1)
+        self.assertAlmostEqual(s.eta(c.start_time + datetime.timedelta(
+            seconds=1)), 5)
+
+    def test_retry(self):
+        s = model.Strategy(self.env)
+        a = Flaky(key='a', failures=2)
+        b = Recorder(key='b', depends=[a])
+        s.extend([a, b])
+
+        @gen.coroutine
+        def drive():
+            while s.runnable:
+                yield s()
+
+        tornado.ioloop.IOLoop().run_sync(drive)
+        self.assertEqual(self.env.calls, ['a', 'a', 'a', 'b'])
+        self.assertEqual(a.attempts, 3)
+        self.assertIsNone(a.failure)
+        self.assertEqual(s.state, COMPLETE)
+
+    def test_retry_gives_up(self):
+        s = model.Strategy(self.env)
+        a = Flaky(key='a', failures=5)
+        s.append(a)
+        tornado.ioloop.IOLoop().run_sync(lambda: s()[0])
+        self.assertEqual(self.env.calls, ['a', 'a', 'a'])
+        self.assertEqual(a.state, FAILED)
+        self.assertEqual(s.state, FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
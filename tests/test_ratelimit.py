@@ -0,0 +1,122 @@
+import mock
+import unittest
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from cloudfoundry import ratelimit
+from cloudfoundry.model import StateDatabase
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_queue(self):
+        clock = Clock()
+        bucket = ratelimit.TokenBucket(2, burst=3, clock=clock)
+        self.assertEqual([bucket.reserve() for i in range(3)], [0, 0, 0])
+        # callers queue behind each other at the configured rate
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.assertEqual(bucket.reserve(), 1.0)
+        clock.now += 1
+        self.assertEqual(bucket.reserve(), 0.5)
+
+    def test_refill_capped_at_burst(self):
+        clock = Clock()
+        bucket = ratelimit.TokenBucket(1, clock=clock)
+        bucket.reserve()
+        clock.now += 60
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 1)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.limiter = ratelimit.RateLimiter(
+            {'deploy': [1, 1], 'default': 10},
+            clock=self.clock, sleep=self.clock.sleep)
+
+    def test_per_operation(self):
+        self.assertEqual(self.limiter.reserve('deploy'), 0)
+        self.assertEqual(self.limiter.reserve('deploy'), 1)
+        # other operations have buckets of their own
+        self.assertEqual(self.limiter.reserve('expose'), 0)
+        self.assertEqual(self.limiter.reserve('add_units'), 0)
+        self.assertEqual(self.limiter.buckets['expose'].rate, 10)
+
+    def test_unlimited(self):
+        limiter = ratelimit.RateLimiter({'deploy': 1})
+        self.assertEqual([limiter.reserve('expose') for i in range(50)],
+                         [0] * 50)
+
+    def test_wait_queues(self):
+        before = ratelimit.DELAYED.value(operation='deploy')
+        self.limiter.wait('deploy')
+        self.limiter.wait('deploy')
+        self.assertEqual(self.clock.now, 1001)
+        self.assertEqual(ratelimit.DELAYED.value(operation='deploy'),
+                         before + 1)
+        self.assertEqual(self.limiter.queued['deploy'], 0)
+
+    def test_queued_gauge(self):
+        seen = []
+        self.limiter.sleep = lambda s: seen.append(
+            ratelimit.QUEUED.value(operation='deploy'))
+        self.limiter.wait('deploy')
+        self.limiter.wait('deploy')
+        self.assertEqual(seen, [1])
+        self.assertEqual(ratelimit.QUEUED.value(operation='deploy'), 0)
+
+
+class TestLimitedEnvironment(unittest.TestCase):
+    def test_calls_wait_for_a_token(self):
+        env = mock.Mock()
+        limiter = mock.Mock()
+        limited = ratelimit.LimitedEnvironment(env, limiter)
+        limited.deploy('nats', 'cs:trusty/nats')
+        limiter.wait.assert_called_once_with('deploy')
+        env.deploy.assert_called_once_with('nats', 'cs:trusty/nats')
+        limited.close()
+        self.assertEqual(limiter.wait.call_count, 1)
+
+    def test_state_database(self):
+        db = StateDatabase({'server.repository': 'build',
+                            'juju.environment': 'local',
+                            'credentials.user': 'user-admin',
+                            'credentials.password': 'secret',
+                            'juju.rate_limits': {'deploy': 1}})
+        self.assertIsInstance(db.env, ratelimit.LimitedEnvironment)
+        self.assertEqual(db.env.env.pool, db.pool)
+        db.executor.shutdown()
+
+
+class TestAsyncLimitedEnvironment(AsyncTestCase):
+    @gen_test
+    def test_calls_queue_on_the_ioloop(self):
+        calls = []
+
+        class Env(object):
+            io_loop = self.io_loop
+
+            @gen.coroutine
+            def expose(self, service_name):
+                calls.append((service_name, self.io_loop.time()))
+                raise gen.Return(service_name)
+
+        limiter = ratelimit.RateLimiter({'expose': [20, 1]})
+        limited = ratelimit.AsyncLimitedEnvironment(Env(), limiter)
+        results = yield [limited.expose('a'), limited.expose('b'),
+                         limited.expose('c')]
+        self.assertEqual(results, ['a', 'b', 'c'])
+        self.assertEqual([c[0] for c in calls], ['a', 'b', 'c'])
+        self.assertGreaterEqual(calls[2][1] - calls[0][1], 0.09)
@@ -0,0 +1,238 @@
+import collections
+import json
+import mock
+
+import tornado.httpclient
+import tornado.testing
+import tornado.websocket
+from tornado import gen
+
+from cloudfoundry import actions
+from cloudfoundry import events
+from cloudfoundry import model
+from cloudfoundry import reconciler
+from cloudfoundry import utils
+from cloudfoundry.config import COMPLETE, FAILED
+
+
+class TestHandlers(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        super(TestHandlers, self).setUp()
+        self.db_patch = mock.patch.object(reconciler, 'db')
+        self.db = self.db_patch.start()
+        self.bus_patch = mock.patch.object(events, 'bus', events.EventBus())
+        self.bus = self.bus_patch.start()
+        self.debouncer_patch = mock.patch.object(reconciler, 'debouncer')
+        self.debouncer = self.debouncer_patch.start()
+
+    def tearDown(self):
+        self.debouncer_patch.stop()
+        self.bus_patch.stop()
+        self.db_patch.stop()
+        super(TestHandlers, self).tearDown()
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/api/v1/", reconciler.StateHandler),
+            (r"/api/v1/services/([^/]+)", reconciler.ServiceHandler),
+            (r"/api/v1/strategy", reconciler.StrategyHandler),
+            (r"/api/v1/strategy/eta", reconciler.StrategyETAHandler),
+            (r"/api/v1/history", reconciler.HistoryHandler),
+            (r"/api/v1/metrics", reconciler.MetricsHandler),
+            (r"/api/v1/events", reconciler.EventsHandler),
+            (r"/api/v1/events/poll", reconciler.EventsPollHandler),
+        ], allowed_origins=['http://dashboard.example.com'])
+
+    def test_patch(self):
+        self.db.expected = {'services': {}}
+        ops = [{'op': 'add', 'path': '/services/nats', 'value': {}}]
+        response = self.fetch('/api/v1/', method='PATCH',
+                              body=json.dumps(ops))
+        self.assertEqual(response.code, 200)
+        self.db.patch.assert_called_once_with(ops)
+        self.assertEqual(self.debouncer.trigger.call_count, 1)
+
+        self.db.patch.side_effect = utils.PatchError('Test failed')
+        response = self.fetch('/api/v1/', method='PATCH',
+                              body=json.dumps(ops))
+        self.assertEqual(response.code, 400)
+        response = self.fetch('/api/v1/', method='PATCH', body='{')
+        self.assertEqual(response.code, 400)
+
+    def test_service(self):
+        self.db.expected = {'services': {'nats': {'num_units': 2}}}
+        response = self.fetch('/api/v1/services/nats')
+        self.assertEqual(json.loads(response.body), {'num_units': 2})
+        self.assertEqual(self.fetch('/api/v1/services/uaa').code, 404)
+
+        response = self.fetch('/api/v1/services/uaa', method='PUT',
+                              body='{"charm": "uaa-v1"}')
+        self.assertEqual(response.code, 200)
+        self.db.put_service.assert_called_once_with('uaa',
+                                                    {'charm': 'uaa-v1'})
+        response = self.fetch('/api/v1/services/uaa', method='PUT',
+                              body='[]')
+        self.assertEqual(response.code, 400)
+
+        self.assertEqual(self.fetch('/api/v1/services/nats',
+                                    method='DELETE').code, 200)
+        self.db.delete_service.assert_called_once_with('nats')
+        self.db.delete_service.side_effect = KeyError('nats')
+        self.assertEqual(self.fetch('/api/v1/services/nats',
+                                    method='DELETE').code, 404)
+
+    def test_strategy(self):
+        strategy = model.Strategy(None)
+        strategy.id = 3
+        strategy.append(actions.AddUnitsTactic(service_name='nats',
+                                               num_units=1))
+        self.db.strategy = strategy
+        data = json.loads(self.fetch('/api/v1/strategy').body)
+        self.assertEqual(data, [str(strategy[0])])
+
+        data = json.loads(self.fetch('/api/v1/strategy/eta').body)
+        self.assertEqual(data['id'], 3)
+        self.assertEqual(data['state'], 'PENDING')
+        self.assertIsNone(data['eta'])
+
+        strategy.estimate = lambda t: 42
+        data = json.loads(self.fetch('/api/v1/strategy/eta').body)
+        self.assertEqual(data['eta'], 42)
+        self.assertTrue(data['eta_time'] > 42)
+
+    def test_history(self):
+        self.db.history = collections.deque(
+            model.StrategySummary(i, FAILED if i == 3 else COMPLETE,
+                                  1.0, 2.0, ())
+            for i in range(1, 6))
+        response = self.fetch('/api/v1/history?offset=1&limit=2')
+        data = json.loads(response.body)
+        self.assertEqual(data['total'], 5)
+        self.assertEqual([s['id'] for s in data['strategies']], [4, 3])
+        self.assertEqual(data['strategies'][1]['state'], 'FAILED')
+        for query in ('offset=x', 'limit=1.5', 'offset=-1', 'limit=-2'):
+            self.assertEqual(
+                self.fetch('/api/v1/history?' + query).code, 400)
+
+    def test_metrics(self):
+        self.db.strategy.pending = [1, 2, 3]
+        model.TACTIC_FAILURES.inc(tactic='DeployTactic')
+        response = self.fetch('/api/v1/metrics')
+        self.assertTrue(response.headers['Content-Type'].startswith(
+            'text/plain'))
+        self.assertIn('reconciler_strategy_queue_depth 3.0', response.body)
+        self.assertIn('reconciler_tactic_failures_total{'
+                      'tactic="DeployTactic"}', response.body)
+        self.assertIn('# TYPE reconciler_pass_duration_seconds histogram',
+                      response.body)
+
+    def test_events_poll(self):
+        self.bus.publish('tactic', index=0)
+        data = json.loads(self.fetch('/api/v1/events/poll?since=0').body)
+        self.assertEqual(data['seq'], 1)
+        self.assertEqual([e['index'] for e in data['events']], [0])
+
+        self.io_loop.add_timeout(self.io_loop.time() + 0.05,
+                                 lambda: self.bus.publish('tactic', index=1))
+        data = json.loads(self.fetch('/api/v1/events/poll?since=1').body)
+        self.assertEqual([e['index'] for e in data['events']], [1])
+
+        data = json.loads(self.fetch(
+            '/api/v1/events/poll?since=2&timeout=0.01').body)
+        self.assertEqual(data['events'], [])
+        self.assertEqual(self.bus.listeners, set())
+
+    def test_events_poll_bad_arguments(self):
+        for query in ['since=x', 'since=-1', 'timeout=y', 'timeout=-1',
+                      'timeout=nan', 'timeout=inf']:
+            response = self.fetch('/api/v1/events/poll?' + query)
+            self.assertEqual(response.code, 400, query)
+        self.assertEqual(self.bus.listeners, set())
+
+    @tornado.testing.gen_test
+    def test_events_websocket(self):
+        self.bus.publish('tactic', index=0)
+        self.bus.publish('tactic', index=1)
+        conn = yield tornado.websocket.websocket_connect(
+            'ws://localhost:%d/api/v1/events?since=1' % self.get_http_port(),
+            io_loop=self.io_loop)
+        message = yield conn.read_message()
+        self.assertEqual(json.loads(message)['index'], 1)
+        self.bus.publish('deltas', deltas=[['unit', 'remove', {}]])
+        message = yield conn.read_message()
+        self.assertEqual(json.loads(message)['type'], 'deltas')
+        conn.close()
+
+    @tornado.testing.gen_test
+    def test_events_websocket_origin(self):
+        url = 'ws://localhost:%d/api/v1/events' % self.get_http_port()
+        for origin, allowed in [
+                ('http://localhost:%d' % self.get_http_port(), True),
+                ('http://dashboard.example.com', True),
+                ('http://evil.example.com', False)]:
+            request = tornado.httpclient.HTTPRequest(
+                url, headers={'Origin': origin})
+            if allowed:
+                conn = yield tornado.websocket.websocket_connect(
+                    request, io_loop=self.io_loop)
+                conn.close()
+            else:
+                with self.assertRaises(tornado.httpclient.HTTPError) as cm:
+                    yield tornado.websocket.websocket_connect(
+                        request, io_loop=self.io_loop)
+                self.assertEqual(cm.exception.code, 403)
+
+    @tornado.testing.gen_test
+    def test_events_websocket_bad_since(self):
+        url = 'ws://localhost:%d/api/v1/events?since=x' % self.get_http_port()
+        with self.assertRaises(tornado.httpclient.HTTPError) as cm:
+            yield tornado.websocket.websocket_connect(url, io_loop=self.io_loop)
+        self.assertEqual(cm.exception.code, 400)
+
+
+class TestReconcile(tornado.testing.AsyncTestCase):
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+        self.db_patch = mock.patch.object(reconciler, 'db')
+        self.db = self.db_patch.start()
+        self.db.strategy = []
+        self.db.fetch_real.return_value = gen.maybe_future({})
+        self.debouncer_patch = mock.patch.object(reconciler, 'debouncer')
+        self.debouncer = self.debouncer_patch.start()
+
+    def tearDown(self):
+        self.debouncer_patch.stop()
+        self.db_patch.stop()
+        super(TestReconcile, self).tearDown()
+
+    @tornado.testing.gen_test
+    def test_replans_when_outdated(self):
+        self.db.outdated = False
+        yield reconciler.reconcile()
+        self.db.build_strategy.assert_called_once_with({})
+        self.assertFalse(self.debouncer.trigger.called)
+
+        # a push landed while status was fetched
+        self.db.outdated = True
+        yield reconciler.reconcile()
+        self.assertEqual(self.debouncer.trigger.call_count, 1)
+
+    @tornado.testing.gen_test
+    def test_preempts_stale_strategy(self):
+        self.db.strategy = [mock.Mock()]
+        self.db.stale = False
+        yield reconciler.reconcile()
+        self.assertFalse(self.db.preempt.called)
+        self.db.stale = True
+        yield reconciler.reconcile()
+        self.db.preempt.assert_called_once_with()
+        self.assertFalse(self.db.build_strategy.called)
+
+    def test_on_retired(self):
+        self.db.outdated = False
+        reconciler.on_retired({'type': 'retired'})
+        self.assertFalse(self.debouncer.trigger.called)
+        self.db.outdated = True
+        reconciler.on_retired({'type': 'tactic'})
+        reconciler.on_retired({'type': 'retired'})
+        self.assertEqual(self.debouncer.trigger.call_count, 1)
@@ -0,0 +1,173 @@
+import json
+import socket
+import time
+
+import mock
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+import tornado.websocket
+from jujuclient import EnvError
+from tornado import gen
+
+from cloudfoundry import actions
+from cloudfoundry import model
+from cloudfoundry import rpc
+from cloudfoundry.config import COMPLETE, FAILED
+
+
+class FakeJuju(tornado.websocket.WebSocketHandler):
+    """
+    Answers a batch of `batch` requests at once and in reverse order,
+    so the responses only line up when matched by RequestId.
+    """
+    def initialize(self, server):
+        self.server = server
+        self.held = []
+        self.logged_in = False
+
+    def on_message(self, message):
+        op = json.loads(message)
+        self.server.requests.append(op)
+        if op['Request'] == 'Login':
+            tornado.ioloop.IOLoop.current().add_timeout(
+                time.time() + self.server.login_delay, self.login, op)
+            return
+        if not self.logged_in:
+            self.write_message(json.dumps({
+                'RequestId': op['RequestId'], 'Error': 'not logged in'}))
+            return
+        self.held.append(op)
+        if len(self.held) >= self.server.batch:
+            held, self.held = self.held, []
+            for op in reversed(held):
+                if op['Request'] == 'Fail':
+                    # like juju, hang up after an error
+                    self.write_message(json.dumps({
+                        'RequestId': op['RequestId'], 'Error': 'boom'}))
+                    self.close()
+                    break
+                self.reply(op, {'Echo': op['Params']})
+
+    def login(self, op):
+        self.logged_in = True
+        self.reply(op, {})
+
+    def reply(self, op, response):
+        self.write_message(json.dumps({
+            'RequestId': op['RequestId'], 'Response': response}))
+
+
+class TestAsyncEnvironment(tornado.testing.AsyncHTTPTestCase):
+    def setUp(self):
+        self.requests = []
+        self.batch = 1
+        self.login_delay = 0
+        super(TestAsyncEnvironment, self).setUp()
+        self.env = rpc.AsyncEnvironment(
+            'ws://localhost:%d/' % self.get_http_port(),
+            password='secret', timeout=1, io_loop=self.io_loop)
+
+    def get_app(self):
+        return tornado.web.Application([(r'/', FakeJuju, {'server': self})])
+
+    @tornado.testing.gen_test
+    def test_login(self):
+        result = yield self.env.expose('nats')
+        self.assertEqual(result, {'Echo': {'ServiceName': 'nats'}})
+        login, expose = self.requests
+        self.assertEqual(login['Params'], {'AuthTag': 'user-admin',
+                                           'Password': 'secret'})
+        self.assertEqual(expose['Request'], 'ServiceExpose')
+
+    @tornado.testing.gen_test
+    def test_call_during_login(self):
+        self.login_delay = 0.1
+        connecting = self.env.connect()
+        while not self.requests:
+            yield gen.Task(self.io_loop.add_timeout, time.time() + 0.01)
+        # the socket is up, the Login reply is not
+        self.assertIsNotNone(self.env.conn)
+        self.assertFalse(connecting.done())
+        result = yield self.env.expose('nats')
+        self.assertEqual(result, {'Echo': {'ServiceName': 'nats'}})
+        self.assertEqual([r['Request'] for r in self.requests],
+                         ['Login', 'ServiceExpose'])
+
+    @tornado.testing.gen_test
+    def test_pipelined(self):
+        self.batch = 3
+        results = yield [self.env.add_relation('a', 'b'),
+                         self.env.add_units('nats', 2),
+                         self.env.deploy('uaa', 'local:trusty/uaa-1',
+                                         config={'port': 80},
+                                         constraints={'mem': '2048'})]
+        self.assertEqual(results[0]['Echo']['Endpoints'], ['a', 'b'])
+        self.assertEqual(results[1]['Echo']['NumUnits'], 2)
+        self.assertEqual(results[2]['Echo']['Config'], {'port': '80'})
+        self.assertEqual(results[2]['Echo']['Constraints'], {'mem': 2048})
+        # one login, all three requests went out before any answer
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(self.env.pending, 0)
+
+    @tornado.testing.gen_test
+    def test_error_reconnects(self):
+        self.batch = 2
+        waiting = self.env.expose('nats')
+        with self.assertRaises(EnvError):
+            yield self.env.rpc({'Type': 'Client', 'Request': 'Fail'})
+        with self.assertRaises(rpc.ConnectionClosed):
+            yield waiting
+        self.batch = 1
+        result = yield self.env.unexpose('nats')
+        self.assertEqual(result, {'Echo': {'ServiceName': 'nats'}})
+        self.assertEqual([r['Request'] for r in self.requests].count(
+            'Login'), 2)
+
+    @tornado.testing.gen_test
+    def test_timeout(self):
+        self.batch = 2
+        with self.assertRaises(gen.TimeoutError):
+            yield self.env.expose('nats')
+        self.assertEqual(self.env.pending, 0)
+
+
+class TestPipelinedTactics(tornado.testing.AsyncTestCase):
+    @mock.patch('cloudfoundry.actions.get_qualified_charm_url')
+    @tornado.testing.gen_test
+    def test_run_async(self, qualify):
+        env = mock.Mock()
+        env.expose.return_value = gen.maybe_future(None)
+        env.deploy.return_value = gen.maybe_future(None)
+        resolve = actions.UpdateCharmTactic(charm_url='cs:trusty/mysql')
+        resolve.charm_url = 'cs:trusty/mysql-7'
+        tactic = actions.DeployTactic(depends=[resolve], service={
+            'service_name': 'mysql', 'charm': 'cs:trusty/mysql',
+            'expose': True}, repo='build')
+        self.assertTrue(tactic.pipelined)
+        yield tactic.run_async(env)
+        # the store was asked by the tactic it depends on, not here
+        self.assertFalse(qualify.called)
+        self.assertEqual(tactic.state, COMPLETE)
+        self.assertEqual(env.deploy.call_args[0][:2],
+                         ('mysql', 'cs:trusty/mysql-7'))
+        env.expose.assert_called_once_with('mysql')
+
+    @tornado.testing.gen_test
+    def test_strategy(self):
+        env = mock.Mock()
+        future = gen.Future()
+        future.set_exception(socket.error('closed'))
+        env.add_relation.return_value = future
+        s = model.Strategy(mock.Mock(), width=2)
+        s.async_env = env
+        relate = actions.AddRelationTactic(endpoint_a='a:db',
+                                           endpoint_b='b:db')
+        relate.retry = actions.NO_RETRY
+        generate = actions.GenerateTactic(repo='build')
+        self.assertFalse(generate.pipelined)
+        s.append(relate)
+        yield s()
+        self.assertEqual(relate.state, FAILED)
+        env.add_relation.assert_called_once_with('a:db', 'b:db')
+        self.assertFalse(s.env.add_relation.called)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+import mock
+
+from charmgen import runtime
+from charmgen.generator import CharmGenerator, main
+from tests.release1 import RELEASES, SERVICES
+
+
+class SlimTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.build = os.path.join(self.tmpdir, 'build')
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        g.generate(self.build, slim=True)
+        self.runtime_dir = os.path.join(self.build, runtime.RUNTIME)
+        self.tarball, = [os.path.join(self.runtime_dir, name)
+                         for name in os.listdir(self.runtime_dir)]
+        self.charm = os.path.join(self.build, 'trusty', 'router_v1')
+
+
+class TestSlimCharms(SlimTest):
+    def test_charm_contents(self):
+        self.assertEqual(sorted(os.listdir(self.charm)),
+                         ['hooks', 'icon.svg', 'metadata.yaml'])
+        hooks = os.listdir(os.path.join(self.charm, 'hooks'))
+        self.assertFalse([h for h in hooks
+                          if os.path.isdir(os.path.join(self.charm, 'hooks',
+                                                        h))])
+        with open(os.path.join(self.charm, 'hooks', 'entry.py')) as fp:
+            entry = fp.read()
+        compile(entry, 'entry.py', 'exec')
+        self.assertIn("NAME = 'router_v1'", entry)
+        self.assertIn(os.path.basename(self.tarball), entry)
+
+    def test_runtime_contents(self):
+        with tarfile.open(self.tarball) as tgz:
+            members = tgz.getmembers()
+        names = [m.name for m in members]
+        for name in ('cloudfoundry/jobs.py', 'charmhelpers/core/hookenv.py',
+                     'files/bosh-template-1.2611.0.pre.gem'):
+            self.assertIn(name, names)
+        self.assertFalse([n for n in names if n.endswith('.pyc')])
+        self.assertEqual(set(m.mtime for m in members), set([0]))
+
+    def test_reproducible(self):
+        other = os.path.join(self.tmpdir, 'other')
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        g.generate(other, slim=True)
+        self.assertEqual(os.listdir(os.path.join(other, runtime.RUNTIME)),
+                         [os.path.basename(self.tarball)])
+
+    def test_replaces_older_runtime(self):
+        tarball = runtime.make_runtime([(self.charm, 'charm')],
+                                       self.runtime_dir)
+        self.assertNotEqual(tarball, self.tarball)
+        self.assertEqual(os.listdir(self.runtime_dir),
+                         [os.path.basename(tarball)])
+
+    def test_switch_modes(self):
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        self.assertEqual(g.generate(self.build, slim=True), [])
+        self.assertEqual(len(g.generate(self.build)), 3)
+        self.assertTrue(os.path.isdir(os.path.join(
+            self.charm, 'hooks', 'cloudfoundry')))
+        self.assertFalse(os.path.exists(self.runtime_dir))
+
+    def test_main(self):
+        target = os.path.join(self.tmpdir, 'main')
+        main(['-d', target, '--slim', '173'])
+        self.assertEqual(os.listdir(os.path.join(target, runtime.RUNTIME)),
+                         [os.path.basename(self.tarball)])
+
+
+class TestBootstrap(SlimTest):
+    def setUp(self):
+        super(TestBootstrap, self).setUp()
+        with open(os.path.join(self.charm, 'hooks', 'entry.py')) as fp:
+            self.bootstrap = {'__name__': 'bootstrap'}
+            exec fp.read() in self.bootstrap
+        self.bootstrap['CACHE'] = os.path.join(self.tmpdir, 'cache')
+        self.relation = {
+            ('relation-ids', 'orchestrator'): 'orchestrator:1\n',
+            ('relation-list', '-r', 'orchestrator:1'): 'cloudfoundry/0\n',
+            ('relation-get', '-r', 'orchestrator:1', 'artifacts_url',
+             'cloudfoundry/0'): 'http://10.0.0.1:8019\n',
+        }
+        patcher = mock.patch('subprocess.check_output',
+                             lambda cmd: self.relation.get(tuple(cmd), ''))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('subprocess.call')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wget(self, cmd):
+        self.urls.append(cmd[-3])
+        shutil.copyfile(self.tarball, cmd[-1])
+
+    @mock.patch('subprocess.check_call')
+    def test_fetch_caches(self, check_call):
+        self.urls = []
+        check_call.side_effect = self.wget
+        target = self.bootstrap['fetch']()
+        self.assertTrue(os.path.isfile(os.path.join(
+            target, 'cloudfoundry', 'jobs.py')))
+        self.assertEqual(self.bootstrap['fetch'](), target)
+        self.assertEqual(self.urls, ['http://10.0.0.1:8019/runtime/' +
+                                     os.path.basename(self.tarball)])
+        self.assertEqual(os.listdir(self.bootstrap['CACHE']),
+                         [os.path.basename(target)])
+
+    @mock.patch('subprocess.check_call')
+    def test_checksum_mismatch(self, check_call):
+        def corrupt(cmd):
+            with open(cmd[-1], 'w') as fp:
+                fp.write('not the runtime')
+        check_call.side_effect = corrupt
+        self.assertRaises(IOError, self.bootstrap['fetch'])
+        self.assertEqual(os.listdir(self.bootstrap['CACHE']), [])
+
+    @mock.patch('subprocess.check_call')
+    def test_deferred_until_related(self, check_call):
+        self.relation.clear()
+        self.assertIsNone(self.bootstrap['fetch']())
+        self.assertFalse(check_call.called)
@@ -0,0 +1,89 @@
+import json
+import pkg_resources
+import unittest
+
+from cloudfoundry import status
+from cloudfoundry.utils import flatten_relations
+
+
+def load_status():
+    return json.loads(pkg_resources.resource_string(__name__, 'status.json'))
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = status.Snapshot.parse(load_status())
+
+    def test_parse(self):
+        nats = self.snapshot.services['nats']
+        self.assertEqual(nats.charm, 'local:trusty/nats-v1-0')
+        self.assertFalse(nats.exposed)
+        self.assertEqual([u.name for u in nats.units], ['nats/0'])
+        unit = self.snapshot.units['nats/0']
+        self.assertIs(unit, nats.units[0])
+        self.assertEqual((unit.service, unit.number, unit.machine),
+                         ('nats', 0, '6'))
+        relation, = nats.relations
+        self.assertEqual((relation.endpoint, relation.remotes),
+                         ('nats:nats', ('router',)))
+
+    def test_slotted_and_interned(self):
+        nats = self.snapshot.services['nats']
+        self.assertFalse(hasattr(nats, '__dict__'))
+        self.assertFalse(hasattr(nats.units[0], '__dict__'))
+        self.assertFalse(hasattr(nats.relations[0], '__dict__'))
+        self.assertIs(nats.units[0].service, nats.name)
+        router = self.snapshot.services['router']
+        self.assertIs(router.relations[0].remotes[0], nats.name)
+        found, = [pair for pair in self.snapshot.relation_index.pairs
+                  if pair[0] == 'nats:nats']
+        self.assertIs(found[0], status.endpoint('nats', 'nats'))
+
+    def test_alive_units(self):
+        service = status.Service('web', units=[
+            status.Unit('web/10'), status.Unit('web/2', life='dying'),
+            status.Unit('web/1')])
+        self.assertEqual([u.name for u in service.units],
+                         ['web/1', 'web/2', 'web/10'])
+        self.assertEqual([u.name for u in service.alive_units()],
+                         ['web/1', 'web/10'])
+
+    def test_relation_index_once_per_snapshot(self):
+        index = self.snapshot.relation_index
+        self.assertIs(self.snapshot.relation_index, index)
+        self.assertEqual(index.pairs, set([
+            ('etcd:cluster', 'etcd:cluster'),
+            ('mysql:cluster', 'mysql:cluster'),
+            ('nats:nats', 'router:nats')]))
+
+    def test_snapshot(self):
+        self.assertIs(status.snapshot(self.snapshot), self.snapshot)
+        self.assertEqual(status.snapshot({}).services, {})
+        self.assertEqual(
+            status.snapshot(load_status()).services.keys(),
+            self.snapshot.services.keys())
+
+
+class TestRelationIndex(unittest.TestCase):
+    def test_relation_index(self):
+        index = status.RelationIndex(load_status())
+        self.assertEqual(index.pairs, set([
+            ('etcd:cluster', 'etcd:cluster'),
+            ('mysql:cluster', 'mysql:cluster'),
+            ('nats:nats', 'router:nats')]))
+        self.assertIn(('nats', 'router:nats'), index)
+        self.assertIn(('router:nats', 'nats'), index)
+        self.assertIn(('nats', 'router'), index)
+        self.assertIn(('nats:nats', 'router:nats'), index)
+        self.assertNotIn(('nats:other', 'router:nats'), index)
+        self.assertNotIn(('nats', 'rabbitmq'), index)
+
+    def test_relation_index_diff(self):
+        index = status.RelationIndex(load_status())
+        adds, removes = index.diff(flatten_relations([
+            ['nats', ['router:nats']],
+            ['uaa:db', 'mysql:db']]))
+        self.assertEqual(adds, set([('mysql:db', 'uaa:db')]))
+        self.assertEqual(removes, set([
+            ('etcd:cluster', 'etcd:cluster'),
+            ('mysql:cluster', 'mysql:cluster')]))
@@ -0,0 +1,104 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from charmgen.generator import CharmGenerator
+from charmgen.store import ContentStore
+from tests.release1 import RELEASES, SERVICES
+
+
+class TestContentStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.store = ContentStore(os.path.join(self.tmpdir, 'store'))
+        self.src = os.path.join(self.tmpdir, 'src')
+        os.makedirs(os.path.join(self.src, 'pkg'))
+        self.write('a.py', 'same')
+        self.write('pkg/b.py', 'same')
+        self.write('pkg/b.pyc', 'compiled')
+        self.write('run', 'other', 0755)
+
+    def write(self, name, content, mode=0644):
+        fn = os.path.join(self.src, name)
+        with open(fn, 'w') as fp:
+            fp.write(content)
+        os.chmod(fn, mode)
+
+    def test_add_tree(self):
+        entries = self.store.add_tree(self.src)
+        self.assertEqual([e[:2] for e in entries], [
+            ('f', 'a.py'), ('f', 'run'), ('d', 'pkg'), ('f', 'pkg/b.py')])
+        # identical contents are stored once
+        self.assertEqual(entries[0][2], entries[3][2])
+        self.assertTrue(entries[1][2].endswith('.x'))
+
+    def test_materialize_links(self):
+        entries = self.store.add_tree(self.src)
+        for name in ('one', 'two'):
+            self.store.materialize(entries, os.path.join(self.tmpdir, name))
+        one = os.stat(os.path.join(self.tmpdir, 'one', 'pkg', 'b.py'))
+        two = os.stat(os.path.join(self.tmpdir, 'two', 'a.py'))
+        self.assertEqual(one.st_ino, two.st_ino)
+        self.assertTrue(os.access(
+            os.path.join(self.tmpdir, 'two', 'run'), os.X_OK))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tmpdir, 'one', 'pkg', 'b.pyc')))
+
+    @mock.patch('os.link')
+    def test_place_falls_back(self, link):
+        link.side_effect = OSError(errno.EXDEV, 'cross-device link')
+        obj = self.store.add(os.path.join(self.src, 'run'))
+        dest = os.path.join(self.tmpdir, 'placed')
+        with mock.patch('charmgen.store.reflink') as reflink:
+            self.assertEqual(self.store.place(obj, dest), 'reflink')
+            reflink.assert_called_once_with(obj, dest)
+        with mock.patch('fcntl.ioctl') as ioctl:
+            ioctl.side_effect = IOError(errno.EOPNOTSUPP, 'not supported')
+            self.assertEqual(self.store.place(obj, dest), 'copy')
+        with open(dest) as fp:
+            self.assertEqual(fp.read(), 'other')
+        self.assertTrue(os.access(dest, os.X_OK))
+
+    @mock.patch('os.link')
+    def test_gc_after_copies(self, link):
+        link.side_effect = OSError(errno.EMLINK, 'too many links')
+        entries = self.store.add_tree(self.src)
+        target = os.path.join(self.tmpdir, 'charm')
+        with mock.patch('fcntl.ioctl') as ioctl:
+            ioctl.side_effect = IOError(errno.EOPNOTSUPP, 'not supported')
+            self.store.materialize(entries, target)
+        self.assertFalse(self.store.linked)
+        # every object has a single link, but the charm uses them all
+        self.assertEqual(self.store.gc(), 0)
+        self.assertTrue(all(os.path.exists(e[2]) for e in entries
+                            if e[0] == 'f'))
+
+    def test_gc(self):
+        entries = self.store.add_tree(self.src)
+        target = os.path.join(self.tmpdir, 'charm')
+        self.store.materialize(entries, target)
+        self.assertTrue(self.store.linked)
+        self.assertEqual(self.store.gc(), 0)
+        os.unlink(os.path.join(target, 'run'))
+        self.assertEqual(self.store.gc(), 1)
+        self.assertFalse(os.path.exists(entries[1][2]))
+
+
+class TestGeneratedCharms(unittest.TestCase):
+    def test_charms_share_files(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        g = CharmGenerator(RELEASES, SERVICES)
+        g.select_release(173)
+        g.generate(tmpdir)
+        inodes = set(
+            os.stat(os.path.join(tmpdir, 'trusty', charm, 'hooks',
+                                 'cloudfoundry', 'utils.py')).st_ino
+            for charm in ('cloud_controller_v1', 'router_v1'))
+        self.assertEqual(len(inodes), 1)
+        self.assertTrue(os.path.isdir(os.path.join(tmpdir, '.store')))
@@ -46,6 +46,11 @@ class TestTasks(unittest.TestCase):
                        'charm_dir/files/' +
                        'bosh-template-1.2611.0.pre.gem'])])
 
+    def test_runtime_dir(self):
+        self.assertEqual(tasks.runtime_dir(), 'charm_dir')
+        with mock.patch.dict('os.environ', {'CF_RUNTIME_DIR': '/runtime'}):
+            self.assertEqual(tasks.runtime_dir(), '/runtime')
+
 
     #@mock.patch('charmhelpers.core.hookenv.log')
     #@mock.patch('cloudfoundry.utils.modprobe')
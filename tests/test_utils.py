@@ -44,6 +44,41 @@ class TestUtils(unittest.TestCase):
 
         self.assertFalse(utils.rel_exists(data, 'nats', 'rabbitmq'))
 
+    def test_remove_service_relations(self):
+        rels = [['uaa:db', ['mysql:db']],
+                ['nats:nats', ['router:nats', 'uaa:nats']],
+                ['cc', 'uaa']]
+        self.assertEqual(utils.remove_service_relations(rels, 'uaa'),
+                         [['nats:nats', ['router:nats']]])
+
+    def test_json_patch(self):
+        doc = {'services': {'nats': {'num_units': 1}},
+               'relations': [['a', 'b']]}
+        patched = utils.json_patch(doc, [
+            {'op': 'test', 'path': '/services/nats/num_units', 'value': 1},
+            {'op': 'replace', 'path': '/services/nats/num_units',
+             'value': 3},
+            {'op': 'add', 'path': '/services/a~1b', 'value': {}},
+            {'op': 'copy', 'from': '/relations/0', 'path': '/relations/-'},
+            {'op': 'move', 'from': '/services/a~1b', 'path': '/services/c'},
+            {'op': 'remove', 'path': '/relations/0'},
+        ])
+        self.assertEqual(patched, {'services': {'nats': {'num_units': 3},
+                                                'c': {}},
+                                   'relations': [['a', 'b']]})
+        # the original is left alone
+        self.assertEqual(doc['services'], {'nats': {'num_units': 1}})
+
+    def test_json_patch_errors(self):
+        doc = {'services': {'nats': {}}}
+        for ops in ([{'op': 'test', 'path': '/services', 'value': {}}],
+                    [{'op': 'remove', 'path': '/services/router'}],
+                    [{'op': 'replace', 'path': '', 'value': {}}],
+                    [{'op': 'add', 'path': 'services', 'value': {}}],
+                    [{'op': 'frob', 'path': '/services'}],
+                    [{'path': '/services'}]):
+            self.assertRaises(utils.PatchError, utils.json_patch, doc, ops)
+
     def test_deep_merge(self):
         initial = {'properties': {'job1': {'prop1': 'val1'}, 'job2': None}}
         additional = {'properties': {'job1': {'prop2': 'val2'}, 'job2': {'prop3': 'val3'}}}
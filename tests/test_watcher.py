@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+import mock
+
+from cloudfoundry.watcher import EnvironmentWatcher
+
+
+class TestEnvironmentWatcher(unittest.TestCase):
+    def test_own_connection(self):
+        io_loop = mock.Mock()
+        done = threading.Event()
+        env = mock.Mock()
+
+        def deltas():
+            yield [['service', 'change', {}]]
+            yield [['unit', 'change', {}]]
+            watcher.running = False
+            done.set()
+            yield []
+        env.get_watch.return_value = deltas()
+        connect = mock.Mock(return_value=env)
+        watcher = EnvironmentWatcher(connect, 'callback', io_loop=io_loop)
+        watcher.start()
+        self.assertTrue(done.wait(5))
+        watcher.join(5)
+        connect.assert_called_once_with()
+        env.get_watch.assert_called_once_with(connection=env)
+        self.assertEqual(
+            [c[0][2] for c in io_loop.add_callback.call_args_list],
+            [True, False])
+        env.close.assert_called_once_with()
+
+    def test_reconnects(self):
+        envs = []
+        done = threading.Event()
+
+        def connect():
+            env = mock.Mock()
+            envs.append(env)
+            if len(envs) == 1:
+                env.get_watch.side_effect = IOError('connection lost')
+            else:
+                watcher.running = False
+                done.set()
+                env.get_watch.return_value = iter([])
+            return env
+        watcher = EnvironmentWatcher(connect, mock.Mock(),
+                                     io_loop=mock.Mock(), retry_interval=0)
+        watcher.start()
+        self.assertTrue(done.wait(5))
+        watcher.join(5)
+        self.assertEqual(len(envs), 2)
+        # the failed connection is not left open
+        envs[0].close.assert_called_once_with()
+